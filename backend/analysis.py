@@ -2,6 +2,8 @@ import pandas as pd
 import json
 import os
 from llm_processor import LLMProcessor
+from llm_preview import normalize_platforms
+from llm_sampling import estimate_distribution
 
 def perform_analysis(csv_path, topic, df=None, timings=None):
     """
@@ -36,9 +38,18 @@ def perform_analysis(csv_path, topic, df=None, timings=None):
     if 'sentiment_llm' not in df.columns:
         return {"error": "Column 'sentiment_llm' missing. Run LLM phase first."}
 
+    # Filas sin clasificar (fallos del LLM tras reintentos) no cuentan en las distribuciones
+    invalid_mask = df['sentiment_llm'].isin(["Error", "N/A"])
+    # En modo muestreo las filas no muestreadas tampoco cuentan, pero no son fallos
+    sampled_mask = df['sampled'].astype(bool) if 'sampled' in df.columns else pd.Series(True, index=df.index)
+    # Las filas de relleno descartadas por el triaje tampoco son fallos
+    triaged_mask = df['triage'].fillna("").astype(str).ne("") if 'triage' in df.columns else pd.Series(False, index=df.index)
+    error_count = int((invalid_mask & sampled_mask & ~triaged_mask).sum())
+    classified = df[~invalid_mask]
+
     # 1. Estadísticas Globales
-    global_counts = df['sentiment_llm'].value_counts().to_dict()
-    total = len(df)
+    global_counts = classified['sentiment_llm'].value_counts().to_dict()
+    total = len(classified)
     global_stats = {k: int(v) for k,v in global_counts.items()}
     global_percents = {k: f"{(v/total)*100:.1f}%" for k,v in global_stats.items()}
 
@@ -48,12 +59,31 @@ def perform_analysis(csv_path, topic, df=None, timings=None):
         # Normalizar nombres de plataforma
         df['platform_norm'] = df['platform'].astype(str).str.lower().str.strip()
         
-        platforms = df['platform_norm'].unique()
+        classified = df[~invalid_mask]
+        platforms = classified['platform_norm'].unique()
         for p in platforms:
-            sub = df[df['platform_norm'] == p]
+            sub = classified[classified['platform_norm'] == p]
             counts = sub['sentiment_llm'].value_counts().to_dict()
             by_platform[p] = {k: int(v) for k,v in counts.items()}
 
+    # 2b. Casi-duplicados (copy-paste): cada grupo cuenta una sola vez en 'unique_voice_counts'
+    near_duplicates = None
+    if 'near_dup_size' in classified.columns:
+        sizes = pd.to_numeric(classified['near_dup_size'], errors='coerce').fillna(1).clip(lower=1)
+        unique_voices = (1 / sizes).groupby(classified['sentiment_llm']).sum().round().astype(int).to_dict()
+        near_duplicates = {
+            "rows_in_clusters": int((sizes > 1).sum()),
+            "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+            "unique_voice_counts": {k: int(v) for k, v in unique_voices.items()},
+        }
+
+    # 2c. Modo muestreo: porcentajes estimados (estratificados por plataforma) con intervalos de confianza
+    sampling = None
+    if 'sampled' in df.columns and not sampled_mask.all():
+        labels = df['sentiment_llm'].where(sampled_mask & ~invalid_mask, None).tolist()
+        sampling = estimate_distribution(normalize_platforms(df), labels)
+        global_percents = sampling["global_percents"]
+
     # 3. Ejemplos (para contexto del LLM)
     # Tomamos muestras aleatorias de comentarios positivos/negativos
     pos_examples = df[df['sentiment_llm'].str.lower().str.contains("positivo", na=False)]['post_content'].dropna().head(3).tolist()
@@ -64,14 +94,23 @@ def perform_analysis(csv_path, topic, df=None, timings=None):
         "global_counts": global_stats,
         "global_percents": global_percents,
         "by_platform": by_platform,
+        "unclassified": error_count,
+        "triaged": {k: int(v) for k, v in df.loc[triaged_mask, 'triage'].value_counts().items()},
+        "near_duplicates": near_duplicates,
+        "sampling": sampling,
         "examples_positive": pos_examples,
         "examples_negative": neg_examples
     }
 
-    # 4. Generar Storytelling
+    # 4. Generar Storytelling (memoizado por stats + tema; en streaming hacia la colección story_streams)
     print(f"[Analysis] Generando narrativa para: {topic}...")
+    try:
+        from database import Database
+        story_db = Database()
+    except Exception:
+        story_db = None
     processor = LLMProcessor()
-    story = processor.generate_storytelling(topic, stats_package)
+    story = processor.generate_storytelling(topic, stats_package, db=story_db)
 
     # 5. Estructura Final para el Frontend
     
@@ -98,7 +137,7 @@ def perform_analysis(csv_path, topic, df=None, timings=None):
 
     final_output = {
         "topic": topic,
-        "total_posts": total,
+        "total_posts": len(df),
         "stats": stats_package,
         "storytelling": story,
         "timings": timings, # Duraciones de ejecución
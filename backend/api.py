@@ -1,9 +1,11 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 import os
 import json
+import time
 import uvicorn
 from main_parallel import run_pipeline
 
@@ -27,6 +29,8 @@ def read_root():
 class ScrapeRequest(BaseModel):
     topic: str
     limit: int = 10
+    sample: bool = False # Clasificar una muestra estratificada en lugar de todo el corpus
+    margin: Optional[float] = None # Margen de error objetivo del muestreo (p.ej. 0.03 = ±3%)
 
 @app.post("/scrape")
 async def start_scrape(req: ScrapeRequest, background_tasks: BackgroundTasks):
@@ -39,7 +43,7 @@ async def start_scrape(req: ScrapeRequest, background_tasks: BackgroundTasks):
     print(f"[API] Recibida petición para tema: {req.topic}")
     
     # Ejecutamos en background para no bloquear la respuesta inmediata
-    background_tasks.add_task(run_pipeline, req.topic, req.limit)
+    background_tasks.add_task(run_pipeline, req.topic, req.limit, req.sample, req.margin)
     
     return {
         "status": "processing", 
@@ -132,6 +136,114 @@ def delete_history_item(topic: str):
         print(f"[API Error] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/story/{topic}")
+def get_story(topic: str):
+    """Storytelling de un tema tal y como va (texto parcial mientras se genera)."""
+    try:
+        from database import Database
+        db = Database()
+        if db.is_connected:
+            story = db.get_story_stream(topic)
+            if story:
+                return {"text": story.get("text", ""), "done": story.get("done", False)}
+            raise HTTPException(status_code=404, detail="Storytelling not started")
+        return {"status": "db_error"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[API Error] Story: {e}")
+        return {"status": "error"}
+
+@app.get("/story/{topic}/stream")
+def stream_story(topic: str):
+    """
+    Server-Sent Events con el storytelling a medida que se genera: cada evento trae el
+    texto nuevo desde el anterior y el último lleva 'done'. Lee la colección story_streams.
+    """
+    from database import Database
+    db = Database()
+    if not db.is_connected:
+        raise HTTPException(status_code=500, detail="Database connection error")
+
+    def events():
+        sent = 0
+        deadline = time.time() + 300
+        while time.time() < deadline:
+            story = db.get_story_stream(topic) or {}
+            text = story.get("text", "")
+            if len(text) < sent:
+                sent = 0 # Nueva generación (otro run del mismo tema)
+            if len(text) > sent or story.get("done"):
+                payload = {"delta": text[sent:], "done": bool(story.get("done"))}
+                sent = len(text)
+                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                if story.get("done"):
+                    return
+            time.sleep(0.3)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+class ExplainRequest(BaseModel):
+    topic: Optional[str] = None
+    row_id: Optional[str] = None # 'row_id' del corpus: se recupera la fila original del job
+    row: Optional[dict] = None # O la fila tal cual la devolvió el scraper
+    post_content: str = ""
+    comment_content: str = ""
+    sentiment: Optional[str] = None # Etiqueta ya asignada (si no, se toma de la caché)
+
+@app.post("/explain")
+def explain_row(req: ExplainRequest):
+    """
+    Explicación bajo demanda de una fila (modo ligero: la clasificación masiva no las genera).
+    Con topic + row_id se carga la fila original del último job del tema (filas del
+    checkpoint) y se construye exactamente el texto que se clasificó, también para las filas
+    flat (LinkedIn, filas sin post ni comentario); así la explicación queda en la caché de
+    sentimientos y la segunda vez que se abre la fila no se llama al LLM.
+    """
+    try:
+        import pandas as pd
+        from database import Database
+        from llm_checkpoint import compute_row_ids
+        from llm_processor import LLM_LEAN_MODE, LLMProcessor, get_shared_cache
+        from prompt_builder import build_items
+
+        db = Database()
+        if req.row_id:
+            if not req.topic:
+                raise HTTPException(status_code=400, detail="row_id necesita topic.")
+            # Mismo DataFrame que en la fase LLM: todas las filas del job, en su orden
+            frame = pd.DataFrame(db.get_llm_checkpoint_rows(req.topic) if db.is_connected else [])
+            row_ids = compute_row_ids(frame) if len(frame) else []
+            if req.row_id not in row_ids:
+                raise HTTPException(status_code=404, detail="Fila no encontrada (el tema se volvió a analizar).")
+            frame = frame.iloc[[row_ids.index(req.row_id)]]
+        elif req.row:
+            frame = pd.DataFrame([req.row])
+        else:
+            frame = pd.DataFrame([{"post_content": req.post_content, "comment_content": req.comment_content}])
+        item = build_items(frame)[0]
+        if not item.text:
+            raise HTTPException(status_code=400, detail="La fila no tiene texto.")
+        processor = LLMProcessor(cache=get_shared_cache(db if db.is_connected else None, lean=LLM_LEAN_MODE))
+        result = processor.explain(item.text, req.sentiment)
+        return {
+            "sentiment": result.get("sentiment"),
+            "explanation": result.get("explanation", ""),
+            "confidence": result.get("confidence"),
+            "cached": bool(result.get("cached")),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[API Error] Explain: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+def metrics():
+    """Métricas de la fase LLM en formato Prometheus (latencias, códigos de estado, tokens, reintentos, coste)."""
+    from llm_telemetry import GLOBAL_TELEMETRY
+    return PlainTextResponse(GLOBAL_TELEMETRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/list-data")
 def list_data():
     """Lista los archivos CSV generados en la carpeta data"""
@@ -0,0 +1,208 @@
+"""
+Benchmark de la fase LLM (process_dataframe_concurrently) contra el stub local.
+
+Levanta llm_stub_server.py en un subproceso (o usa --base-url si ya hay uno corriendo),
+genera un DataFrame sintético por cada tamaño y mide:
+  - filas/s de la fase completa,
+  - latencia p50/p99 por petición vista por el cliente (incluye la espera en el limitador)
+    y vista por el servidor (solo el tiempo de respuesta simulado),
+  - memoria pico (RSS del proceso y, con --tracemalloc, pico de asignaciones de Python).
+
+Uso: python benchmark_llm.py --rows 1000 10000 100000 --batch-size 0 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+import pandas as pd
+
+from llm_engine import LLMEngine
+from llm_processor import process_dataframe_concurrently
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+WORDS = (
+    "gobierno elecciones economía precio trabajo gracias excelente terrible corrupción país "
+    "futuro apoyo mentira cambio seguridad salud educación jóvenes calle crisis esperanza "
+    "votar propuesta candidato debate noticia verdad vergüenza orgullo mejor peor"
+).split()
+PLATFORMS = ["Twitter", "Facebook", "Instagram", "LinkedIn"]
+
+
+class TimedEngine(LLMEngine):
+    """LLMEngine que registra la latencia de cada petición tal y como la ve quien llama."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    async def chat(self, messages, max_tokens, temperature=0):
+        started = time.perf_counter()
+        try:
+            return await super().chat(messages, max_tokens, temperature)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def make_dataframe(n_rows, comments_per_post=20, duplicate_rate=0.1, seed=0):
+    """Filas con el esquema de los scrapers; una fracción son copias exactas de filas anteriores."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        if rows and rng.random() < duplicate_rate:
+            rows.append(dict(rng.choice(rows)))
+            continue
+        post_index = i // comments_per_post
+        rng_post = random.Random(f"{seed}|{post_index}")
+        rows.append({
+            "platform": PLATFORMS[post_index % len(PLATFORMS)],
+            "post_index": post_index,
+            "post_author": f"autor_{post_index}",
+            "post_content": " ".join(rng_post.choice(WORDS) for _ in range(rng_post.randint(20, 80))),
+            "comment_author": f"usuario_{i}",
+            "comment_content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40))),
+        })
+    return pd.DataFrame(rows)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB, macOS en bytes
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def start_stub(args):
+    cmd = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_stub_server.py"),
+        "--port", str(args.port), "--seed", str(args.seed),
+        "--latency", args.latency, "--median-ms", str(args.median_ms),
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+        "--max-concurrency", str(args.stub_max_concurrency),
+    ]
+    proc = subprocess.Popen(cmd)
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{base_url}/stats", timeout=1.0)
+            return proc, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("El stub no arrancó a tiempo")
+
+
+def run_case(n_rows, base_url, args):
+    df = make_dataframe(n_rows, args.comments_per_post, args.duplicate_rate, args.seed)
+    httpx.post(f"{base_url}/reset", timeout=5.0)
+    engine = TimedEngine(max_concurrency=args.concurrency or None, base_url=base_url, api_key="stub", hedge=args.hedge)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    process_dataframe_concurrently(
+        df, use_cache=False, batch_size=args.batch_size, engine=engine,
+        cascade=args.cascade, base_url=base_url, lean=args.lean
+    )
+    elapsed = time.perf_counter() - started
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+
+    server = httpx.get(f"{base_url}/stats", timeout=5.0).json()
+    snap = engine.snapshot()
+    return {
+        "rows": n_rows,
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(n_rows / elapsed, 1),
+        "requests": server["requests"],
+        "client_p50_s": round(percentile(engine.latencies, 0.50) or 0, 4),
+        "client_p99_s": round(percentile(engine.latencies, 0.99) or 0, 4),
+        "server_p50_s": server["p50_latency_s"],
+        "server_p99_s": server["p99_latency_s"],
+        "status_codes": server["status_codes"],
+        "total_tokens": server["total_tokens"],
+        "final_concurrency": snap["limit"],
+        "retried": snap["retried"],
+        "hedging": snap.get("hedging"),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_traced_mb": traced_peak,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark de la fase LLM contra un stub local")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--batch-size", type=int, default=0, help="LLM_BATCH_SIZE a probar (0 = fila a fila)")
+    parser.add_argument("--concurrency", type=int, default=0, help="Techo de concurrencia del motor (0 = config)")
+    parser.add_argument("--cascade", action="store_true", help="Activar el clasificador local en cascada")
+    parser.add_argument("--lean", action="store_true", help="Modo ligero: solo etiqueta + confianza, sin explicación")
+    parser.add_argument("--hedge", action="store_true", help="Duplicar las peticiones que superan el p95 de latencia")
+    parser.add_argument("--comments-per-post", type=int, default=20)
+    parser.add_argument("--duplicate-rate", type=float, default=0.1)
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--tracemalloc", action="store_true", help="Medir el pico de memoria Python (más lento)")
+    parser.add_argument("--output", help="Guardar los resultados en un JSON")
+    stub = parser.add_argument_group("stub")
+    stub.add_argument("--base-url", help="Usar un stub ya arrancado en lugar de lanzar uno")
+    stub.add_argument("--port", type=int, default=8090)
+    stub.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    stub.add_argument("--median-ms", type=float, default=400.0)
+    stub.add_argument("--error-rate", type=float, default=0.0)
+    stub.add_argument("--rate-limit-rate", type=float, default=0.0)
+    stub.add_argument("--stub-max-concurrency", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    proc = None
+    base_url = args.base_url
+    if not base_url:
+        proc, base_url = start_stub(args)
+
+    results = []
+    try:
+        for n_rows in args.rows:
+            print(f"\n[Bench] {n_rows} filas contra {base_url} ...")
+            results.append(run_case(n_rows, base_url, args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    print(f"\n{'filas':>8} {'seg':>8} {'filas/s':>9} {'peticiones':>10} {'p50 cli':>8} {'p99 cli':>8} "
+          f"{'p50 srv':>8} {'p99 srv':>8} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['rows']:>8} {r['seconds']:>8} {r['rows_per_s']:>9} {r['requests']:>10} "
+              f"{r['client_p50_s']:>8} {r['client_p99_s']:>8} {r['server_p50_s']!s:>8} "
+              f"{r['server_p99_s']!s:>8} {r['peak_rss_mb']!s:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"[Bench] Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
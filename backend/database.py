@@ -1,6 +1,6 @@
 import os
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne
+from datetime import datetime, timedelta
 
 class Database:
     def __init__(self, uri="mongodb://localhost:27017/", db_name="social_sentiment_db"):
@@ -72,6 +72,29 @@ class Database:
         if not self.is_connected: return []
         return list(self.collection.find({"topic": topic}, {"_id": 0}))
 
+    def get_labeled_samples(self, limit=20000):
+        """Pares (texto del comentario, sentimiento) ya clasificados por el LLM (para el modelo local)"""
+        if not self.is_connected: return [], []
+        texts, labels = [], []
+        try:
+            cursor = self.collection.find(
+                {"comments.sentiment": {"$in": ["Positivo", "Negativo", "Neutro"]}},
+                {"comments.content": 1, "comments.sentiment": 1, "_id": 0}
+            ).sort("last_updated", -1)
+            for doc in cursor:
+                for c in doc.get("comments", []):
+                    # Solo etiquetas del LLM: las del propio modelo local (o del triaje) no se reaprenden
+                    if c.get("label_source", "llm") != "llm":
+                        continue
+                    if c.get("content") and c.get("sentiment") in ("Positivo", "Negativo", "Neutro"):
+                        texts.append(c["content"])
+                        labels.append(c["sentiment"])
+                if len(texts) >= limit:
+                    break
+        except Exception as e:
+            print(f"[MongoDB] Error recuperando etiquetas: {e}")
+        return texts[:limit], labels[:limit]
+
     def save_analysis(self, topic, analysis_data):
         """Guarda el resultado del análisis (stats, charts, storytelling) en una colección separada"""
         if not self.is_connected: return False
@@ -94,6 +117,52 @@ class Database:
             print(f"[MongoDB] Error guardando análisis: {e}")
             return False
 
+    def update_story_stream(self, topic, text, done=False):
+        """
+        Publica el storytelling parcial (en generación) en la colección story_streams.
+        No va en analysis_results: un tema sin análisis guardado quedaría con un documento sin 'data'.
+        """
+        if not self.is_connected: return
+        try:
+            self.db["story_streams"].update_one(
+                {"topic": topic},
+                {"$set": {"text": text, "done": done, "updated_at": datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"[MongoDB] Error publicando storytelling parcial: {e}")
+
+    def get_story_stream(self, topic):
+        """Storytelling en generación de un tema ({text, done}) o None"""
+        if not self.is_connected: return None
+        try:
+            return self.db["story_streams"].find_one({"topic": topic}, {"text": 1, "done": 1, "updated_at": 1, "_id": 0})
+        except Exception as e:
+            print(f"[MongoDB] Error leyendo storytelling parcial: {e}")
+            return None
+
+    def get_story_cache(self, key):
+        """Informe memoizado para una clave (hash de stats + tema + versión del prompt)"""
+        if not self.is_connected: return None
+        try:
+            doc = self.db["story_cache"].find_one({"_id": key}, {"story": 1})
+            return doc["story"] if doc else None
+        except Exception as e:
+            print(f"[MongoDB] Error leyendo story_cache: {e}")
+            return None
+
+    def save_story_cache(self, key, topic, story):
+        """Guarda un informe generado para reutilizarlo si las estadísticas no cambian"""
+        if not self.is_connected: return
+        try:
+            self.db["story_cache"].update_one(
+                {"_id": key},
+                {"$set": {"topic": topic, "story": story, "created_at": datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"[MongoDB] Error guardando story_cache: {e}")
+
     def get_analysis(self, topic):
         """Recupera el análisis más reciente para un tema"""
         if not self.is_connected: return None
@@ -106,7 +175,8 @@ class Database:
                 res = analysis_coll.find_one({"topic": {"$regex": f"^{topic}$", "$options": "i"}})
             
             if res:
-                return res["data"]
+                # Documentos sin 'data' (storytelling parcial de versiones anteriores): no hay análisis
+                return res.get("data")
             return None
         except Exception as e:
             print(f"[MongoDB] Error recuperando análisis: {e}")
@@ -118,7 +188,7 @@ class Database:
         try:
             analysis_coll = self.db["analysis_results"]
             # Proyección para traer solo topic y updated_at, y stats para el count
-            cursor = analysis_coll.find({}, {
+            cursor = analysis_coll.find({"data": {"$exists": True}}, {
                 "topic": 1, 
                 "updated_at": 1, 
                 "data.stats.global_counts": 1, 
@@ -162,8 +232,11 @@ class Database:
             print(f"[MongoDB] Error eliminando historial: {e}")
             return False
 
-    def init_job_status(self, topic, platforms, limit):
-        """Inicializa el estado de un trabajo de scraping"""
+    def init_job_status(self, topic, platforms, limit, resume_attempts=0):
+        """
+        Inicializa el estado de un trabajo de scraping.
+        resume_attempts: reanudaciones seguidas de la fase LLM (0 si el job empieza de cero).
+        """
         if not self.is_connected: return
         try:
             status_coll = self.db["job_status"]
@@ -174,7 +247,9 @@ class Database:
             doc = {
                 "topic": topic,
                 "stages": stages,
-                "llm_status": "pending", # pending, running, completed
+                "llm_status": "pending", # pending, running, completed, failed
+                "llm_resume_attempts": resume_attempts,
+                "llm_preview": None,
                 "cancelled": False,
                 "updated_at": datetime.now()
             }
@@ -244,7 +319,7 @@ class Database:
             return doc.get("cancelled", False) if doc else False
         except: return False
 
-    def update_job_timings(self, topic, scraping_time=None, llm_time=None):
+    def update_job_timings(self, topic, scraping_time=None, llm_time=None, llm_errors=None):
         """Actualiza los tiempos de ejecución del job (en segundos)"""
         if not self.is_connected: return
         try:
@@ -254,6 +329,8 @@ class Database:
                 update_data["timings.scraping"] = scraping_time
             if llm_time is not None:
                 update_data["timings.llm"] = llm_time
+            if llm_errors is not None:
+                update_data["timings.llm_errors"] = llm_errors
                 
             status_coll.update_one(
                 {"topic": topic},
@@ -261,3 +338,152 @@ class Database:
             )
         except Exception as e:
             print(f"[MongoDB] Error actualizando timings: {e}")
+
+    def _ensure_llm_cache_index(self, ttl_seconds):
+        """Crea (una sola vez por conexión) el índice TTL de la caché de sentimientos"""
+        if getattr(self, "_llm_cache_index_ready", False): return
+        try:
+            self.db["llm_cache"].create_index("created_at", expireAfterSeconds=int(ttl_seconds))
+        except Exception as e:
+            print(f"[MongoDB] No se pudo crear índice TTL de llm_cache: {e}")
+        self._llm_cache_index_ready = True
+
+    def get_llm_cache_many(self, keys, ttl_seconds):
+        """Recupera en una sola consulta las clasificaciones cacheadas para una lista de claves"""
+        if not self.is_connected or not keys: return {}
+        try:
+            min_date = datetime.now() - timedelta(seconds=ttl_seconds)
+            cursor = self.db["llm_cache"].find(
+                {"_id": {"$in": list(keys)}, "created_at": {"$gte": min_date}},
+                {"result": 1}
+            )
+            return {doc["_id"]: doc["result"] for doc in cursor}
+        except Exception as e:
+            print(f"[MongoDB] Error leyendo llm_cache: {e}")
+            return {}
+
+    def save_llm_cache_many(self, entries, ttl_seconds):
+        """Guarda (upsert) un dict {clave: resultado} en la caché de sentimientos"""
+        if not self.is_connected or not entries: return
+        try:
+            self._ensure_llm_cache_index(ttl_seconds)
+            now = datetime.now()
+            ops = [
+                UpdateOne({"_id": k}, {"$set": {"result": v, "created_at": now}}, upsert=True)
+                for k, v in entries.items()
+            ]
+            self.db["llm_cache"].bulk_write(ops, ordered=False)
+        except Exception as e:
+            print(f"[MongoDB] Error guardando llm_cache: {e}")
+
+    def update_llm_metrics(self, topic, metrics):
+        """Publica métricas de la fase LLM (caché, throughput, errores...) en job_status.llm_metrics"""
+        if not self.is_connected or not metrics: return
+        try:
+            status_coll = self.db["job_status"]
+            update_data = {f"llm_metrics.{k}": v for k, v in metrics.items()}
+            update_data["updated_at"] = datetime.now()
+            status_coll.update_one({"topic": topic}, {"$set": update_data})
+        except Exception as e:
+            print(f"[MongoDB] Error actualizando métricas LLM: {e}")
+
+    def update_scraper_metrics(self, topic, platform, metrics):
+        """Publica las métricas de red de un scraper (bloqueo de recursos, bytes, tiempos de carga) en job_status.scraper_metrics"""
+        if not self.is_connected or not metrics: return
+        try:
+            status_coll = self.db["job_status"]
+            status_coll.update_one(
+                {"topic": topic},
+                {"$set": {f"scraper_metrics.{platform}": metrics, "updated_at": datetime.now()}}
+            )
+        except Exception as e:
+            print(f"[MongoDB] Error actualizando métricas de red {platform}: {e}")
+
+    def update_llm_preview(self, topic, preview):
+        """Publica los recuentos parciales de sentimiento (global y por plataforma) en job_status.llm_preview"""
+        if not self.is_connected: return
+        try:
+            status_coll = self.db["job_status"]
+            status_coll.update_one(
+                {"topic": topic},
+                {"$set": {"llm_preview": preview, "updated_at": datetime.now()}}
+            )
+        except Exception as e:
+            print(f"[MongoDB] Error actualizando vista previa LLM: {e}")
+
+    def save_llm_checkpoint_rows(self, topic, rows, row_ids):
+        """
+        Guarda las filas scrapeadas de un job (con su id estable) para poder reanudar
+        la fase LLM sin volver a scrapear. Conserva los resultados ya guardados de las
+        filas que siguen presentes y elimina los de filas que ya no existen.
+        """
+        if not self.is_connected or not rows: return
+        try:
+            coll = self.db["llm_checkpoints"]
+            coll.create_index([("topic", 1), ("seq", 1)])
+            coll.delete_many({"topic": topic, "row_id": {"$nin": list(row_ids)}})
+            now = datetime.now()
+            ops = [
+                UpdateOne(
+                    {"_id": f"{topic}|{rid}"},
+                    {"$set": {"topic": topic, "row_id": rid, "seq": seq, "row": row, "updated_at": now}},
+                    upsert=True
+                )
+                for seq, (rid, row) in enumerate(zip(row_ids, rows))
+            ]
+            coll.bulk_write(ops, ordered=False)
+        except Exception as e:
+            print(f"[MongoDB] Error guardando filas del checkpoint: {e}")
+
+    def get_llm_checkpoint_rows(self, topic):
+        """Recupera, en su orden original, las filas scrapeadas guardadas para el topic"""
+        if not self.is_connected: return []
+        try:
+            cursor = self.db["llm_checkpoints"].find(
+                {"topic": topic, "row": {"$exists": True}}, {"row": 1}
+            ).sort("seq", 1)
+            return [doc["row"] for doc in cursor]
+        except Exception as e:
+            print(f"[MongoDB] Error leyendo filas del checkpoint: {e}")
+            return []
+
+    def get_llm_checkpoint_results(self, topic):
+        """Devuelve {row_id: resultado} de las filas ya clasificadas del topic"""
+        if not self.is_connected: return {}
+        try:
+            cursor = self.db["llm_checkpoints"].find(
+                {"topic": topic, "result": {"$exists": True}}, {"row_id": 1, "result": 1}
+            )
+            return {doc["row_id"]: doc["result"] for doc in cursor}
+        except Exception as e:
+            print(f"[MongoDB] Error leyendo resultados del checkpoint: {e}")
+            return {}
+
+    def save_llm_checkpoint_results(self, topic, results):
+        """Guarda (upsert) un dict {row_id: resultado} de la fase LLM"""
+        if not self.is_connected or not results: return
+        try:
+            now = datetime.now()
+            ops = [
+                UpdateOne(
+                    {"_id": f"{topic}|{rid}"},
+                    {"$set": {"topic": topic, "row_id": rid, "result": res, "updated_at": now}},
+                    upsert=True
+                )
+                for rid, res in results.items()
+            ]
+            self.db["llm_checkpoints"].bulk_write(ops, ordered=False)
+        except Exception as e:
+            print(f"[MongoDB] Error guardando resultados del checkpoint: {e}")
+
+    def clear_llm_checkpoint(self, topic):
+        """
+        Elimina los resultados del checkpoint de un topic (job terminado). Las filas se
+        conservan hasta el siguiente job del tema: /explain reconstruye desde ellas el
+        texto exacto que se clasificó.
+        """
+        if not self.is_connected: return
+        try:
+            self.db["llm_checkpoints"].update_many({"topic": topic}, {"$unset": {"result": ""}})
+        except Exception as e:
+            print(f"[MongoDB] Error eliminando checkpoint: {e}")
@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Sentimientos válidos que merece la pena cachear (los errores NUNCA se guardan)
+CACHEABLE_SENTIMENTS = {"Positivo", "Negativo", "Neutro"}
+
+
+def normalize_text(text):
+    """Normaliza espacios para que variaciones triviales compartan la misma clave."""
+    return " ".join(str(text).split())
+
+
+class SentimentCache:
+    """
+    Caché de clasificaciones de sentimiento direccionada por contenido.
+
+    Dos niveles:
+      1. LRU en memoria (por proceso), limitado por `max_items` y `ttl_seconds`.
+      2. Colección `llm_cache` en MongoDB (persistente entre ejecuciones, TTL nativo).
+
+    MongoDB no se toca en get()/set(), que se llaman desde el event loop: las entradas
+    persistidas se cargan antes con prefetch() (una consulta) y las nuevas se acumulan
+    hasta flush() (una escritura en bloque por ejecución).
+
+    La clave es un SHA-256 de (modelo, versión de prompt, texto normalizado), de modo que
+    cambiar el prompt invalida automáticamente las entradas antiguas.
+    """
+
+    def __init__(self, model, prompt_version, max_items=50000, ttl_seconds=30 * 86400, db=None):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.db = db
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (timestamp, result)
+        self._dirty = {}  # key -> result, pendientes de guardar en MongoDB
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, text):
+        raw = f"{self.model}|{self.prompt_version}|{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _db_ready(self):
+        return self.db is not None and self.db.is_connected
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            ts, result = entry
+            if time.time() - ts > self.ttl_seconds:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return result
+
+    def _memory_set(self, key, result, ts=None):
+        with self._lock:
+            self._memory[key] = (ts or time.time(), result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def get(self, text):
+        """Devuelve el resultado cacheado (copia, con tokens=0) o None. Solo mira la memoria."""
+        result = self._memory_get(self.make_key(text))
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return dict(result, tokens=0, cached=True)
+
+    def contains(self, text):
+        """Comprueba si el texto está en memoria, sin contar hit/miss (usar tras prefetch)."""
+        return self._memory_get(self.make_key(text)) is not None
+
+    def set(self, text, result):
+        """
+        Guarda un resultado válido en memoria y lo deja pendiente para MongoDB (flush).
+        Ignora errores y respuestas vacías.
+        """
+        if not isinstance(result, dict) or result.get("sentiment") not in CACHEABLE_SENTIMENTS:
+            return
+        key = self.make_key(text)
+        value = {"sentiment": result["sentiment"], "explanation": result.get("explanation", "")}
+        if "confidence" in result:
+            value["confidence"] = result["confidence"]
+        self._memory_set(key, value)
+        if self._db_ready():
+            with self._lock:
+                self._dirty[key] = value
+
+    def flush(self):
+        """Guarda en MongoDB, en una sola escritura, las entradas nuevas desde el último flush."""
+        with self._lock:
+            entries, self._dirty = self._dirty, {}
+        if entries and self._db_ready():
+            self.db.save_llm_cache_many(entries, self.ttl_seconds)
+        return len(entries)
+
+    def prefetch(self, texts):
+        """
+        Carga en memoria, con UNA sola consulta a MongoDB, las entradas persistidas
+        de todos los textos indicados. Evita una ida y vuelta a la BD por fila.
+        """
+        if not self._db_ready():
+            return 0
+        keys = []
+        for t in set(texts):
+            k = self.make_key(t)
+            if self._memory_get(k) is None:
+                keys.append(k)
+        if not keys:
+            return 0
+        stored = self.db.get_llm_cache_many(keys, self.ttl_seconds)
+        for k, v in stored.items():
+            self._memory_set(k, v)
+        return len(stored)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
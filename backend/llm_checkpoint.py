@@ -0,0 +1,110 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Resultados por escritura en MongoDB y tiempo máximo que un resultado espera en memoria
+CHECKPOINT_FLUSH_ROWS = getattr(_config, "CHECKPOINT_FLUSH_ROWS", 50)
+CHECKPOINT_FLUSH_SECONDS = getattr(_config, "CHECKPOINT_FLUSH_SECONDS", 5.0)
+
+# Reanudar la fase LLM de un job solo si se cortó hace menos de N horas y como mucho M veces
+LLM_RESUME_TTL_HOURS = getattr(_config, "LLM_RESUME_TTL_HOURS", 24)
+LLM_RESUME_MAX_ATTEMPTS = getattr(_config, "LLM_RESUME_MAX_ATTEMPTS", 3)
+RESUMABLE_STATUSES = {"running", "failed"}
+
+ID_COLUMNS = ["platform", "post_index", "post_content", "comment_author", "comment_content", "content"]
+VALID_SENTIMENTS = {"Positivo", "Negativo", "Neutro"}
+
+
+def _norm(val):
+    if val is None:
+        return ""
+    s = str(val).strip()
+    return "" if s.lower() in ("nan", "none") else s
+
+
+def compute_row_ids(df):
+    """
+    Id estable por fila: hash de las columnas de contenido + nº de aparición
+    (dos filas idénticas obtienen ids distintos pero reproducibles entre ejecuciones).
+    """
+    cols = [c for c in ID_COLUMNS if c in df.columns]
+    ids = []
+    seen = {}
+    for values in zip(*(df[c].tolist() for c in cols)):
+        raw = "\x1f".join(_norm(v) for v in values)
+        base = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(f"{base}-{n}")
+    return ids
+
+
+def should_resume(job_status, now=None):
+    """
+    Si el job anterior de un tema (su documento de job_status) dejó una fase LLM a medias
+    que merece reanudarse: llm_status 'running' (el proceso murió) o 'failed' (excepción),
+    sin cancelar, actualizado hace menos de LLM_RESUME_TTL_HOURS y con menos de
+    LLM_RESUME_MAX_ATTEMPTS reanudaciones seguidas.
+    """
+    if not job_status or job_status.get("cancelled"):
+        return False
+    if job_status.get("llm_status") not in RESUMABLE_STATUSES:
+        return False
+    if job_status.get("llm_resume_attempts", 0) >= LLM_RESUME_MAX_ATTEMPTS:
+        return False
+    updated_at = job_status.get("updated_at")
+    if not isinstance(updated_at, datetime):
+        return False
+    return (now or datetime.now()) - updated_at < timedelta(hours=LLM_RESUME_TTL_HOURS)
+
+
+class CheckpointWriter:
+    """
+    Acumula resultados de la fase LLM y los vuelca a MongoDB en lotes pequeños
+    (cada CHECKPOINT_FLUSH_ROWS filas o CHECKPOINT_FLUSH_SECONDS segundos).
+    Solo se guardan sentimientos válidos: los errores se reintentan en la siguiente ejecución.
+    writer: BackgroundWriter por el que pasan las escrituras (add se llama desde el event
+    loop); sin él se escribe en el momento.
+    """
+
+    def __init__(self, db, topic, flush_rows=None, flush_seconds=None, writer=None):
+        self.db = db
+        self.topic = topic
+        self.writer = writer
+        self.flush_rows = flush_rows or CHECKPOINT_FLUSH_ROWS
+        self.flush_seconds = flush_seconds or CHECKPOINT_FLUSH_SECONDS
+        self._buffer = {}
+        self._last_flush = time.monotonic()
+        self.saved = 0
+
+    def add(self, row_ids, result):
+        """Registra el resultado de un texto para todas las filas que lo comparten."""
+        if result.get("sentiment") not in VALID_SENTIMENTS:
+            return
+        for n, row_id in enumerate(row_ids):
+            self._buffer[row_id] = {
+                "sentiment": result["sentiment"],
+                "explanation": result.get("explanation", ""),
+                # Los tokens solo cuentan una vez por texto (primera fila)
+                "tokens": result.get("tokens", 0) if n == 0 else 0,
+            }
+            for extra in ("confidence", "source"):
+                if extra in result:
+                    self._buffer[row_id][extra] = result[extra]
+        if len(self._buffer) >= self.flush_rows or time.monotonic() - self._last_flush > self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            buffer, self._buffer = self._buffer, {}
+            if self.writer is not None:
+                self.writer.submit(self.db.save_llm_checkpoint_results, self.topic, buffer)
+            else:
+                self.db.save_llm_checkpoint_results(self.topic, buffer)
+            self.saved += len(buffer)
+        self._last_flush = time.monotonic()
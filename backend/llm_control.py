@@ -0,0 +1,299 @@
+import asyncio
+import random
+import statistics
+import time
+from collections import deque
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+LLM_INITIAL_CONCURRENCY = getattr(_config, "LLM_INITIAL_CONCURRENCY", 8)
+LLM_MIN_CONCURRENCY = getattr(_config, "LLM_MIN_CONCURRENCY", 1)
+
+# Reintentos (cola de reintentos drenada al final de la fase)
+LLM_MAX_ATTEMPTS = getattr(_config, "LLM_MAX_ATTEMPTS", 4)
+LLM_RETRY_BASE_DELAY = getattr(_config, "LLM_RETRY_BASE_DELAY", 1.0)
+LLM_RETRY_MAX_DELAY = getattr(_config, "LLM_RETRY_MAX_DELAY", 30.0)
+
+# Resultado de una petición, tal y como lo ve el controlador
+OUTCOME_OK = "ok"
+OUTCOME_OVERLOAD = "overload" # 429 / 5xx / timeout: el proveedor está saturado
+OUTCOME_ERROR = "error" # Cualquier otro fallo (no implica saturación)
+OUTCOME_CANCELLED = "cancelled" # Petición duplicada (hedging) cancelada al ganar la otra
+
+# Hedging: si una petición no responde en el percentil p95 de latencia, se lanza un duplicado
+LLM_HEDGE_ENABLED = getattr(_config, "LLM_HEDGE_ENABLED", False)
+LLM_HEDGE_PERCENTILE = getattr(_config, "LLM_HEDGE_PERCENTILE", 0.95)
+# Duplicados como máximo, en fracción de las peticiones (0.05 = +5% de peticiones)
+LLM_HEDGE_BUDGET = getattr(_config, "LLM_HEDGE_BUDGET", 0.05)
+LLM_HEDGE_MIN_SAMPLES = getattr(_config, "LLM_HEDGE_MIN_SAMPLES", 20) # Latencias antes de empezar
+LLM_HEDGE_MIN_DELAY = getattr(_config, "LLM_HEDGE_MIN_DELAY", 0.5) # Segundos
+
+
+class AdaptiveLimiter:
+    """
+    Controlador de concurrencia AIMD (Additive Increase / Multiplicative Decrease).
+
+    - Sube el límite en +1 cada vez que se completa una "ventana" (tantas peticiones
+      como el límite actual) con la latencia p50 dentro de `latency_tolerance` veces
+      la mejor p50 observada y una tasa de errores por debajo de `max_error_rate`.
+    - Ante 429/5xx/timeouts lo multiplica por `backoff` (como mucho una vez por
+      ventana, para que una ráfaga de fallos simultáneos no lo hunda a 1).
+    """
+
+    def __init__(self, initial=None, min_limit=None, max_limit=60,
+                 backoff=0.5, latency_tolerance=2.0, max_error_rate=0.05):
+        self.min_limit = min_limit or LLM_MIN_CONCURRENCY
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial or LLM_INITIAL_CONCURRENCY, self.min_limit), max_limit))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+
+        self.in_flight = 0
+        self._cond = None # asyncio.Condition, se crea dentro del loop
+        self._loop = None
+        self._window_latencies = []
+        self._window_errors = 0
+        self._baseline_p50 = None
+        self._last_decrease = 0.0
+        self._completions = deque(maxlen=2000) # timestamps para throughput
+        self._recent_latencies = deque(maxlen=200)
+        self.total_ok = 0
+        self.total_overload = 0
+        self.total_error = 0
+
+    async def acquire(self):
+        """Espera a que haya hueco bajo el límite actual. Devuelve el instante de inicio."""
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            # El motor puede reutilizarse en otro event loop (p.ej. un run() posterior)
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started, outcome):
+        """Registra el resultado de una petición y ajusta el límite."""
+        now = time.monotonic()
+        latency = now - started
+        if outcome == OUTCOME_OK:
+            self.total_ok += 1
+            self._window_latencies.append(latency)
+            self._recent_latencies.append(latency)
+            self._completions.append(now)
+        elif outcome == OUTCOME_OVERLOAD:
+            self.total_overload += 1
+            self._window_errors += 1
+            # Solo reducimos si la petición empezó después del último recorte
+            if started >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                self._reset_window()
+        elif outcome == OUTCOME_CANCELLED:
+            # Ni éxito ni fallo: solo libera el hueco
+            pass
+        else:
+            self.total_error += 1
+            self._window_errors += 1
+
+        window_size = len(self._window_latencies) + self._window_errors
+        if window_size >= max(int(self.limit), 1):
+            self._end_window()
+
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _reset_window(self):
+        self._window_latencies = []
+        self._window_errors = 0
+
+    def _end_window(self):
+        total = len(self._window_latencies) + self._window_errors
+        error_rate = self._window_errors / total if total else 0.0
+        if self._window_latencies:
+            p50 = statistics.median(self._window_latencies)
+            if self._baseline_p50 is None or p50 < self._baseline_p50:
+                self._baseline_p50 = p50
+            healthy_latency = p50 <= self._baseline_p50 * self.latency_tolerance
+            if healthy_latency and error_rate <= self.max_error_rate:
+                self.limit = min(self.max_limit, self.limit + 1)
+        self._reset_window()
+
+    def throughput(self, horizon=10.0):
+        """Peticiones completadas por segundo en los últimos `horizon` segundos."""
+        now = time.monotonic()
+        recent = [t for t in self._completions if now - t <= horizon]
+        if not recent:
+            return 0.0
+        span = max(now - recent[0], 1e-3)
+        return len(recent) / span
+
+    def snapshot(self):
+        p50 = statistics.median(self._recent_latencies) if self._recent_latencies else None
+        return {
+            "limit": int(self.limit),
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "throughput_rps": round(self.throughput(), 2),
+            "p50_latency_s": round(p50, 3) if p50 is not None else None,
+            "ok": self.total_ok,
+            "overload": self.total_overload,
+            "errors": self.total_error,
+        }
+
+
+class Hedger:
+    """
+    Política de hedging para la cola de latencias.
+
+    - delay(): percentil `percentile` de las latencias recientes de peticiones completas
+      (None mientras no haya `min_samples`, así que al principio no se duplica nada).
+    - allow(): presupuesto: los duplicados no pueden superar `budget` x peticiones.
+    - Al ganar un duplicado se estima lo que habría tardado la original como la media
+      de las latencias observadas mayores que su edad en ese momento (cola empírica).
+    """
+
+    def __init__(self, percentile=None, budget=None, min_samples=None, min_delay=None):
+        self.percentile = LLM_HEDGE_PERCENTILE if percentile is None else percentile
+        self.budget = LLM_HEDGE_BUDGET if budget is None else budget
+        self.min_samples = LLM_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self.min_delay = LLM_HEDGE_MIN_DELAY if min_delay is None else min_delay
+        self._latencies = deque(maxlen=500)
+        self._observed = deque(maxlen=5000) # latencia vista por quien llama (con hedging)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
+
+    def delay(self):
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))])
+
+    def allow(self):
+        return self.hedged < self.budget * self.requests
+
+    def record(self, latency, hedged=False, hedge_won=False):
+        """Latencia final de una petición (desde que se lanzó la original)."""
+        self._observed.append(latency)
+        if not hedge_won:
+            # Si ganó el duplicado, la latencia real de la original se desconoce (quedó cortada)
+            self._latencies.append(latency)
+        if hedge_won:
+            self.hedge_wins += 1
+            tail = [lat for lat in self._latencies if lat > latency]
+            if tail:
+                self.saved_seconds += statistics.mean(tail) - latency
+
+    def snapshot(self):
+        observed = sorted(self._observed)
+
+        def pct(p):
+            return round(observed[min(len(observed) - 1, int(p * len(observed)))], 3) if observed else None
+
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "budget": self.budget,
+            "delay_s": round(self.delay(), 3) if self.delay() is not None else None,
+            "estimated_saved_s": round(self.saved_seconds, 2),
+            "p50_latency_s": pct(0.50),
+            "p95_latency_s": pct(0.95),
+            "p99_latency_s": pct(0.99),
+        }
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Backoff exponencial con 'full jitter': uniforme en [0, min(cap, base * 2^attempt)]."""
+    base = LLM_RETRY_BASE_DELAY if base is None else base
+    cap = LLM_RETRY_MAX_DELAY if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitOpenError(Exception):
+    """El proveedor lleva demasiado tiempo caído: se falla rápido en lugar de esperar."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker compartido por todas las peticiones del motor.
+
+    - CLOSED: las peticiones pasan. `failure_threshold` saturaciones seguidas lo abren.
+    - OPEN: todas las peticiones esperan (el pool entero queda en pausa) durante `cooldown`.
+    - HALF_OPEN: pasa una única petición de prueba; si va bien se cierra, si falla se
+      vuelve a abrir con el doble de cooldown (hasta `max_cooldown`).
+    Si el circuito lleva abierto más de `give_up_after` segundos sin un solo éxito,
+    wait_ready() lanza CircuitOpenError para que la fase termine en lugar de colgarse.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, cooldown=5.0, max_cooldown=60.0, give_up_after=300.0):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.give_up_after = give_up_after
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.down_since = None
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    async def wait_ready(self):
+        """Bloquea mientras el circuito está abierto. Devuelve True si esta petición es la sonda."""
+        while True:
+            now = time.monotonic()
+            if self.state == self.CLOSED:
+                return False
+            if self.down_since is not None and now - self.down_since > self.give_up_after:
+                raise CircuitOpenError(f"Proveedor LLM caído desde hace {now - self.down_since:.0f}s")
+            if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            await asyncio.sleep(min(0.5, max(0.05, self.cooldown - (now - self.opened_at))))
+
+    def record_success(self, probe=False):
+        if probe:
+            self._probe_in_flight = False
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            print("[LLM] Circuit breaker CERRADO: el proveedor vuelve a responder.")
+        self.state = self.CLOSED
+        self.cooldown = self.base_cooldown
+        self.down_since = None
+
+    def record_failure(self, overload, probe=False):
+        if probe:
+            self._probe_in_flight = False
+        if not overload:
+            return
+        self.consecutive_failures += 1
+        now = time.monotonic()
+        if probe:
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self._open(now)
+        elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open(now)
+
+    def _open(self, now):
+        if self.down_since is None:
+            self.down_since = now
+        self.state = self.OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        print(f"[LLM] Circuit breaker ABIERTO: pausando peticiones {self.cooldown:.1f}s.")
@@ -0,0 +1,295 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, OpenAI, RateLimitError
+
+from llm_telemetry import JobTelemetry, status_label
+from llm_control import (
+    LLM_HEDGE_ENABLED, LLM_MAX_ATTEMPTS, OUTCOME_CANCELLED, OUTCOME_ERROR, OUTCOME_OK, OUTCOME_OVERLOAD,
+    AdaptiveLimiter, CircuitBreaker, CircuitOpenError, Hedger, backoff_delay,
+)
+
+# Importar claves desde config
+try:
+    from config import DEEPSEEK_API_KEY
+except ImportError:
+    DEEPSEEK_API_KEY = ""
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Endpoint compatible con OpenAI. Apuntarlo al stub local (llm_stub_server.py) permite
+# medir la fase LLM sin gastar en DeepSeek: LLM_BASE_URL=http://127.0.0.1:8090
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL") or getattr(_config, "LLM_BASE_URL", DEEPSEEK_BASE_URL)
+LLM_MODEL = "deepseek-chat" # DeepSeek V3 (Chat)
+
+# Techo de peticiones simultáneas en vuelo (el controlador AIMD se mueve por debajo)
+LLM_MAX_CONCURRENCY = getattr(_config, "LLM_MAX_CONCURRENCY", 60)
+# Conexiones keep-alive que se mantienen abiertas en el pool (evita un handshake TLS por petición)
+LLM_MAX_KEEPALIVE = getattr(_config, "LLM_MAX_KEEPALIVE", 20)
+# Timeout por petición (el de OpenAI por defecto son 10 minutos y esconde peticiones colgadas)
+LLM_REQUEST_TIMEOUT = getattr(_config, "LLM_REQUEST_TIMEOUT", 30.0)
+LLM_STORY_TIMEOUT = getattr(_config, "LLM_STORY_TIMEOUT", 120.0)
+
+# HTTP/2 solo si el paquete 'h2' está instalado (httpx lo requiere)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_async_clients = weakref.WeakKeyDictionary() # event loop -> {(base_url, api_key): AsyncOpenAI}
+_sync_clients = {} # (base_url, api_key) -> OpenAI
+_sync_lock = threading.Lock()
+
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_KEEPALIVE)
+
+
+def get_async_client(base_url=None, api_key=None):
+    """
+    Cliente AsyncOpenAI compartido por event loop (y endpoint). Un httpx.AsyncClient está
+    ligado al loop donde se crea, así que la API (loop de FastAPI, longevo) reutiliza siempre
+    el mismo, y cada ejecución síncrona vía run_sync() tiene el suyo.
+    """
+    key = (base_url or LLM_BASE_URL, api_key or DEEPSEEK_API_KEY)
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(key)
+    if client is None:
+        http_client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=_limits())
+        # max_retries=0: los reintentos los gestiona LLMEngine (backoff + circuit breaker)
+        client = AsyncOpenAI(
+            api_key=key[1], base_url=key[0], http_client=http_client,
+            timeout=LLM_REQUEST_TIMEOUT, max_retries=0
+        )
+        clients[key] = client
+    return client
+
+
+async def close_async_client():
+    """Cierra los clientes del loop actual (liberando sus conexiones)."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def get_sync_client(base_url=None, api_key=None):
+    """Cliente OpenAI síncrono compartido (storytelling y llamadas sueltas)."""
+    key = (base_url or LLM_BASE_URL, api_key or DEEPSEEK_API_KEY)
+    with _sync_lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            http_client = httpx.Client(http2=HTTP2_AVAILABLE, limits=_limits())
+            client = OpenAI(
+                api_key=key[1], base_url=key[0], http_client=http_client,
+                timeout=LLM_STORY_TIMEOUT
+            )
+            _sync_clients[key] = client
+        return client
+
+
+def classify_exception(exc):
+    """429, 5xx, timeouts y cortes de conexión indican saturación del proveedor."""
+    if isinstance(exc, (RateLimitError, APITimeoutError, APIConnectionError, asyncio.TimeoutError, CircuitOpenError)):
+        return OUTCOME_OVERLOAD
+    if isinstance(exc, APIStatusError) and exc.status_code >= 500:
+        return OUTCOME_OVERLOAD
+    return OUTCOME_ERROR
+
+
+def is_retryable(exc):
+    """Los fallos de saturación son transitorios y merecen reintento; un 400 no."""
+    return classify_exception(exc) == OUTCOME_OVERLOAD
+
+
+def run_sync(coro):
+    """
+    Ejecuta una corrutina desde código síncrono (run_pipeline, scripts).
+    Si ya hay un loop corriendo en este hilo, se usa un hilo auxiliar con su propio loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+class LLMEngine:
+    """
+    Motor asíncrono de peticiones al LLM.
+    - Un único cliente con pool de conexiones por event loop.
+    - Un controlador AIMD (AdaptiveLimiter) decide cuántas peticiones hay en vuelo.
+    - Un circuit breaker pausa todo el pool cuando el proveedor está caído.
+    - map() reparte los elementos entre un número fijo de workers (no crea una tarea por fila).
+    - retry_failed() drena al final de la fase la cola de elementos con fallos transitorios.
+    - Hedging opcional (hedge=True / LLM_HEDGE_ENABLED): una petición que no responde en el
+      p95 de latencia se duplica; gana la primera respuesta y la otra se cancela.
+    """
+
+    def __init__(self, max_concurrency=None, limiter=None, breaker=None, base_url=None, api_key=None,
+                 hedge=None, hedger=None):
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.base_url = base_url # None = LLM_BASE_URL
+        self.api_key = api_key
+        self.limiter = limiter or AdaptiveLimiter(max_limit=self.max_concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.retried = 0
+        self.recovered = 0
+        hedge = LLM_HEDGE_ENABLED if hedge is None else hedge
+        self.hedger = hedger or (Hedger() if hedge else None)
+        self.telemetry = JobTelemetry()
+
+    async def chat(self, messages, max_tokens, temperature=0):
+        """Una chat completion (un solo intento, con hedging si está activo). Devuelve (contenido, total_tokens)."""
+        if self.hedger is None:
+            return await self._attempt(messages, max_tokens, temperature)
+        return await self._hedged(messages, max_tokens, temperature)
+
+    async def _hedged(self, messages, max_tokens, temperature):
+        hedger = self.hedger
+        hedger.requests += 1
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._attempt(messages, max_tokens, temperature))
+        delay = hedger.delay()
+        if delay is None or not hedger.allow():
+            result = await primary
+            hedger.record(time.monotonic() - started)
+            return result
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not hedger.allow():
+            result = await primary
+            hedger.record(time.monotonic() - started)
+            return result
+
+        # La original va por la cola lenta: duplicado, gana la primera respuesta válida
+        hedger.hedged += 1
+        backup = asyncio.ensure_future(self._attempt(messages, max_tokens, temperature))
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        hedger.record(time.monotonic() - started, hedged=True, hedge_won=task is backup)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, messages, max_tokens, temperature=0):
+        """Un único intento contra el endpoint configurado."""
+        probe = await self.breaker.wait_ready()
+        started = await self.limiter.acquire()
+        outcome = OUTCOME_OK
+        try:
+            response = await get_async_client(self.base_url, self.api_key).chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except asyncio.CancelledError as e:
+            # Perdió la carrera del hedging: no cuenta como fallo del proveedor
+            outcome = OUTCOME_CANCELLED
+            self.breaker.record_failure(False, probe=probe)
+            self._record(started, e)
+            raise
+        except Exception as e:
+            outcome = classify_exception(e)
+            self.breaker.record_failure(outcome == OUTCOME_OVERLOAD, probe=probe)
+            self._record(started, e)
+            raise
+        finally:
+            await self.limiter.release(started, outcome)
+        self.breaker.record_success(probe=probe)
+        self._record(started, usage=response.usage)
+        return response.choices[0].message.content, response.usage.total_tokens
+
+    def _record(self, started, exc=None, usage=None, endpoint=None):
+        """Telemetría de un intento: latencia, código de estado y tokens."""
+        if endpoint is None:
+            endpoint = urlparse(self.base_url or LLM_BASE_URL).netloc
+        self.telemetry.record(
+            time.monotonic() - started, status_label(exc),
+            getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0, endpoint
+        )
+
+    async def retry_failed(self, func, items, results, needs_retry, max_attempts=None):
+        """
+        Cola de reintentos: vuelve a lanzar `func` sobre los elementos cuyo resultado
+        cumple `needs_retry`, con backoff exponencial + jitter entre rondas. Cada
+        elemento espera su propio retardo en una corrutina aparte, así que un
+        reintento lento no bloquea a los demás. Modifica `results` in situ.
+        """
+        max_attempts = max_attempts or LLM_MAX_ATTEMPTS
+        queue = [i for i, res in enumerate(results) if needs_retry(res)]
+        attempt = 1
+        while queue and attempt < max_attempts:
+            print(f"[LLM] Reintento {attempt}/{max_attempts - 1}: {len(queue)} elementos en cola.")
+            self.retried += len(queue)
+            self.telemetry.record_retries(len(queue))
+
+            async def retry_one(i, attempt=attempt):
+                await asyncio.sleep(backoff_delay(attempt))
+                return await func(items[i])
+
+            retry_results = await self.map(retry_one, queue)
+            next_queue = []
+            for i, res in zip(queue, retry_results):
+                results[i] = res
+                if needs_retry(res):
+                    next_queue.append(i)
+                else:
+                    self.recovered += 1
+            queue = next_queue
+            attempt += 1
+        return len(queue)
+
+    def snapshot(self):
+        """Estado del controlador de concurrencia (para job_status)."""
+        snap = self.limiter.snapshot()
+        snap["circuit"] = self.breaker.state
+        snap["circuit_opened"] = self.breaker.times_opened
+        snap["retried"] = self.retried
+        snap["recovered"] = self.recovered
+        if self.hedger is not None:
+            snap["hedging"] = self.hedger.snapshot()
+        return snap
+
+    async def map(self, func, items, on_result=None):
+        """
+        Aplica la corrutina `func` a cada elemento con concurrencia acotada.
+        Conserva el orden de entrada. `on_result(i, res)` se llama al completar cada uno.
+        """
+        results = [None] * len(items)
+        pending = iter(enumerate(items))
+
+        async def worker():
+            for i, item in pending:
+                results[i] = await func(item)
+                if on_result:
+                    on_result(i, results[i])
+
+        n_workers = min(self.max_concurrency, len(items))
+        await asyncio.gather(*(worker() for _ in range(n_workers)))
+        return results
+
+    def run(self, coro):
+        """Ejecuta una corrutina del motor desde código síncrono y cierra después su pool de conexiones."""
+        async def _main():
+            try:
+                return await coro
+            finally:
+                await close_async_client()
+        return run_sync(_main())
@@ -0,0 +1,92 @@
+import time
+
+from llm_checkpoint import VALID_SENTIMENTS
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Publicar en job_status recuentos parciales mientras la fase LLM avanza
+LLM_PREVIEW_ENABLED = getattr(_config, "LLM_PREVIEW_ENABLED", True)
+# Como mucho una publicación cada N segundos
+LLM_PREVIEW_SECONDS = getattr(_config, "LLM_PREVIEW_SECONDS", 2.0)
+# La vista previa se marca "stable" cuando ninguna proporción global se movió más que esto
+LLM_PREVIEW_STABLE_DELTA = getattr(_config, "LLM_PREVIEW_STABLE_DELTA", 0.02)
+
+
+def normalize_platforms(df):
+    """Plataforma de cada fila normalizada igual que en analysis.py (minúsculas, sin espacios)."""
+    if "platform" not in df.columns:
+        return [""] * len(df)
+    return df["platform"].map(str).str.lower().str.strip().tolist()
+
+
+class PartialStats:
+    """
+    Recuentos parciales de sentimiento (global y por plataforma) de la fase LLM.
+
+    Cada resultado se suma a todas las filas que lo comparten (duplicados exactos y
+    casi-duplicados) y, cada LLM_PREVIEW_SECONDS, se publica en job_status.llm_preview
+    con el mismo formato que global_counts/by_platform del análisis final. `max_shift`
+    es el mayor cambio de proporción global desde la publicación anterior: cuando baja
+    de LLM_PREVIEW_STABLE_DELTA la vista previa se marca como estable.
+    writer: BackgroundWriter para publicar sin bloquear el event loop (None = en el momento).
+    """
+
+    def __init__(self, platforms, db=None, topic=None, interval=None, stable_delta=None, writer=None):
+        self.platforms = platforms
+        self.db = db
+        self.topic = topic
+        self.writer = writer
+        self.interval = LLM_PREVIEW_SECONDS if interval is None else interval
+        self.stable_delta = LLM_PREVIEW_STABLE_DELTA if stable_delta is None else stable_delta
+        self.global_counts = {}
+        self.by_platform = {}
+        self.classified_rows = 0
+        self.publications = 0
+        self._last_shares = {}
+        self._last_publish = 0.0
+
+    def add(self, rows, res):
+        """Suma el resultado `res` a las filas (índices del DataFrame) indicadas."""
+        label = res.get("sentiment")
+        if label not in VALID_SENTIMENTS:
+            return
+        for n in rows:
+            p = self.platforms[n]
+            self.global_counts[label] = self.global_counts.get(label, 0) + 1
+            counts = self.by_platform.setdefault(p, {})
+            counts[label] = counts.get(label, 0) + 1
+        self.classified_rows += len(rows)
+        self.maybe_publish()
+
+    def snapshot(self):
+        total = self.classified_rows
+        shares = {k: v / total for k, v in self.global_counts.items()} if total else {}
+        labels = set(shares) | set(self._last_shares)
+        max_shift = max((abs(shares.get(k, 0.0) - self._last_shares.get(k, 0.0)) for k in labels), default=1.0)
+        return {
+            "global_counts": dict(self.global_counts),
+            "global_percents": {k: f"{v * 100:.1f}%" for k, v in shares.items()},
+            "by_platform": {p: dict(c) for p, c in self.by_platform.items()},
+            "classified_rows": total,
+            "total_rows": len(self.platforms),
+            "max_shift": round(max_shift, 4),
+            "stable": bool(self.publications) and max_shift < self.stable_delta,
+        }, shares
+
+    def maybe_publish(self, force=False):
+        if self.db is None or not self.topic:
+            return
+        if not force and time.monotonic() - self._last_publish < self.interval:
+            return
+        self._last_publish = time.monotonic()
+        preview, shares = self.snapshot()
+        preview["final"] = force
+        if self.writer is not None:
+            self.writer.submit(self.db.update_llm_preview, self.topic, preview)
+        else:
+            self.db.update_llm_preview(self.topic, preview)
+        self._last_shares = shares
+        self.publications += 1
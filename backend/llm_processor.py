@@ -1,24 +1,170 @@
 import os
+import re
 import json
+import time
+import hashlib
 import pandas as pd
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
-# Importar claves desde config
+from llm_cache import SentimentCache
+from llm_checkpoint import CheckpointWriter, compute_row_ids
+from llm_writer import BackgroundWriter
+from llm_preview import LLM_PREVIEW_ENABLED, PartialStats, normalize_platforms
+from llm_triage import LLM_TRIAGE_ENABLED, triage_rows, triage_stats
+from local_classifier import CASCADE_CONFIDENCE, LLM_CASCADE_MODE, get_local_classifier
+from near_dup import NEAR_DUP_ENABLED, cluster_near_duplicates
+from llm_engine import (
+    DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, LLM_BASE_URL, LLM_MODEL, get_sync_client, is_retryable,
+)
+from llm_router import LLM_ENDPOINTS, create_engine, routed_model_key, sync_endpoint
+from prompt_builder import (
+    LLM_PRIORITY_ORDER, PROMPT_CONTEXT_MAX_CHARS, PROMPT_MAX_CHARS, PromptItem, build_items, clean_value,
+    compose_text, flat_text, plan_requests, prioritize_units,
+)
+
 try:
-    from config import DEEPSEEK_API_KEY
+    import config as _config
 except ImportError:
-    DEEPSEEK_API_KEY = ""
+    _config = None
+
+# Subir esta versión cada vez que cambie el system prompt: invalida la caché de sentimientos
+PROMPT_VERSION = "sentiment-v1"
+# Ídem para el prompt del storytelling (invalida los informes memoizados)
+STORY_PROMPT_VERSION = "story-v1"
+
+# Modo por lotes: N comentarios por petición (0 = una petición por fila)
+LLM_BATCH_SIZE = getattr(_config, "LLM_BATCH_SIZE", 0)
+LLM_BATCH_TOKEN_BUDGET = getattr(_config, "LLM_BATCH_TOKEN_BUDGET", 3000) # Tokens de entrada aprox. por lote
+BATCH_OUTPUT_TOKENS_PER_ITEM = 80
+
+# Modo ligero: el modelo solo devuelve la etiqueta (y una confianza 0-9), sin explicación.
+# Las explicaciones se generan bajo demanda (POST /explain) y se guardan en la caché.
+LLM_LEAN_MODE = getattr(_config, "LLM_LEAN_MODE", False)
+LEAN_OUTPUT_TOKENS = 8
+LEAN_OUTPUT_TOKENS_PER_ITEM = 8
+LEAN_LABELS = {"pos": "Positivo", "neg": "Negativo", "neu": "Neutro"}
+_LEAN_RE = re.compile(r"\b(pos|neg|neu)\w*\W*(\d)?", re.IGNORECASE)
+_LEAN_LINE_RE = re.compile(r"^\W*(\d+)\W+(pos|neg|neu)\w*\W*(\d)?", re.IGNORECASE)
+
+LLM_CACHE_MAX_ITEMS = getattr(_config, "LLM_CACHE_MAX_ITEMS", 50000)
+LLM_CACHE_TTL_DAYS = getattr(_config, "LLM_CACHE_TTL_DAYS", 30)
+
+# Storytelling: reutilizar el informe si el stats_package y el tema no cambiaron
+STORY_CACHE_ENABLED = getattr(_config, "STORY_CACHE_ENABLED", True)
+# Publicar el informe en analysis_results a medida que se genera (stream de tokens)
+STORY_STREAMING = getattr(_config, "STORY_STREAMING", True)
+STORY_STREAM_FLUSH_SECONDS = getattr(_config, "STORY_STREAM_FLUSH_SECONDS", 0.5)
+
+_shared_caches = {} # (versión de prompt, modelo) -> SentimentCache
+_story_memory = {} # clave -> informe (por proceso, delante de la colección story_cache)
+
+
+def story_cache_key(topic, stats):
+    """Hash de (modelo, versión del prompt, tema, stats_package): mismo resultado -> mismo informe."""
+    payload = json.dumps(stats, sort_keys=True, ensure_ascii=False, default=str)
+    raw = f"{LLM_MODEL}|{STORY_PROMPT_VERSION}|{topic}|{payload}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def cache_model_key(base_url=None):
+    """
+    Modelo (y endpoint) que identifica las entradas de la caché de sentimientos.
+    None si el router reparte entre modelos distintos: esas respuestas no se cachean.
+    """
+    if base_url is None and LLM_ENDPOINTS:
+        return routed_model_key()
+    # Otro endpoint (stub, self-hosted) no comparte entradas con DeepSeek
+    base_url = base_url or LLM_BASE_URL
+    return LLM_MODEL if base_url == DEEPSEEK_BASE_URL else f"{LLM_MODEL}@{base_url}"
+
+def get_shared_cache(db=None, lean=False, base_url=None):
+    """
+    Caché de sentimientos compartida por todo el proceso (la API reutiliza el LRU
+    en memoria entre ejecuciones). Si se pasa una BD conectada, se engancha como
+    nivel persistente. El modo ligero tiene su propia caché (otra versión de prompt):
+    sus resultados no traen explicación y los del modo completo no traen confianza.
+    Devuelve None (sin caché) si LLM_ENDPOINTS mezcla modelos.
+    """
+    model_key = cache_model_key(base_url)
+    if model_key is None:
+        print("[LLM] LLM_ENDPOINTS mezcla modelos distintos: caché de sentimientos desactivada")
+        return None
+    prompt_version = PROMPT_VERSION + ("-lean" if lean else "")
+    cache = _shared_caches.get((prompt_version, model_key))
+    if cache is None:
+        cache = _shared_caches[(prompt_version, model_key)] = SentimentCache(
+            model_key, prompt_version,
+            max_items=LLM_CACHE_MAX_ITEMS,
+            ttl_seconds=LLM_CACHE_TTL_DAYS * 86400,
+        )
+    if db is not None and db.is_connected:
+        cache.db = db
+    return cache
 
 class LLMProcessor:
-    def __init__(self):
+    def __init__(self, cache=None, base_url=None, api_key=None, lean=None):
+        """
+        base_url: endpoint compatible con OpenAI (None = LLM_BASE_URL), p.ej. el stub
+        local de llm_stub_server.py. Un endpoint propio no necesita la clave de DeepSeek.
+        lean: pedir solo la etiqueta y una confianza, sin explicación (None = LLM_LEAN_MODE).
+        Con LLM_ENDPOINTS (y sin base_url) las llamadas asíncronas van por el router y las
+        síncronas al primer endpoint sano, con su clave y su modelo (ver _sync_target).
+        """
+        self.cache = cache
+        self.base_url = base_url
+        self.lean = LLM_LEAN_MODE if lean is None else lean
+        is_local = (base_url or LLM_BASE_URL) != DEEPSEEK_BASE_URL
+        # Con varios endpoints (LLM_ENDPOINTS) las claves las lleva cada endpoint del router
+        self.routed = base_url is None and bool(LLM_ENDPOINTS)
+        self.api_key = api_key or DEEPSEEK_API_KEY or ("local" if is_local or self.routed else "")
         self.system_prompt = (
             "Eres un analista de sentimientos experto. "
             "Tu tarea es clasificar el siguiente texto de una red social. "
             "Responde SOLAMENTE un objeto JSON con dos claves: "
             "'sentiment' (Positivo, Negativo, Neutro) y 'explanation' (breve explicación de por qué en español)."
         )
+        self.batch_system_prompt = (
+            "Eres un analista de sentimientos experto. "
+            "Recibirás una lista JSON de textos de redes sociales, cada uno con un 'id'. "
+            "Clasifica CADA texto de forma independiente. "
+            "Responde SOLAMENTE un array JSON con un objeto por texto y las claves: "
+            "'id' (el mismo id recibido), 'sentiment' (Positivo, Negativo, Neutro) y "
+            "'explanation' (breve explicación de por qué en español)."
+        )
+        self.group_system_prompt = (
+            "Eres un analista de sentimientos experto. "
+            "Recibirás el texto de un post de una red social como CONTEXTO y una lista JSON "
+            "de comentarios a ese post, cada uno con un 'id'. "
+            "Clasifica el sentimiento de CADA comentario (no del post), usando el post solo para entenderlo. "
+            "Responde SOLAMENTE un array JSON con un objeto por comentario y las claves: "
+            "'id' (el mismo id recibido), 'sentiment' (Positivo, Negativo, Neutro) y "
+            "'explanation' (breve explicación de por qué en español)."
+        )
+        self.lean_system_prompt = (
+            "Eres un analista de sentimientos experto. "
+            "Clasifica el siguiente texto de una red social. "
+            "Responde SOLAMENTE la etiqueta (pos, neg o neu) y tu confianza del 0 al 9, p.ej.: neg 8"
+        )
+        self.lean_batch_system_prompt = (
+            "Eres un analista de sentimientos experto. "
+            "Recibirás una lista JSON de textos de redes sociales, cada uno con un 'id'. "
+            "Clasifica CADA texto de forma independiente. "
+            "Responde SOLAMENTE una línea por texto con el id, la etiqueta (pos, neg o neu) "
+            "y tu confianza del 0 al 9, p.ej.:\n0 neg 8\n1 pos 6"
+        )
+        self.lean_group_system_prompt = (
+            "Eres un analista de sentimientos experto. "
+            "Recibirás el texto de un post de una red social como CONTEXTO y una lista JSON "
+            "de comentarios a ese post, cada uno con un 'id'. "
+            "Clasifica el sentimiento de CADA comentario (no del post), usando el post solo para entenderlo. "
+            "Responde SOLAMENTE una línea por comentario con el id, la etiqueta (pos, neg o neu) "
+            "y tu confianza del 0 al 9, p.ej.:\n0 neg 8\n1 pos 6"
+        )
+        self.explain_system_prompt = (
+            "Eres un analista de sentimientos experto. "
+            "Te daré un texto de una red social y el sentimiento con el que se clasificó. "
+            "Explica en una o dos frases, en español, por qué tiene ese sentimiento. "
+            "Responde solo la explicación."
+        )
 
     def _safe_json_parse(self, text):
         try:
@@ -28,37 +174,273 @@ class LLMProcessor:
         except:
             return {"sentiment": "Error", "explanation": "Falló el parsing JSON: " + text[:50]}
 
+    def _parse_lean(self, text):
+        """Respuesta del modo ligero ('neg 8') -> resultado con etiqueta y confianza, sin explicación."""
+        match = _LEAN_RE.search(text or "")
+        if not match:
+            return {"sentiment": "Error", "explanation": "Respuesta sin etiqueta: " + str(text)[:50]}
+        result = {"sentiment": LEAN_LABELS[match.group(1).lower()], "explanation": ""}
+        if match.group(2):
+            result["confidence"] = round(int(match.group(2)) / 9, 2)
+        return result
+
+    def _single_messages(self, text):
+        return [
+            {"role": "system", "content": self.lean_system_prompt if self.lean else self.system_prompt},
+            {"role": "user", "content": f"Texto: {text}"}
+        ]
+
+    @property
+    def single_max_tokens(self):
+        return LEAN_OUTPUT_TOKENS if self.lean else 200
+
+    def _cached(self, text, load=False):
+        # Consultar la caché ANTES de cualquier llamada HTTP. Desde el event loop solo se
+        # mira la memoria (ya precargada); load=True consulta MongoDB (llamadas síncronas).
+        if self.cache is None:
+            return None
+        if load:
+            self.cache.prefetch([text])
+        return self.cache.get(text)
+
+    def _finish_single(self, text, content, total_tokens):
+        result = self._parse_lean(content) if self.lean else self._safe_json_parse(content)
+        # Inyectar tokens en el resultado
+        if isinstance(result, dict):
+            if self.cache is not None:
+                self.cache.set(text, result)
+            result['tokens'] = total_tokens
+        return result
+
+    def _sync_target(self):
+        """(cliente síncrono, modelo) para las llamadas sueltas."""
+        if self.routed:
+            base_url, api_key, model = sync_endpoint()
+            return get_sync_client(base_url, api_key), model
+        return get_sync_client(self.base_url, self.api_key), LLM_MODEL
+
     def analyze_with_deepseek(self, text):
-        if not DEEPSEEK_API_KEY: return {"sentiment": "N/A", "explanation": "Falta DEEPSEEK_API_KEY"}
+        """Clasificación síncrona de un texto (llamadas sueltas / scripts)."""
+        cached = self._cached(text, load=True)
+        if cached is not None:
+            return cached
+
+        if not self.api_key: return {"sentiment": "N/A", "explanation": "Falta DEEPSEEK_API_KEY"}
         try:
-            # DeepSeek es compatible con OpenAI Client
-            client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+            # DeepSeek es compatible con OpenAI Client (cliente compartido, con keep-alive)
+            client, model = self._sync_target()
             response = client.chat.completions.create(
-                model="deepseek-chat", # DeepSeek V3 (Chat)
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": f"Texto: {text}"}
-                ],
+                model=model,
+                messages=self._single_messages(text),
                 temperature=0,
-                max_tokens=200 
+                max_tokens=self.single_max_tokens
             )
-            
-            # Capturar uso de tokens
-            usage = response.usage
-            total_tokens = usage.total_tokens
-            
-            result = self._safe_json_parse(response.choices[0].message.content)
-            # Inyectar tokens en el resultado
-            if isinstance(result, dict):
-                result['tokens'] = total_tokens
+            result = self._finish_single(text, response.choices[0].message.content, response.usage.total_tokens)
+            if self.cache is not None:
+                self.cache.flush() # Llamada suelta: se guarda en MongoDB en el momento
             return result
 
         except Exception as e:
             return {"sentiment": "Error", "explanation": str(e), "tokens": 0}
 
-    def generate_storytelling(self, topic, stats):
+    async def analyze_text_async(self, text, engine):
+        """Igual que analyze_with_deepseek pero a través del motor asíncrono compartido."""
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
+
+        if not self.api_key: return {"sentiment": "N/A", "explanation": "Falta DEEPSEEK_API_KEY"}
+        try:
+            content, total_tokens = await engine.chat(self._single_messages(text), max_tokens=self.single_max_tokens)
+            return self._finish_single(text, content, total_tokens)
+        except Exception as e:
+            # 'retryable' manda la fila a la cola de reintentos del final de la fase
+            return {"sentiment": "Error", "explanation": str(e), "tokens": 0, "retryable": is_retryable(e)}
+
+    def _parse_batch(self, text, n):
+        """Valida la respuesta de un lote: array JSON con exactamente los ids 0..n-1."""
+        if self.lean:
+            return self._parse_lean_batch(text, n)
+        try:
+            clean = text.replace("```json", "").replace("```", "").strip()
+            data = json.loads(clean)
+            if isinstance(data, dict):
+                # Algunos modelos envuelven el array: {"results": [...]}
+                data = next((v for v in data.values() if isinstance(v, list)), None)
+            if not isinstance(data, list):
+                return None
+            by_id = {}
+            for item in data:
+                if isinstance(item, dict) and "sentiment" in item:
+                    by_id[int(item.get("id"))] = item
+            if set(by_id) != set(range(n)):
+                return None
+            return [by_id[i] for i in range(n)]
+        except:
+            return None
+
+    def _parse_lean_batch(self, text, n):
+        """Respuesta de un lote en modo ligero: una línea 'id etiqueta confianza' por texto."""
+        by_id = {}
+        for line in (text or "").splitlines():
+            match = _LEAN_LINE_RE.match(line)
+            if match:
+                item = {"sentiment": LEAN_LABELS[match.group(2).lower()], "explanation": ""}
+                if match.group(3):
+                    item["confidence"] = round(int(match.group(3)) / 9, 2)
+                by_id[int(match.group(1))] = item
+        if set(by_id) != set(range(n)):
+            return None
+        return [by_id[i] for i in range(n)]
+
+    async def _request_batch(self, texts, engine, context=None):
+        """Una única petición para varios textos. Devuelve (lista de resultados | None, tokens)."""
+        payload = json.dumps([{"id": i, "text": t} for i, t in enumerate(texts)], ensure_ascii=False)
+        if context:
+            # El post viaja UNA vez por petición, no una vez por comentario
+            messages = [
+                {"role": "system", "content": self.lean_group_system_prompt if self.lean else self.group_system_prompt},
+                {"role": "user", "content": f"Post (contexto): {context[:PROMPT_CONTEXT_MAX_CHARS]}\nComentarios: {payload}"}
+            ]
+        else:
+            messages = [
+                {"role": "system", "content": self.lean_batch_system_prompt if self.lean else self.batch_system_prompt},
+                {"role": "user", "content": f"Textos: {payload}"}
+            ]
+        per_item = LEAN_OUTPUT_TOKENS_PER_ITEM if self.lean else BATCH_OUTPUT_TOKENS_PER_ITEM
+        content, total_tokens = await engine.chat(
+            messages,
+            max_tokens=min(8000, 50 + per_item * len(texts))
+        )
+        return self._parse_batch(content, len(texts)), total_tokens
+
+    async def analyze_batch_async(self, texts, engine, context=None, keys=None):
+        """
+        Clasifica varios textos en una sola petición (mismo orden que `texts`).
+        context: post compartido por todos los textos (modo agrupado por post).
+        keys: texto autocontenido de cada elemento, usado como clave de caché y en
+        el modo individual (por defecto, los propios textos).
+        Si la respuesta viene malformada, parte el lote por la mitad y reintenta;
+        un lote de 1 elemento cae al modo individual. Los tokens de cada petición
+        (incluidas las fallidas) se imputan a las filas en proporción a su longitud.
+        """
+        keys = keys or texts
+        results = [None] * len(texts)
+        pending = []
+        for i, t in enumerate(keys):
+            cached = self._cached(t)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+
+        if not pending:
+            return results
+        if not self.api_key:
+            for i in pending:
+                results[i] = {"sentiment": "N/A", "explanation": "Falta DEEPSEEK_API_KEY"}
+            return results
+
+        extra_tokens = [0.0] * len(texts) # Tokens de intentos fallidos a repartir
+        stack = [pending]
+        while stack:
+            idxs = stack.pop()
+            if len(idxs) == 1:
+                i = idxs[0]
+                res = await self.analyze_text_async(keys[i], engine)
+                res['tokens'] = res.get('tokens', 0) + round(extra_tokens[i])
+                results[i] = res
+                continue
+
+            sub_texts = [texts[i] for i in idxs]
+            weights = [len(t) or 1 for t in sub_texts]
+            total_w = sum(weights)
+            try:
+                parsed, total_tokens = await self._request_batch(sub_texts, engine, context=context)
+            except Exception as e:
+                if is_retryable(e):
+                    # Saturación del proveedor: partir el lote no ayuda, va entero a la cola de reintentos
+                    for i in idxs:
+                        results[i] = {"sentiment": "Error", "explanation": str(e), "tokens": round(extra_tokens[i]), "retryable": True}
+                    continue
+                parsed, total_tokens = None, 0
+                print(f"[LLM Batch] Error en lote de {len(idxs)}: {e}")
+
+            if parsed is None:
+                for i, w in zip(idxs, weights):
+                    extra_tokens[i] += total_tokens * w / total_w
+                mid = len(idxs) // 2
+                stack.append(idxs[mid:])
+                stack.append(idxs[:mid])
+                continue
+
+            for i, w, item in zip(idxs, weights, parsed):
+                res = {"sentiment": item.get("sentiment", "Error"), "explanation": item.get("explanation", "")}
+                if "confidence" in item:
+                    res["confidence"] = item["confidence"]
+                if self.cache is not None:
+                    self.cache.set(keys[i], res)
+                res['tokens'] = round(total_tokens * w / total_w + extra_tokens[i])
+                results[i] = res
+        return results
+
+    def explain(self, text, sentiment=None):
+        """
+        Explicación bajo demanda de la clasificación de un texto (filas clasificadas en
+        modo ligero). Si la caché ya tiene una explicación (la del modo ligero o, para la
+        misma etiqueta, la del modo completo), no se llama al LLM; si no, se genera para la
+        etiqueta guardada (o la indicada) y se guarda en la caché.
+        Devuelve el resultado {'sentiment', 'explanation', 'tokens'} ('cached' si vino de la caché).
+        """
+        cached = self._cached(text, load=True)
+        if cached is not None and cached.get("explanation"):
+            return cached
+        full_cache = None
+        if self.cache is not None:
+            full_cache = self.cache if not self.lean else get_shared_cache(self.cache.db, lean=False, base_url=self.base_url)
+        if self.lean and full_cache is not None:
+            # Filas clasificadas en modo completo (antes de activar el modo ligero)
+            full_cache.prefetch([text])
+            full_hit = full_cache.get(text)
+            if full_hit and full_hit.get("explanation") and (not sentiment or full_hit.get("sentiment") == sentiment):
+                return full_hit
+        sentiment = sentiment or (cached or {}).get("sentiment")
+        if not sentiment:
+            # Texto nunca clasificado: clasificación completa (etiqueta + explicación)
+            full = LLMProcessor(cache=full_cache, base_url=self.base_url, api_key=self.api_key, lean=False)
+            return full.analyze_with_deepseek(text)
+
+        if not self.api_key: return {"sentiment": sentiment, "explanation": "Falta DEEPSEEK_API_KEY", "tokens": 0}
+        try:
+            client, model = self._sync_target()
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": self.explain_system_prompt},
+                    {"role": "user", "content": f"Texto: {text}\nSentimiento: {sentiment}"}
+                ],
+                temperature=0,
+                max_tokens=200
+            )
+        except Exception as e:
+            return {"sentiment": sentiment, "explanation": f"No se pudo generar la explicación: {e}", "tokens": 0}
+        result = {"sentiment": sentiment, "explanation": (response.choices[0].message.content or "").strip()}
+        if cached and "confidence" in cached:
+            result["confidence"] = cached["confidence"]
+        if self.cache is not None:
+            self.cache.set(text, result)
+            self.cache.flush() # Llamada suelta: se guarda en MongoDB en el momento
+        result["tokens"] = response.usage.total_tokens
+        return result
+
+    def generate_storytelling(self, topic, stats, db=None, stream=None, on_text=None):
         """
         Genera un reporte narrativo (storytelling) basado en estadísticas agregadas.
+        Memoizado por story_cache_key (memoria + colección story_cache si hay db): con el
+        mismo stats_package no se vuelve a llamar al LLM.
+        stream: pedir la respuesta en streaming (None = STORY_STREAMING); el texto acumulado
+        se publica en la colección story_streams (si hay db) y se pasa a on_text(texto)
+        como mucho cada STORY_STREAM_FLUSH_SECONDS.
         stats format expected:
         {
             "global": {"Positivo": 10, "Negativo": 5, ...},
@@ -70,8 +452,22 @@ class LLMProcessor:
             "top_negative_examples": [...]
         }
         """
-        if not DEEPSEEK_API_KEY: return "Error: No API Key."
-        
+        if not self.api_key: return "Error: No API Key."
+        db = db if db is not None and db.is_connected else None
+        stream = STORY_STREAMING if stream is None else stream
+
+        key = story_cache_key(topic, stats)
+        if STORY_CACHE_ENABLED:
+            story = _story_memory.get(key) or (db.get_story_cache(key) if db is not None else None)
+            if story:
+                print("[Story] Estadísticas sin cambios: se reutiliza el informe anterior.")
+                _story_memory[key] = story
+                if db is not None:
+                    db.update_story_stream(topic, story, done=True)
+                if on_text:
+                    on_text(story)
+                return story
+
         prompt = (
             f"Actúa como un analista de datos y sociólogo experto. "
             f"Se ha realizado un análisis de sentimiento en redes sociales sobre el tema: '{topic}'.\n\n"
@@ -84,49 +480,195 @@ class LLMProcessor:
             "Usa un tono profesional pero atrapante. No listes solo números, cuenta la historia detrás de ellos."
         )
 
+        if stream and db is not None:
+            # Vacía el informe del run anterior: los lectores del stream empiezan de cero
+            db.update_story_stream(topic, "", done=False)
         try:
-            client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+            client, model = self._sync_target()
             response = client.chat.completions.create(
-                model="deepseek-chat",
+                model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
-                max_tokens=600
+                max_tokens=600,
+                stream=stream
             )
-            return response.choices[0].message.content
+            if stream:
+                story = self._consume_story_stream(response, topic, db, on_text)
+            else:
+                story = response.choices[0].message.content
         except Exception as e:
-            return f"No se pudo generar el storytelling: {str(e)}"
+            story = f"No se pudo generar el storytelling: {str(e)}"
+            if db is not None:
+                db.update_story_stream(topic, story, done=True)
+            return story
+
+        if STORY_CACHE_ENABLED and story:
+            _story_memory[key] = story
+            if db is not None:
+                db.save_story_cache(key, topic, story)
+        return story
+
+    def _consume_story_stream(self, response, topic, db, on_text):
+        """Acumula los fragmentos del stream y publica el texto parcial periódicamente."""
+        parts = []
+        last_flush = time.monotonic()
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            if time.monotonic() - last_flush >= STORY_STREAM_FLUSH_SECONDS:
+                last_flush = time.monotonic()
+                if db is not None:
+                    db.update_story_stream(topic, "".join(parts), done=False)
+                if on_text:
+                    on_text("".join(parts))
+        story = "".join(parts)
+        if db is not None:
+            db.update_story_stream(topic, story, done=True)
+        if on_text:
+            on_text(story)
+        return story
 
     # --- RUTER PRINCIPAL ---
+    def build_item(self, row):
+        """
+        PromptItem de una fila: texto autocontenido (post recortado + comentario completo)
+        y, si la fila es un comentario, el post por separado como contexto del grupo.
+        """
+        post = clean_value(row.get('post_content', ''))
+        comment = clean_value(row.get('comment_content', ''))
+        group = (clean_value(row.get('platform', '')), clean_value(row.get('post_index', '')))
+        if not post and not comment:
+            text = self.build_text(row)
+            return PromptItem(text, "", text, group)
+        if not comment:
+            text = compose_text(post, "")
+            return PromptItem(text, "", text, group)
+        return PromptItem(compose_text(post, comment), post, comment[:PROMPT_MAX_CHARS], group)
+
+    def build_text(self, row):
+        """Construye el texto a clasificar para una fila (post + comentario o formato flat)."""
+        return flat_text(
+            str(row.get('post_content', '')), str(row.get('comment_content', '')),
+            str(row.get('content', '')), row.values
+        )
+
     def analyze_row(self, row):
-        # ... (código previo omitido para brevedad, no cambia lógica de limpieza) ...
-        # Combinamos contenido de post y comentario si existe, asegurando string
-        p_content = str(row.get('post_content', ''))
-        c_content = str(row.get('comment_content', ''))
-        
-        # Si el contenido está vacío en las columnas estándar, buscar en 'content' (formato flat)
-        if not p_content and not c_content:
-             content = str(row.get('content', ''))
+        # AHORA SIEMPRE USAMOS DEEPSEEK
+        return self.analyze_with_deepseek(self.build_item(row).text)
+
+async def classify_items_async(items, processor=None, engine=None, batch_size=None, on_progress=None,
+                               on_item_result=None, priority=None):
+    """
+    Clasifica una lista de PromptItem dentro de un event loop (usable directamente
+    desde un endpoint de FastAPI). Devuelve los resultados en el mismo orden.
+    on_progress(n): se llama con el número de elementos completados en cada paso.
+    on_item_result(i, res): se llama con el resultado definitivo de cada item en cuanto
+    se conoce (los que van a la cola de reintentos, al terminar de reintentarse).
+    priority: enviar las peticiones en orden de prioridad (prioritize_units) en lugar del
+    orden del DataFrame (None = LLM_PRIORITY_ORDER de config).
+    """
+    processor = processor or LLMProcessor(cache=get_shared_cache(lean=LLM_LEAN_MODE))
+    engine = engine or create_engine(base_url=processor.base_url, api_key=processor.api_key)
+    if batch_size is None:
+        batch_size = LLM_BATCH_SIZE
+
+    if priority is None:
+        priority = LLM_PRIORITY_ORDER
+    units = plan_requests(items, batch_size, LLM_BATCH_TOKEN_BUDGET)
+    if priority:
+        units = prioritize_units(items, units)
+    grouped = sum(len(idxs) for ctx, idxs in units if ctx)
+    print(f"[LLM] {len(items)} textos en {len(units)} peticiones ({grouped} comentarios agrupados por post).")
+
+    async def run_unit(unit):
+        context, idxs = unit
+        if len(idxs) == 1:
+            return [await processor.analyze_text_async(items[idxs[0]].text, engine)]
+        if context:
+            bodies = [items[i].body for i in idxs]
         else:
-             content = f"Post: {p_content} | Comment: {c_content}"
-             
-        # Lógica especial para LinkedIn (filas desplazadas) que queríamos conservar
-        if len(content) < 5 or "nan" in content.lower():
-            parts = []
-            for val in row.values:
-                s_val = str(val).strip()
-                if s_val and s_val.lower() not in ['nan', 'none', '', 'linkedin', 'post', 'comment', 'objetivo']:
-                    parts.append(s_val)
-            if parts:
-                content = " | ".join(parts)
-        
-        # Limitar longitud para ahorrar tokens y evitar errores
-        content = content[:1000] 
+            bodies = [items[i].text for i in idxs]
+        return await processor.analyze_batch_async(
+            bodies, engine, context=context, keys=[items[i].text for i in idxs]
+        )
 
-        # AHORA SIEMPRE USAMOS DEEPSEEK
-        return self.analyze_with_deepseek(content)
+    def on_unit_result(u, res_list):
+        if on_item_result:
+            for i, res in zip(units[u][1], res_list):
+                if not res.get("retryable", False):
+                    on_item_result(i, res)
+        if on_progress:
+            on_progress(len(res_list))
+
+    unit_results = await engine.map(run_unit, units, on_result=on_unit_result)
+    results = [None] * len(items)
+    for (_, idxs), res_list in zip(units, unit_results):
+        for i, res in zip(idxs, res_list):
+            results[i] = res
+
+    # Drenar la cola de reintentos (fila a fila) con los fallos transitorios
+    retry_idxs = [i for i, res in enumerate(results) if res.get("retryable", False)]
+    still_failing = await engine.retry_failed(
+        lambda item: processor.analyze_text_async(item.text, engine), items, results,
+        needs_retry=lambda res: res.get("retryable", False)
+    )
+    if on_item_result:
+        for i in retry_idxs:
+            on_item_result(i, results[i])
+    if still_failing:
+        print(f"[LLM] {still_failing} textos siguen fallando tras agotar los reintentos.")
+    return results
 
-def process_dataframe_concurrently(df):
-    processor = LLMProcessor()
+async def classify_texts_async(texts, processor=None, engine=None, batch_size=None, on_progress=None):
+    """Atajo de classify_items_async para textos sueltos (sin post de contexto)."""
+    items = [PromptItem(t, "", t, None) for t in texts]
+    return await classify_items_async(items, processor, engine, batch_size, on_progress)
+
+def process_dataframe_concurrently(df, topic=None, db=None, use_cache=True, batch_size=None, engine=None,
+                                   cascade=None, cascade_threshold=None, use_checkpoint=True, precomputed=None,
+                                   base_url=None, near_dup=None, preview=None, lean=None, triage=None):
+    """
+    Clasifica el sentimiento de todas las filas del DataFrame.
+    batch_size: textos por petición (None = LLM_BATCH_SIZE de config; 0/1 = modo fila a fila).
+    engine: LLMEngine a reutilizar (por defecto uno nuevo con LLM_MAX_CONCURRENCY).
+    cascade: primero el clasificador local; solo las filas con confianza < cascade_threshold
+             van al LLM (None = LLM_CASCADE_MODE / CASCADE_CONFIDENCE de config).
+    use_checkpoint: con db y topic, los resultados se guardan por fila en MongoDB a medida
+             que llegan y las filas ya clasificadas en una ejecución anterior no se reenvían.
+    precomputed: {texto: resultado} ya clasificados (p.ej. por StreamClassifier durante el
+             scraping); esos textos no se vuelven a enviar y conservan sus tokens.
+    base_url: endpoint compatible con OpenAI (None = LLM_BASE_URL; p.ej. el stub local).
+    near_dup: agrupar comentarios casi idénticos (MinHash/LSH) y clasificar uno por grupo
+             (None = NEAR_DUP_ENABLED). El tamaño del grupo de cada fila queda en 'near_dup_size'.
+    preview: con db y topic, publicar recuentos parciales (global y por plataforma) en
+             job_status.llm_preview a medida que llegan resultados (None = LLM_PREVIEW_ENABLED).
+    lean: modo ligero, solo etiqueta + confianza ('confidence_llm'); las explicaciones
+             quedan vacías y se piden después con LLMProcessor.explain (None = LLM_LEAN_MODE).
+    triage: resolver sin LLM las filas de relleno (placeholders, vacías, solo emojis, un
+             carácter) con las reglas por plataforma de llm_triage (None = LLM_TRIAGE_ENABLED).
+             La regla aplicada queda en la columna 'triage'.
+    """
+    if batch_size is None:
+        batch_size = LLM_BATCH_SIZE
+    if cascade is None:
+        cascade = LLM_CASCADE_MODE
+    if cascade_threshold is None:
+        cascade_threshold = CASCADE_CONFIDENCE
+    if near_dup is None:
+        near_dup = NEAR_DUP_ENABLED
+    if preview is None:
+        preview = LLM_PREVIEW_ENABLED
+    if triage is None:
+        triage = LLM_TRIAGE_ENABLED
+    if lean is None:
+        lean = LLM_LEAN_MODE
+    cache = get_shared_cache(db, lean=lean, base_url=base_url) if use_cache else None
+    processor = LLMProcessor(cache=cache, base_url=base_url, lean=lean)
+    # Checkpoint, vista previa y métricas se publican desde el event loop: sus escrituras
+    # a MongoDB van a un hilo aparte para no frenar las peticiones en vuelo
+    writer = BackgroundWriter()
     
     # Lista de resultados
     sentiments = []
@@ -135,16 +677,209 @@ def process_dataframe_concurrently(df):
     
     print(f"Iniciando análisis CONCURRENTE de {len(df)} registros con DEEPSEEK EXCLUSIVAMENTE...")
     
-    # Convertimos a lista de diccionarios para iterar
-    rows = [row for _, row in df.iterrows()]
+    # Checkpoint: las filas ya clasificadas en una ejecución anterior no se vuelven a enviar
+    row_ids = []
+    done = {}
+    checkpoint = None
+    if use_checkpoint and db is not None and topic:
+        row_ids = compute_row_ids(df)
+        stored = db.get_llm_checkpoint_results(topic)
+        done = {rid: stored[rid] for rid in row_ids if rid in stored}
+        checkpoint = CheckpointWriter(db, topic, writer=writer)
+        if done:
+            print(f"[Checkpoint] {len(done)} de {len(df)} filas ya clasificadas; se reanuda con las {len(df) - len(done)} restantes.")
+
+    # Construimos el prompt de cada fila una sola vez, por columnas (sin una Series por fila)
+    row_items = build_items(df)
+    texts = [item.text for item in row_items]
+    # Triaje: las filas de relleno se etiquetan (o se descartan) sin llamar al LLM
+    triaged = triage_rows(df, texts) if triage else [None] * len(df)
+    pending_rows = [n for n in range(len(df)) if triaged[n] is None and (not done or row_ids[n] not in done)]
+    if triage:
+        triage_summary = triage_stats(triaged, texts, {texts[n] for n in pending_rows})
+        if triage_summary["rows"]:
+            print(f"[Triage] {triage_summary['rows']} filas resueltas sin LLM ({triage_summary['skipped']} descartadas, {triage_summary['labeled']} etiquetadas) | Peticiones ahorradas: {triage_summary['calls_saved']} | {triage_summary['by_rule']}")
+        if db is not None and topic:
+            db.update_llm_metrics(topic, {"triage": triage_summary})
+
+    # Vista previa: recuentos parciales en job_status mientras se clasifica (en orden de prioridad)
+    partial = None
+    if preview and db is not None and topic:
+        partial = PartialStats(normalize_platforms(df), db, topic, writer=writer)
+        for n, rid in enumerate(row_ids):
+            if rid in done and triaged[n] is None:
+                partial.add([n], done[rid])
+        for n, res in enumerate(triaged):
+            if res is not None:
+                partial.add([n], res)
+
+    # Deduplicar: cada texto distinto se clasifica UNA vez
+    first_items = {}
+    rows_by_text = {}
+    for n in pending_rows:
+        item = row_items[n]
+        first_items.setdefault(item.text, item)
+        rows_by_text.setdefault(item.text, []).append(n)
+    unique_items = list(first_items.values())
+    unique_texts = [item.text for item in unique_items]
+    if cache is not None:
+        cache.reset_stats()
+        preloaded = cache.prefetch(unique_texts)
+        if preloaded:
+            print(f"[Cache] {preloaded} textos recuperados de MongoDB.")
+
+    # Textos ya clasificados en streaming durante el scraping
+    precomputed = {t: precomputed[t] for t in unique_texts if t in precomputed} if precomputed else {}
+    if precomputed:
+        print(f"[Stream] {len(precomputed)} de {len(unique_texts)} textos ya clasificados durante el scraping.")
+
+    llm_items = [item for item in unique_items if item.text not in precomputed]
+
+    # Casi-duplicados (copy-paste, variantes de emojis): se clasifica un representante por
+    # grupo y el resto hereda su etiqueta. Lo ya cacheado no entra: no cuesta nada.
+    # Los textos clasificados en streaming sí entran: si un grupo tiene alguno, ese hace
+    # de representante y el grupo queda igual que en una ejecución sin streaming.
+    near_dup_members = {} # texto representante -> [textos miembros que heredan su etiqueta]
+    rep_of = {} # texto -> representante de su grupo (para near_dup_size)
+    near_dup_stats = None
+    if near_dup and unique_items:
+        pool = [item for item in unique_items if cache is None or not cache.contains(item.text)]
+        clusters = {}
+        for idx, r in enumerate(cluster_near_duplicates([item.body for item in pool])):
+            clusters.setdefault(r, []).append(pool[idx].text)
+        sizes = []
+        for group in clusters.values():
+            if len(group) < 2:
+                continue
+            rep_text = next((t for t in group if t in precomputed), group[0])
+            # Los ya clasificados en streaming conservan su resultado (y sus tokens)
+            near_dup_members[rep_text] = [t for t in group if t != rep_text and t not in precomputed]
+            rep_of.update((t, rep_text) for t in group if t != rep_text)
+            sizes.append(len(group))
+        member_texts = {t for members in near_dup_members.values() for t in members}
+        llm_items = [item for item in llm_items if item.text not in member_texts]
+        near_dup_stats = {
+            "clusters": len(sizes),
+            "clustered_texts": sum(sizes),
+            "calls_saved": len(member_texts),
+            "largest": max(sizes, default=1),
+        }
+        if member_texts:
+            print(f"[NearDup] {near_dup_stats['clusters']} grupos de casi-duplicados: {len(member_texts)} textos heredan la etiqueta de su representante.")
+
+    # Modo cascada: el clasificador local resuelve lo que tiene claro (lo ya cacheado no se toca)
+    local_results = {}
+    local_fallback = {}
+    if cascade:
+        classifier = get_local_classifier(db)
+        candidates = [item for item in llm_items if cache is None or not cache.contains(item.text)]
+        # Se predice sobre el comentario solo (item.body), el mismo texto con el que se entrena
+        for item, (label, conf) in zip(candidates, classifier.predict([item.body for item in candidates])):
+            res = {"sentiment": label, "explanation": f"Clasificador local (confianza {conf:.2f})", "tokens": 0, "source": "local"}
+            if conf >= cascade_threshold:
+                local_results[item.text] = res
+            else:
+                local_fallback[item.text] = res
+        llm_items = [item for item in llm_items if item.text not in local_results]
+        escalation_rate = len(local_fallback) / len(candidates) if candidates else 0.0
+        cascade_stats = {
+            "threshold": cascade_threshold,
+            "model": "linear" if classifier.has_model else "lexicon",
+            "local": len(local_results),
+            "escalated": len(local_fallback),
+            "escalation_rate": round(escalation_rate, 4),
+        }
+        print(f"[Cascade] Local: {len(local_results)} | Escalados al LLM: {len(local_fallback)} ({escalation_rate:.1%})")
+
+    def record_result(text, res):
+        # Resultado definitivo de un texto: checkpoint por fila y vista previa (incluye sus casi-duplicados)
+        for t in [text] + near_dup_members.get(text, []):
+            if checkpoint is not None:
+                checkpoint.add([row_ids[n] for n in rows_by_text[t]], res if t == text else dict(res, tokens=0))
+            if partial is not None:
+                partial.add(rows_by_text[t], res)
+
+    for t, res in list(local_results.items()) + list(precomputed.items()):
+        record_result(t, res)
     
+    # Motor asíncrono: un solo pool de conexiones y concurrencia adaptativa (AIMD)
+    engine = engine or create_engine(base_url=base_url, api_key=processor.api_key)
+    last_report = [0.0]
+
+    with tqdm(total=len(llm_items), unit="posts") as bar:
+        def on_progress(n):
+            bar.update(n)
+            # Publicar límite actual y throughput en job_status (como mucho cada 2s)
+            if db is not None and topic and time.monotonic() - last_report[0] > 2:
+                last_report[0] = time.monotonic()
+                writer.submit(db.update_llm_metrics, topic, {"concurrency": engine.snapshot()})
+
+        try:
+            llm_results = engine.run(classify_items_async(
+                llm_items, processor=processor, engine=engine,
+                batch_size=batch_size, on_progress=on_progress,
+                on_item_result=lambda i, res: record_result(llm_items[i].text, res)
+            )) if llm_items else []
+        finally:
+            # Lo ya clasificado queda guardado aunque la fase se interrumpa
+            if checkpoint is not None:
+                checkpoint.flush()
+            if partial is not None:
+                partial.maybe_publish(force=True)
+            writer.close()
+            if cache is not None:
+                saved = cache.flush()
+                if saved:
+                    print(f"[Cache] {saved} resultados nuevos guardados en MongoDB.")
+
+    concurrency_stats = engine.snapshot()
+    print(f"[LLM] Concurrencia final: {concurrency_stats['limit']} | Throughput: {concurrency_stats['throughput_rps']} req/s | Saturaciones (429/5xx/timeout): {concurrency_stats['overload']}")
+    print(f"[LLM] Reintentos: {concurrency_stats['retried']} | Recuperados: {concurrency_stats['recovered']} | Aperturas del circuit breaker: {concurrency_stats['circuit_opened']}")
+    if db is not None and topic:
+        db.update_llm_metrics(topic, {"concurrency": concurrency_stats})
+    telemetry = engine.telemetry.snapshot()
+    print(f"[LLM] Latencia p50/p95/p99: {telemetry['p50_latency_s']}/{telemetry['p95_latency_s']}/{telemetry['p99_latency_s']}s | {telemetry['tokens_per_s']} tokens/s | Coste estimado: ${telemetry['cost_usd']}")
+    if db is not None and topic:
+        db.update_llm_metrics(topic, {"telemetry": telemetry})
+    hedge_stats = concurrency_stats.get("hedging")
+    if hedge_stats:
+        print(f"[LLM] Hedging: {hedge_stats['hedged']} duplicados ({hedge_stats['hedge_rate']:.1%}), {hedge_stats['hedge_wins']} ganados | Ahorro estimado: {hedge_stats['estimated_saved_s']}s | p99: {hedge_stats['p99_latency_s']}s")
+        if db is not None and topic:
+            db.update_llm_metrics(topic, {"hedging": hedge_stats})
+
+    by_text = dict(local_results)
+    by_text.update(precomputed)
+    for item, res in zip(llm_items, llm_results):
+        # Si el LLM no está disponible, la cascada deja terminar con la etiqueta local
+        if res.get('sentiment') in ("Error", "N/A") and item.text in local_fallback:
+            res = dict(local_fallback[item.text], explanation="Clasificador local (LLM no disponible)")
+        by_text[item.text] = res
+
+    if cascade and db is not None and topic:
+        db.update_llm_metrics(topic, {"cascade": cascade_stats})
+
+    # Repartir la etiqueta del representante a los miembros de su grupo
+    for rep_text, members in near_dup_members.items():
+        for member in members:
+            by_text[member] = dict(by_text[rep_text], tokens=0)
+    if near_dup_stats and db is not None and topic:
+        db.update_llm_metrics(topic, {"near_dup": near_dup_stats})
+
+    # Re-expandir a filas: los tokens solo se imputan a la primera aparición de cada texto
     results = []
-    # ThreadPool para hacer peticiones HTTP concurrentes
-    # DeepSeek NO tiene Rate Limit estricto. Subimos workers para mayor velocidad.
-    with ThreadPoolExecutor(max_workers=60) as executor:
-        # Usamos tqdm para barra de progreso sobre el iterador de resultados
-        for res in tqdm(executor.map(processor.analyze_row, rows), total=len(rows), unit="posts"):
-            results.append(res)
+    seen = set()
+    for n, t in enumerate(texts):
+        if triaged[n] is not None:
+            results.append(triaged[n])
+            continue
+        if done and row_ids[n] in done:
+            results.append(done[row_ids[n]])
+            continue
+        res = by_text[t]
+        if t in seen:
+            res = dict(res, tokens=0)
+        seen.add(t)
+        results.append(res)
     
     # Desempaquetar
     for res in results:
@@ -155,10 +890,39 @@ def process_dataframe_concurrently(df):
     df['sentiment_llm'] = sentiments
     df['explanation_llm'] = explanations
     df['tokens_llm'] = tokens_usage
+    if triage:
+        df['triage'] = [res["triage"] if res is not None else "" for res in triaged]
+    # Origen de cada etiqueta: solo las del LLM vuelven al corpus de entrenamiento del modelo local
+    df['label_source'] = ["triage" if triaged[n] is not None else res.get('source', 'llm') for n, res in enumerate(results)]
+    if processor.lean:
+        df['confidence_llm'] = [res.get('confidence') for res in results]
+    # Filas que comparten etiqueta (mismo texto o casi-duplicado): permite ponderar en el análisis
+    cluster_rows = {}
+    for t in texts:
+        key = rep_of.get(t, t)
+        cluster_rows[key] = cluster_rows.get(key, 0) + 1
+    df['near_dup_size'] = [cluster_rows[rep_of.get(t, t)] for t in texts]
     
     total_tokens = sum(tokens_usage)
     print(f"\n[Resumen] Total Tokens consumidos: {total_tokens}")
     print(f"         Promedio por post: {total_tokens/len(df):.1f}")
+
+    error_rows = sum(1 for s in sentiments if s == "Error")
+    if error_rows:
+        print(f"[WARN] {error_rows} filas quedaron con sentimiento 'Error' (se excluyen de las estadísticas).")
+    if db is not None and topic:
+        db.update_job_timings(topic, llm_errors=error_rows)
+
+    if cache is not None:
+        cache_stats = cache.stats()
+        cache_stats["unique_texts"] = len(unique_texts)
+        cache_stats["duplicate_rows"] = len(pending_rows) - len(unique_texts)
+        print(f"[Cache] Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} | Filas duplicadas: {cache_stats['duplicate_rows']}")
+        if db is not None and topic:
+            db.update_llm_metrics(topic, {"cache": cache_stats})
+
+    if checkpoint is not None:
+        db.update_llm_metrics(topic, {"checkpoint": {"resumed_rows": len(done), "saved_rows": checkpoint.saved}})
     
     return df
 
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from urllib.parse import urlparse
+
+from llm_control import (
+    LLM_INITIAL_CONCURRENCY, OUTCOME_CANCELLED, OUTCOME_OK, OUTCOME_OVERLOAD, AdaptiveLimiter, CircuitBreaker,
+    CircuitOpenError,
+)
+from llm_engine import DEEPSEEK_BASE_URL, LLM_MODEL, LLMEngine, classify_exception, get_async_client
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Endpoints compatibles con OpenAI entre los que repartir la fase LLM. Cada entrada:
+#   {"base_url": ..., "api_key": ... | "api_keys": [...], "model": ..., "weight": 1, "max_concurrency": 20}
+# ("api_keys" crea un endpoint por clave). Vacío = un solo endpoint (LLM_BASE_URL).
+# También se puede pasar como JSON en la variable de entorno LLM_ENDPOINTS.
+LLM_ENDPOINTS = json.loads(os.environ["LLM_ENDPOINTS"]) if os.environ.get("LLM_ENDPOINTS") else getattr(_config, "LLM_ENDPOINTS", [])
+# "least_latency": el endpoint con menor latencia reciente ponderada por su ocupación
+# "weighted": reparto aleatorio proporcional a weight x huecos libres
+LLM_ROUTER_POLICY = getattr(_config, "LLM_ROUTER_POLICY", "least_latency")
+LLM_ENDPOINT_MAX_CONCURRENCY = getattr(_config, "LLM_ENDPOINT_MAX_CONCURRENCY", 20)
+
+_EWMA_ALPHA = 0.2
+_last_router = None # Para que las llamadas síncronas eviten los endpoints caídos (sync_endpoint)
+
+
+class Endpoint:
+    """Un backend del router, con su propio control de concurrencia (AIMD con techo) y circuit breaker."""
+
+    def __init__(self, name, base_url, api_key, model=None, weight=1.0, max_concurrency=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model or LLM_MODEL
+        self.weight = float(weight)
+        self.max_concurrency = max_concurrency or LLM_ENDPOINT_MAX_CONCURRENCY
+        self.limiter = AdaptiveLimiter(
+            initial=min(LLM_INITIAL_CONCURRENCY, self.max_concurrency), max_limit=self.max_concurrency
+        )
+        self.breaker = CircuitBreaker()
+        self.ewma_latency = None
+        self.requests = 0
+
+    def available(self):
+        """True si se le puede enviar una petición ya (circuito cerrado o listo para la sonda)."""
+        b = self.breaker
+        if b.state == b.CLOSED:
+            return True
+        if b._probe_in_flight:
+            return False
+        return b.state == b.HALF_OPEN or time.monotonic() - b.opened_at >= b.cooldown
+
+    def given_up(self):
+        b = self.breaker
+        return b.down_since is not None and time.monotonic() - b.down_since > b.give_up_after
+
+    def load(self):
+        return (self.limiter.in_flight + 1) / max(int(self.limiter.limit), 1)
+
+    def record_latency(self, latency):
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = _EWMA_ALPHA * latency + (1 - _EWMA_ALPHA) * self.ewma_latency
+
+    def snapshot(self):
+        snap = self.limiter.snapshot()
+        snap["circuit"] = self.breaker.state
+        snap["requests"] = self.requests
+        snap["ewma_latency_s"] = round(self.ewma_latency, 3) if self.ewma_latency is not None else None
+        return snap
+
+
+def load_endpoints(specs=None):
+    """Convierte la configuración (LLM_ENDPOINTS) en una lista de Endpoint."""
+    endpoints = []
+    for spec in (LLM_ENDPOINTS if specs is None else specs):
+        keys = spec.get("api_keys") or [spec.get("api_key") or "local"]
+        host = urlparse(spec["base_url"]).netloc or spec["base_url"]
+        for k, key in enumerate(keys):
+            name = spec.get("name") or host
+            if len(keys) > 1:
+                name = f"{name}#{k + 1}"
+            endpoints.append(Endpoint(
+                name, spec["base_url"], key, model=spec.get("model"),
+                weight=spec.get("weight", 1.0), max_concurrency=spec.get("max_concurrency"),
+            ))
+    return endpoints
+
+
+def routed_model_key(specs=None):
+    """
+    Clave de modelo para la caché de sentimientos con el router: el modelo común a todos
+    los endpoints (con sus hosts si alguno no es DeepSeek), o None si los endpoints usan
+    modelos distintos, porque entonces no se sabe qué modelo respondió cada entrada.
+    """
+    specs = LLM_ENDPOINTS if specs is None else specs
+    models = {spec.get("model") or LLM_MODEL for spec in specs}
+    if len(models) != 1:
+        return None
+    model = models.pop()
+    hosts = sorted({spec["base_url"] for spec in specs} - {DEEPSEEK_BASE_URL})
+    return f"{model}@{'+'.join(hosts)}" if hosts else model
+
+
+class LLMRouter(LLMEngine):
+    """
+    LLMEngine que reparte las peticiones entre varios endpoints compatibles con OpenAI
+    (varias claves de DeepSeek, un servidor propio, stubs locales...).
+
+    - Balanceo: `least_latency` (latencia EWMA x ocupación) o `weighted` (peso x huecos libres).
+    - Cada endpoint tiene su techo de concurrencia y su propio AIMD: un 429 en una clave
+      no frena a las demás.
+    - Failover: si un endpoint devuelve 429/5xx/timeout la misma petición se reintenta al
+      momento en otro; un endpoint con el circuito abierto deja de recibir tráfico hasta
+      que pasa su sonda.
+    map(), retry_failed() y run() se heredan sin cambios. No hay circuit breaker global:
+    el router solo se rinde cuando todos los endpoints llevan demasiado tiempo caídos.
+    """
+
+    def __init__(self, endpoints=None, policy=None, **kwargs):
+        self.endpoints = endpoints if endpoints is not None else load_endpoints()
+        if not self.endpoints:
+            raise ValueError("LLMRouter necesita al menos un endpoint")
+        self.policy = policy or LLM_ROUTER_POLICY
+        kwargs.setdefault("max_concurrency", sum(ep.max_concurrency for ep in self.endpoints))
+        super().__init__(**kwargs)
+        # El breaker heredado de LLMEngine no se consulta: cada endpoint tiene el suyo
+        self.breaker = None
+        self.failovers = 0
+        global _last_router
+        _last_router = self
+
+    def _pick(self, exclude):
+        candidates = [ep for ep in self.endpoints if ep.name not in exclude and ep.available()]
+        if not candidates:
+            return None
+        if self.policy == "weighted":
+            weights = [ep.weight * max(int(ep.limiter.limit) - ep.limiter.in_flight, 0) for ep in candidates]
+            if not any(weights):
+                weights = [ep.weight for ep in candidates]
+            return random.choices(candidates, weights=weights)[0]
+        # Sin latencia medida todavía cuenta como 0: cada endpoint recibe tráfico al menos una vez
+        return min(candidates, key=lambda ep: ((ep.ewma_latency or 0.0) * ep.load() / ep.weight, ep.load()))
+
+    async def _next_endpoint(self, exclude):
+        while True:
+            ep = self._pick(exclude)
+            if ep is not None or exclude:
+                return ep
+            if all(ep.given_up() for ep in self.endpoints):
+                raise CircuitOpenError("Todos los endpoints LLM llevan demasiado tiempo caídos")
+            await asyncio.sleep(0.2)
+
+    async def _attempt(self, messages, max_tokens, temperature=0):
+        """Un intento en el mejor endpoint disponible, con failover ante saturación (el hedging lo pone chat())."""
+        tried = set()
+        last_exc = None
+        for _ in range(len(self.endpoints)):
+            ep = await self._next_endpoint(tried)
+            if ep is None:
+                break
+            tried.add(ep.name)
+            probe = await ep.breaker.wait_ready()
+            started = await ep.limiter.acquire()
+            outcome = OUTCOME_OK
+            ep.requests += 1
+            try:
+                response = await get_async_client(ep.base_url, ep.api_key).chat.completions.create(
+                    model=ep.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+            except asyncio.CancelledError as e:
+                outcome = OUTCOME_CANCELLED
+                ep.breaker.record_failure(False, probe=probe)
+                self._record(started, e, endpoint=ep.name)
+                raise
+            except Exception as e:
+                outcome = classify_exception(e)
+                ep.breaker.record_failure(outcome == OUTCOME_OVERLOAD, probe=probe)
+                self._record(started, e, endpoint=ep.name)
+                last_exc = e
+                if outcome == OUTCOME_OVERLOAD and len(tried) < len(self.endpoints):
+                    self.failovers += 1
+                    continue
+                raise
+            finally:
+                await ep.limiter.release(started, outcome)
+            ep.breaker.record_success(probe=probe)
+            ep.record_latency(time.monotonic() - started)
+            self._record(started, usage=response.usage, endpoint=ep.name)
+            return response.choices[0].message.content, response.usage.total_tokens
+        raise last_exc or CircuitOpenError("Ningún endpoint LLM disponible")
+
+    def snapshot(self):
+        """Agregado de todos los endpoints con el mismo formato que LLMEngine.snapshot(), más el detalle."""
+        snaps = {ep.name: ep.snapshot() for ep in self.endpoints}
+        latencies = [lat for ep in self.endpoints for lat in ep.limiter._recent_latencies]
+        closed = sum(1 for ep in self.endpoints if ep.breaker.state == CircuitBreaker.CLOSED)
+        return {
+            "limit": sum(s["limit"] for s in snaps.values()),
+            "max_limit": sum(s["max_limit"] for s in snaps.values()),
+            "in_flight": sum(s["in_flight"] for s in snaps.values()),
+            "throughput_rps": round(sum(s["throughput_rps"] for s in snaps.values()), 2),
+            "p50_latency_s": round(statistics.median(latencies), 3) if latencies else None,
+            "ok": sum(s["ok"] for s in snaps.values()),
+            "overload": sum(s["overload"] for s in snaps.values()),
+            "errors": sum(s["errors"] for s in snaps.values()),
+            "circuit": CircuitBreaker.CLOSED if closed else CircuitBreaker.OPEN,
+            "circuit_opened": sum(ep.breaker.times_opened for ep in self.endpoints),
+            "retried": self.retried,
+            "recovered": self.recovered,
+            "failovers": self.failovers,
+            **({"hedging": self.hedger.snapshot()} if self.hedger is not None else {}),
+            "policy": self.policy,
+            "endpoints": snaps,
+        }
+
+
+def sync_endpoint(router=None):
+    """
+    (base_url, api_key, model) para las llamadas síncronas (clasificación suelta, explicación,
+    storytelling) cuando hay LLM_ENDPOINTS: el primer endpoint sano del router indicado o del
+    último creado; sin router, el primero de la configuración.
+    """
+    router = router or _last_router
+    endpoints = router.endpoints if router is not None else load_endpoints()
+    ep = next((ep for ep in endpoints if ep.available()), endpoints[0])
+    return ep.base_url, ep.api_key, ep.model
+
+
+def create_engine(base_url=None, api_key=None, **kwargs):
+    """
+    Motor de la fase LLM: un LLMRouter si hay LLM_ENDPOINTS configurados y no se fuerza
+    un endpoint concreto (base_url), o un LLMEngine de un solo endpoint en otro caso.
+    """
+    if base_url is None and LLM_ENDPOINTS:
+        return LLMRouter(**kwargs)
+    return LLMEngine(base_url=base_url, api_key=api_key, **kwargs)
@@ -0,0 +1,209 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from llm_checkpoint import VALID_SENTIMENTS
+from llm_preview import normalize_platforms
+from llm_processor import process_dataframe_concurrently
+from llm_router import create_engine
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Margen de error objetivo (semiamplitud del intervalo de confianza de cada % global)
+LLM_SAMPLE_MARGIN = getattr(_config, "LLM_SAMPLE_MARGIN", 0.03)
+LLM_SAMPLE_Z = getattr(_config, "LLM_SAMPLE_Z", 1.96) # 95% de confianza
+# Por debajo de este tamaño se clasifica todo (muestrear no compensa)
+LLM_SAMPLE_MIN_ROWS = getattr(_config, "LLM_SAMPLE_MIN_ROWS", 2000)
+# Tamaño de la primera ronda de muestreo
+LLM_SAMPLE_INITIAL = getattr(_config, "LLM_SAMPLE_INITIAL", 400)
+# Filas clasificadas mínimas por plataforma antes de dar por buena una estimación
+LLM_SAMPLE_MIN_PER_PLATFORM = getattr(_config, "LLM_SAMPLE_MIN_PER_PLATFORM", 30)
+
+UNSAMPLED_EXPLANATION = "Fila no muestreada"
+
+
+def stratified_order(df, seed=0):
+    """
+    Orden de muestreo estratificado por (plataforma, post): cualquier prefijo del orden
+    devuelto contiene de cada post aproximadamente la misma fracción de filas (asignación
+    proporcional, sistemática con arranque aleatorio). Así la muestra puede crecer por
+    rondas sin dejar de ser estratificada.
+    """
+    n = len(df)
+    if n == 0:
+        return np.array([], dtype=int)
+    rng = np.random.default_rng(seed)
+    key = pd.Series([""] * n, index=df.index)
+    for col in ("platform", "post_index"):
+        if col in df.columns:
+            key = key + "|" + df[col].map(str)
+    codes = pd.factorize(key)[0]
+    sizes = np.bincount(codes)
+    # Rango aleatorio de cada fila dentro de su estrato
+    rank = pd.Series(rng.random(n)).groupby(codes).rank(method="first").to_numpy() - 1
+    position = (rank + rng.random(n)) / sizes[codes]
+    return np.argsort(position, kind="stable")
+
+
+def estimate_distribution(platforms, labels, z=None):
+    """
+    Estimación estratificada por plataforma de la distribución de sentimiento.
+    platforms: plataforma (normalizada) de cada fila del corpus completo.
+    labels: etiqueta de cada fila, o None si no se muestreó / no se pudo clasificar.
+
+    Cada plataforma pesa lo que pesa en el corpus (W_h = N_h / N); la varianza de cada
+    proporción incluye la corrección por población finita. Las plataformas sin ninguna
+    fila clasificada quedan fuera (y se listan en 'unsampled_platforms').
+    """
+    z = LLM_SAMPLE_Z if z is None else z
+    totals = {}
+    counts = {}
+    for p, label in zip(platforms, labels):
+        totals[p] = totals.get(p, 0) + 1
+        if label in VALID_SENTIMENTS:
+            c = counts.setdefault(p, {})
+            c[label] = c.get(label, 0) + 1
+
+    sampled_total = sum(totals[p] for p in counts)
+    by_platform = {}
+    global_share = {}
+    global_var = {}
+    for p, c in counts.items():
+        n_h = sum(c.values())
+        N_h = totals[p]
+        w = N_h / sampled_total
+        fpc = max(0.0, 1 - n_h / N_h)
+        shares, ci = {}, {}
+        for label in sorted(VALID_SENTIMENTS):
+            share = c.get(label, 0) / n_h
+            var = share * (1 - share) / max(n_h - 1, 1) * fpc
+            half = z * math.sqrt(var)
+            shares[label] = share
+            ci[label] = [round(max(0.0, share - half), 4), round(min(1.0, share + half), 4)]
+            global_share[label] = global_share.get(label, 0.0) + w * share
+            global_var[label] = global_var.get(label, 0.0) + w * w * var
+        by_platform[p] = {
+            "percents": {k: f"{v * 100:.1f}%" for k, v in shares.items()},
+            "ci": ci,
+            "margin": round(max(ci[k][1] - ci[k][0] for k in ci) / 2, 4),
+            "sampled": n_h,
+            "total": N_h,
+        }
+
+    global_ci = {}
+    for label, share in global_share.items():
+        half = z * math.sqrt(global_var[label])
+        global_ci[label] = [round(max(0.0, share - half), 4), round(min(1.0, share + half), 4)]
+    margin = max((z * math.sqrt(v) for v in global_var.values()), default=1.0)
+    return {
+        "global_percents": {k: f"{v * 100:.1f}%" for k, v in global_share.items()},
+        "global_ci": global_ci,
+        "margin": round(margin, 4),
+        "confidence": round(math.erf(z / math.sqrt(2)), 3),
+        "by_platform": by_platform,
+        "sampled_rows": sum(sum(c.values()) for c in counts.values()),
+        "total_rows": len(labels),
+        "unsampled_platforms": sorted(p for p in totals if p not in counts),
+    }
+
+
+def _next_size(taken, total, margin, target):
+    """Tamaño de la siguiente ronda: el error cae con 1/sqrt(n), así que n ~ n * (margen/objetivo)^2."""
+    needed = int(math.ceil(taken * (margin / target) ** 2)) if margin > 0 else taken
+    return min(total, max(int(taken * 1.25), min(needed, taken * 4)))
+
+
+def classify_sample(df, topic=None, db=None, target_margin=None, initial=None, seed=0, engine=None, **kwargs):
+    """
+    Modo muestreo: clasifica una muestra estratificada por plataforma y post que crece
+    por rondas hasta que el margen de error de los porcentajes globales baja de
+    `target_margin` (y cada plataforma tiene LLM_SAMPLE_MIN_PER_PLATFORM filas), o
+    hasta agotar el corpus. El coste crece con el margen pedido, no con el tamaño del tema.
+
+    Devuelve el DataFrame completo: las filas no muestreadas quedan como 'N/A' (se excluyen
+    de las estadísticas igual que los fallos) y la columna 'sampled' marca la muestra.
+    El resto de kwargs se pasa a process_dataframe_concurrently en cada ronda.
+    """
+    target = target_margin or LLM_SAMPLE_MARGIN
+    total = len(df)
+    platforms = normalize_platforms(df)
+    order = stratified_order(df, seed)
+    engine = engine or create_engine()
+
+    sentiments = ["N/A"] * total
+    explanations = [UNSAMPLED_EXPLANATION] * total
+    tokens = [0] * total
+    near_dup_sizes = [1] * total
+    triaged = [""] * total
+    sources = ["unsampled"] * total
+    sampled = [False] * total
+
+    taken = 0
+    idx = order[:min(total, initial or LLM_SAMPLE_INITIAL)]
+    rounds = 0
+    while True:
+        if len(idx):
+            part = process_dataframe_concurrently(
+                df.iloc[idx].copy(), topic=topic, db=db, engine=engine,
+                use_checkpoint=False, preview=False, **kwargs
+            )
+            for n, s, e, t, d in zip(idx, part["sentiment_llm"], part["explanation_llm"],
+                                     part["tokens_llm"], part["near_dup_size"]):
+                sentiments[n], explanations[n], tokens[n], near_dup_sizes[n] = s, e, t, d
+                sampled[n] = True
+            if "triage" in part.columns:
+                for n, rule in zip(idx, part["triage"]):
+                    triaged[n] = rule
+            for n, source in zip(idx, part["label_source"]):
+                sources[n] = source
+        taken += len(idx)
+        rounds += 1
+
+        estimate = estimate_distribution(platforms, [s if ok else None for s, ok in zip(sentiments, sampled)])
+        # Plataformas con muy pocas filas clasificadas: su intervalo no dice nada todavía
+        short = {
+            p: min(LLM_SAMPLE_MIN_PER_PLATFORM, info["total"]) - info["sampled"]
+            for p, info in estimate["by_platform"].items()
+        }
+        short = {p: k for p, k in short.items() if k > 0}
+        short.update({p: LLM_SAMPLE_MIN_PER_PLATFORM for p in estimate["unsampled_platforms"]})
+        reached = estimate["margin"] <= target
+        print(f"[Sample] Ronda {rounds}: {taken}/{total} filas | margen ±{estimate['margin']:.1%} (objetivo ±{target:.1%})")
+        if db is not None and topic:
+            db.update_llm_metrics(topic, {"sampling": {
+                "rounds": rounds, "sampled_rows": taken, "total_rows": total,
+                "margin": estimate["margin"], "target_margin": target, "reached": reached,
+            }})
+
+        remaining = [n for n in order if not sampled[n]]
+        if not remaining or (reached and not short):
+            break
+        if db is not None and topic and db.check_cancellation(topic):
+            print("[Sample] Trabajo cancelado: se detiene el muestreo.")
+            break
+        if reached:
+            # El margen global ya se cumple: solo se completan las plataformas cortas
+            picked = []
+            for n in remaining:
+                if short.get(platforms[n], 0) > 0:
+                    short[platforms[n]] -= 1
+                    picked.append(n)
+            if not picked:
+                break # Las plataformas cortas no tienen más filas (o todas fallaron)
+            idx = np.array(picked, dtype=int)
+        else:
+            idx = np.array(remaining[:_next_size(taken, total, estimate["margin"], target) - taken], dtype=int)
+
+    df["sentiment_llm"] = sentiments
+    df["explanation_llm"] = explanations
+    df["tokens_llm"] = tokens
+    df["near_dup_size"] = near_dup_sizes
+    df["triage"] = triaged
+    df["label_source"] = sources
+    df["sampled"] = sampled
+    print(f"[Sample] Clasificadas {taken} de {total} filas ({taken / total:.1%}) en {rounds} rondas.")
+    return df
@@ -0,0 +1,182 @@
+import asyncio
+import queue as queue_module
+import threading
+import time
+import pandas as pd
+
+from llm_checkpoint import VALID_SENTIMENTS
+from llm_processor import LLM_LEAN_MODE, LLMProcessor, classify_items_async, get_shared_cache
+from local_classifier import CASCADE_CONFIDENCE, LLM_CASCADE_MODE, get_local_classifier
+from llm_router import create_engine
+from llm_triage import LLM_TRIAGE_ENABLED, triage_rows
+from near_dup import NEAR_DUP_ENABLED, cluster_near_duplicates
+from scrapers.common import STREAM_PUT_TIMEOUT
+from prompt_builder import build_items
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Clasificar mientras se scrapea (los scrapers publican cada fila en una cola)
+LLM_STREAMING = getattr(_config, "LLM_STREAMING", True)
+# Filas en cola como máximo: si se llena, los scrapers esperan (contrapresión)
+STREAM_QUEUE_MAXSIZE = getattr(_config, "STREAM_QUEUE_MAXSIZE", 1000)
+# Una tanda se lanza al LLM al llegar a N filas o tras X segundos desde su primera fila
+STREAM_BATCH_ROWS = getattr(_config, "STREAM_BATCH_ROWS", 100)
+STREAM_BATCH_SECONDS = getattr(_config, "STREAM_BATCH_SECONDS", 3.0)
+# Tandas clasificándose a la vez; con todas ocupadas se deja de leer la cola
+STREAM_MAX_INFLIGHT_BATCHES = getattr(_config, "STREAM_MAX_INFLIGHT_BATCHES", 4)
+
+STREAM_END = "__END__"
+
+
+class StreamClassifier:
+    """
+    Consumidor de la fase LLM que trabaja en paralelo al scraping.
+
+    Lee filas de una cola de multiprocessing (Manager().Queue) en un hilo propio con
+    su event loop, las agrupa en tandas y las clasifica con el LLMEngine compartido.
+    Los resultados quedan en `results` ({texto: resultado}) para que la pasada final
+    de process_dataframe_concurrently solo tenga que clasificar lo que falte.
+
+    Etapas de la pasada final que aquí no se repiten:
+      - Casi-duplicados: cada tanda envía un representante por grupo; la pasada final
+        vuelve a agrupar todos los textos (también los de `results`) y los miembros heredan
+        la etiqueta ya obtenida, igual que en una ejecución sin streaming.
+      - Checkpoint: las filas solo se guardan al terminar el scraping, así que antes no hay
+        nada que reanudar; la pasada final escribe en el checkpoint estos resultados.
+
+    Si el consumidor se cae, sigue vaciando la cola (descartando filas) hasta el final
+    para que los scrapers no se queden bloqueados en put(); la pasada final las clasifica.
+    """
+
+    def __init__(self, row_queue, db=None, engine=None, batch_rows=None, batch_seconds=None,
+                 max_inflight=None, cascade=None):
+        self.queue = row_queue
+        self.db = db
+        self.engine = engine or create_engine()
+        self.processor = LLMProcessor(cache=get_shared_cache(db, lean=LLM_LEAN_MODE), lean=LLM_LEAN_MODE)
+        self.batch_rows = batch_rows or STREAM_BATCH_ROWS
+        self.batch_seconds = batch_seconds or STREAM_BATCH_SECONDS
+        self.max_inflight = max_inflight or STREAM_MAX_INFLIGHT_BATCHES
+        self.cascade = LLM_CASCADE_MODE if cascade is None else cascade
+        self.results = {}
+        self.rows_received = 0
+        self.batches = 0
+        self._seen = set()
+        self._thread = None
+        self.failed = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="llm-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self, timeout=None):
+        """Indica que no llegarán más filas y espera a que terminen las tandas en vuelo."""
+        if self.alive:
+            try:
+                self.queue.put(STREAM_END, timeout=STREAM_PUT_TIMEOUT)
+            except Exception as e:
+                print(f"[Stream] No se pudo cerrar la cola del streaming: {e}")
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.processor.cache is not None:
+            self.processor.cache.flush()
+        return self.results
+
+    def stats(self):
+        return {
+            "rows_received": self.rows_received,
+            "batches": self.batches,
+            "classified_texts": len(self.results),
+        }
+
+    def _run(self):
+        try:
+            self.engine.run(self._consume())
+        except Exception as e:
+            print(f"[Stream] El consumidor LLM se detuvo: {e}")
+            self.failed = True
+            self._discard()
+
+    def _discard(self):
+        # Consumidor caído: vaciar la cola hasta STREAM_END para no bloquear a los scrapers
+        while True:
+            try:
+                if self.queue.get(True, 0.5) == STREAM_END:
+                    return
+            except queue_module.Empty:
+                continue
+            except Exception:
+                return # Manager cerrado
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_inflight)
+        classifier = get_local_classifier(self.db) if self.cascade else None
+        tasks = []
+        batch = []
+        first_at = None
+        finished = False
+        while not finished:
+            try:
+                row = await loop.run_in_executor(None, self.queue.get, True, 0.5)
+            except queue_module.Empty:
+                row = None
+            if row == STREAM_END:
+                finished = True
+            elif row is not None:
+                batch.append(row)
+                self.rows_received += 1
+                first_at = first_at or time.monotonic()
+
+            if batch and (finished or len(batch) >= self.batch_rows or time.monotonic() - first_at >= self.batch_seconds):
+                # Contrapresión: con todas las tandas ocupadas no se leen más filas
+                await slots.acquire()
+                tasks.append(asyncio.create_task(self._classify(batch, slots, classifier)))
+                batch, first_at = [], None
+        await asyncio.gather(*tasks)
+
+    async def _classify(self, rows, slots, classifier):
+        try:
+            items = []
+            frame = pd.DataFrame(rows)
+            row_items = build_items(frame)
+            # Las filas de relleno no se envían: la pasada final las resuelve con el triaje
+            triaged = triage_rows(frame, [item.text for item in row_items]) if LLM_TRIAGE_ENABLED else [None] * len(row_items)
+            for item, res in zip(row_items, triaged):
+                if res is None and item.text not in self._seen:
+                    self._seen.add(item.text)
+                    items.append(item)
+            if classifier is not None and items:
+                # Lo que el clasificador local resuelve con confianza no se envía (la pasada final lo repite gratis)
+                preds = classifier.predict([item.body for item in items])
+                items = [item for item, (_, conf) in zip(items, preds) if conf < CASCADE_CONFIDENCE]
+            if not items:
+                return
+            if NEAR_DUP_ENABLED and len(items) > 1:
+                # Un representante por grupo de casi-duplicados de la tanda; el resto lo hereda en la pasada final
+                reps = cluster_near_duplicates([item.body for item in items])
+                items = [item for idx, item in enumerate(items) if reps[idx] == idx]
+            if self.processor.cache is not None:
+                # La consulta a MongoDB fuera del event loop (las otras tandas siguen en vuelo)
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.processor.cache.prefetch, [item.text for item in items]
+                )
+            self.batches += 1
+            results = await classify_items_async(items, processor=self.processor, engine=self.engine)
+            for item, res in zip(items, results):
+                if res.get("sentiment") in VALID_SENTIMENTS:
+                    self.results[item.text] = res
+                else:
+                    self._seen.discard(item.text)
+        except Exception as e:
+            print(f"[Stream] Error clasificando una tanda de {len(rows)} filas: {e}")
+        finally:
+            slots.release()
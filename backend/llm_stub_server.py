@@ -0,0 +1,248 @@
+"""
+Servidor local compatible con la API de chat completions de OpenAI que imita a DeepSeek
+de forma determinista, para medir la fase LLM sin gastar dinero.
+
+- Responde en el formato que espera LLMProcessor (fila a fila, por lotes y agrupado por post,
+  también en modo ligero y para las explicaciones bajo demanda).
+  La etiqueta de cada texto se deriva de su hash: misma entrada -> misma respuesta.
+- Latencia configurable (fija, uniforme o lognormal) más un coste por token de salida.
+- Inyección de errores 500 y 429, y un límite de concurrencia opcional que devuelve 429
+  al superarse (para ejercitar el controlador AIMD).
+- Contabilidad de tokens y latencias en GET /stats (POST /reset para reiniciar).
+
+Uso: python llm_stub_server.py --port 8090 --latency lognormal --median-ms 400
+y luego LLM_BASE_URL=http://127.0.0.1:8090 (o LLMProcessor(base_url=...)).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LABELS = ("Positivo", "Negativo", "Neutro")
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.attempts = Counter() # hash del cuerpo -> nº de veces recibido (reintentos deterministas)
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.attempts.clear()
+            self.requests = 0
+            self.status_codes = Counter()
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.latencies = []
+            self.max_in_flight = 0
+            self.started_at = time.time()
+
+    def rng_for(self, body):
+        """Generador seeded con (semilla, cuerpo, nº de intento): independiente del orden de llegada."""
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            attempt = self.attempts[digest]
+            self.attempts[digest] += 1
+        return random.Random(f"{self.args.seed}|{digest}|{attempt}")
+
+    def sample_latency(self, rng, completion_tokens):
+        a = self.args
+        if a.latency == "fixed":
+            base = a.median_ms
+        elif a.latency == "uniform":
+            base = rng.uniform(a.min_ms, a.max_ms)
+        else:
+            base = rng.lognormvariate(math.log(a.median_ms), a.sigma)
+        return (base + a.per_token_ms * completion_tokens) / 1000.0
+
+    def record(self, status, latency, prompt_tokens=0, completion_tokens=0):
+        with self.lock:
+            self.requests += 1
+            self.status_codes[status] += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+            elapsed = max(time.time() - self.started_at, 1e-6)
+
+            def pct(p):
+                return round(lat[min(len(lat) - 1, int(p * len(lat)))], 4) if lat else None
+
+            return {
+                "requests": self.requests,
+                "status_codes": {str(k): v for k, v in self.status_codes.items()},
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "p50_latency_s": pct(0.50),
+                "p99_latency_s": pct(0.99),
+                "mean_latency_s": round(statistics.mean(lat), 4) if lat else None,
+                "max_in_flight": self.max_in_flight,
+                "requests_per_s": round(self.requests / elapsed, 2),
+            }
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def label_for(text):
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    return LABELS[digest[0] % len(LABELS)]
+
+
+def lean_label(text):
+    """Etiqueta compacta del modo ligero ('neg 7'), coherente con label_for."""
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    return f"{label_for(text)[:3].lower()} {digest[1] % 10}"
+
+
+def build_answer(messages):
+    """Genera el contenido que devolvería el modelo según el tipo de petición."""
+    user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    lean = "(pos, neg o neu)" in system
+    payload = None
+    if user.startswith("Textos: "):
+        payload = user[len("Textos: "):]
+    elif "\nComentarios: " in user:
+        # El JSON de comentarios no contiene saltos de línea literales: el último es el separador
+        payload = user.rsplit("\nComentarios: ", 1)[1]
+    if payload is not None:
+        try:
+            if lean:
+                return "\n".join(f"{it['id']} {lean_label(it['text'])}" for it in json.loads(payload))
+            return json.dumps([
+                {"id": it["id"], "sentiment": label_for(it["text"]), "explanation": "Respuesta simulada."}
+                for it in json.loads(payload)
+            ], ensure_ascii=False)
+        except (ValueError, KeyError, TypeError):
+            return "[]"
+    if user.startswith("Texto: ") and lean:
+        return lean_label(user)
+    if user.startswith("Texto: ") and "\nSentimiento: " not in user:
+        return json.dumps({"sentiment": label_for(user), "explanation": "Respuesta simulada."}, ensure_ascii=False)
+    if "\nSentimiento: " in user:
+        return "Explicación simulada del sentimiento del texto."
+    # Storytelling u otras peticiones de texto libre
+    return "Informe simulado. " * 20
+
+
+def error_body(message, kind):
+    return {"error": {"message": message, "type": kind, "code": None}}
+
+
+def create_app(args):
+    app = FastAPI(title="LLM Stub")
+    state = StubState(args)
+    app.state.stub = state
+
+    async def chat_completions(request: Request):
+        body = await request.body()
+        rng = state.rng_for(body)
+        payload = json.loads(body or b"{}")
+        messages = payload.get("messages", [])
+
+        with state.lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            over_capacity = args.max_concurrency and state.in_flight > args.max_concurrency
+        try:
+            roll = rng.random()
+            if over_capacity or roll < args.rate_limit_rate:
+                await asyncio.sleep(args.error_latency_ms / 1000.0)
+                state.record(429, args.error_latency_ms / 1000.0)
+                return JSONResponse(error_body("Rate limit reached (stub)", "rate_limit_error"), status_code=429)
+            if roll < args.rate_limit_rate + args.error_rate:
+                await asyncio.sleep(args.error_latency_ms / 1000.0)
+                state.record(500, args.error_latency_ms / 1000.0)
+                return JSONResponse(error_body("Internal error (stub)", "server_error"), status_code=500)
+
+            content = build_answer(messages)
+            prompt_tokens = sum(count_tokens(m.get("content", "")) for m in messages)
+            completion_tokens = min(count_tokens(content), payload.get("max_tokens") or 10 ** 6)
+            latency = state.sample_latency(rng, completion_tokens)
+            await asyncio.sleep(latency)
+            state.record(200, latency, prompt_tokens, completion_tokens)
+            return {
+                "id": f"stub-{hashlib.md5(body).hexdigest()[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    # El cliente de OpenAI añade /chat/completions a la base_url (con o sin /v1)
+    app.add_api_route("/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/v1/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/stats")
+    def stats():
+        return state.snapshot()
+
+    @app.post("/reset")
+    def reset():
+        state.reset()
+        return {"status": "ok"}
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Servidor LLM local y determinista compatible con OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--seed", default="0", help="Semilla: misma semilla y mismas peticiones -> mismas respuestas")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal",
+                        help="Distribución de la latencia base de cada petición")
+    parser.add_argument("--median-ms", type=float, default=400.0, help="Latencia fija / mediana de la lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Dispersión de la lognormal (cola larga)")
+    parser.add_argument("--min-ms", type=float, default=200.0, help="Mínimo de la uniforme")
+    parser.add_argument("--max-ms", type=float, default=800.0, help="Máximo de la uniforme")
+    parser.add_argument("--per-token-ms", type=float, default=2.0, help="Coste extra por token de salida")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que devuelven 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fracción de peticiones que devuelven 429")
+    parser.add_argument("--error-latency-ms", type=float, default=50.0, help="Latencia de las respuestas de error")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Peticiones simultáneas aceptadas; por encima devuelve 429 (0 = sin límite)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"[Stub] Escuchando en http://{args.host}:{args.port} (latencia {args.latency}, "
+          f"errores {args.error_rate:.1%}, 429 {args.rate_limit_rate:.1%})")
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
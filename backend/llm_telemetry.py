@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+import threading
+import time
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Precio por millón de tokens (USD) para estimar el coste de cada job (tarifa de deepseek-chat)
+LLM_PRICE_INPUT_PER_M = getattr(_config, "LLM_PRICE_INPUT_PER_M", 0.27)
+LLM_PRICE_OUTPUT_PER_M = getattr(_config, "LLM_PRICE_OUTPUT_PER_M", 1.10)
+
+# Límites superiores (segundos) de los buckets del histograma de latencias
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0)
+
+
+def status_label(exc=None):
+    """Código con el que se contabiliza una petición: '200', '429', '500'..., 'timeout', 'connection', 'cancelled' o 'error'."""
+    if exc is None:
+        return "200"
+    if isinstance(exc, APIStatusError):
+        return str(exc.status_code)
+    if isinstance(exc, (APITimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, APIConnectionError):
+        return "connection"
+    if isinstance(exc, asyncio.CancelledError):
+        return "cancelled"
+    return "error"
+
+
+class Histogram:
+    """Histograma de buckets fijos (como los de Prometheus): O(log n) por observación y memoria constante."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, p):
+        """Percentil aproximado, interpolando linealmente dentro del bucket."""
+        if not self.count:
+            return None
+        target = p * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= target:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (target - seen) / c
+            seen += c
+        return self.bounds[-1]
+
+    def cumulative(self):
+        """(límite, recuento acumulado) por bucket, incluido +Inf."""
+        out, total = [], 0
+        for bound, c in zip(list(self.bounds) + [float("inf")], self.counts):
+            total += c
+            out.append((bound, total))
+        return out
+
+
+class Telemetry:
+    """
+    Contadores e histogramas de las peticiones al LLM: latencia, tokens de entrada y
+    salida, reintentos y códigos de estado (por endpoint). Cada LLMEngine tiene la suya
+    (métricas del job, que se guardan en job_status) y además todo se suma a la global
+    del proceso, que expone GET /metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram()
+        self.status_codes = {} # (endpoint, código) -> peticiones
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.first_at = None
+        self.last_at = None
+
+    def record(self, latency, status, prompt_tokens=0, completion_tokens=0, endpoint=""):
+        now = time.monotonic()
+        with self._lock:
+            key = (endpoint, status)
+            self.status_codes[key] = self.status_codes.get(key, 0) + 1
+            if status == "200":
+                self.latency.observe(latency)
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+            if self.first_at is None:
+                self.first_at = now - latency
+            self.last_at = now
+
+    def record_retries(self, n):
+        with self._lock:
+            self.retries += n
+
+    def cost_usd(self):
+        return (self.prompt_tokens * LLM_PRICE_INPUT_PER_M + self.completion_tokens * LLM_PRICE_OUTPUT_PER_M) / 1e6
+
+    def snapshot(self):
+        """Resumen para job_status: percentiles, tokens/s y coste estimado."""
+        with self._lock:
+            elapsed = (self.last_at - self.first_at) if self.first_at is not None else 0.0
+            codes = {}
+            by_endpoint = {}
+            for (endpoint, status), n in self.status_codes.items():
+                codes[status] = codes.get(status, 0) + n
+                if endpoint:
+                    by_endpoint.setdefault(endpoint, {})[status] = n
+            total_tokens = self.prompt_tokens + self.completion_tokens
+
+            def pct(p):
+                value = self.latency.percentile(p)
+                return round(value, 3) if value is not None else None
+
+            return {
+                "requests": sum(codes.values()),
+                "status_codes": codes,
+                "by_endpoint": by_endpoint,
+                "retries": self.retries,
+                "p50_latency_s": pct(0.50),
+                "p95_latency_s": pct(0.95),
+                "p99_latency_s": pct(0.99),
+                "mean_latency_s": round(self.latency.sum / self.latency.count, 3) if self.latency.count else None,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tokens_per_s": round(total_tokens / elapsed, 1) if elapsed > 0 else 0.0,
+                "cost_usd": round(self.cost_usd(), 4),
+            }
+
+    def render_prometheus(self):
+        """Formato de texto de Prometheus (para GET /metrics)."""
+        with self._lock:
+            lines = [
+                "# HELP llm_requests_total Peticiones al LLM por endpoint y código de estado.",
+                "# TYPE llm_requests_total counter",
+            ]
+            for (endpoint, status), n in sorted(self.status_codes.items()):
+                lines.append(f'llm_requests_total{{endpoint="{endpoint}",status="{status}"}} {n}')
+            lines += [
+                "# HELP llm_request_latency_seconds Latencia de las peticiones correctas al LLM.",
+                "# TYPE llm_request_latency_seconds histogram",
+            ]
+            for bound, total in self.latency.cumulative():
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'llm_request_latency_seconds_bucket{{le="{le}"}} {total}')
+            lines += [
+                f"llm_request_latency_seconds_sum {self.latency.sum:.6f}",
+                f"llm_request_latency_seconds_count {self.latency.count}",
+                "# HELP llm_tokens_total Tokens consumidos por tipo.",
+                "# TYPE llm_tokens_total counter",
+                f'llm_tokens_total{{kind="prompt"}} {self.prompt_tokens}',
+                f'llm_tokens_total{{kind="completion"}} {self.completion_tokens}',
+                "# HELP llm_retries_total Elementos reenviados por la cola de reintentos.",
+                "# TYPE llm_retries_total counter",
+                f"llm_retries_total {self.retries}",
+                "# HELP llm_cost_usd_total Coste estimado acumulado (USD).",
+                "# TYPE llm_cost_usd_total counter",
+                f"llm_cost_usd_total {self.cost_usd():.6f}",
+            ]
+            return "\n".join(lines) + "\n"
+
+
+# Acumulado de todo el proceso (la API ejecuta la fase LLM en su propio proceso)
+GLOBAL_TELEMETRY = Telemetry()
+
+
+class JobTelemetry(Telemetry):
+    """Telemetría de un motor que además reenvía cada observación a GLOBAL_TELEMETRY."""
+
+    def record(self, latency, status, prompt_tokens=0, completion_tokens=0, endpoint=""):
+        super().record(latency, status, prompt_tokens, completion_tokens, endpoint)
+        GLOBAL_TELEMETRY.record(latency, status, prompt_tokens, completion_tokens, endpoint)
+
+    def record_retries(self, n):
+        super().record_retries(n)
+        GLOBAL_TELEMETRY.record_retries(n)
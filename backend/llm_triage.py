@@ -0,0 +1,159 @@
+import re
+
+import pandas as pd
+
+from local_classifier import NEGATIVE_EMOJI, POSITIVE_EMOJI
+from prompt_builder import EMPTY_VALUES, build_items
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Triaje previo a la fase LLM: las filas de relleno de los scrapers se resuelven sin llamar al LLM
+LLM_TRIAGE_ENABLED = getattr(_config, "LLM_TRIAGE_ENABLED", True)
+
+# Acciones de cada regla:
+#   "skip"     -> 'N/A' (no cuenta en las estadísticas ni como fallo)
+#   "neutral"  -> 'Neutro'
+#   "emoji"    -> etiqueta por los emojis del comentario (léxico de local_classifier)
+#   "classify" -> regla desactivada, la fila va al LLM
+# Reglas: empty (la fila no tiene texto utilizable), placeholder (comentario de relleno),
+# empty_comment (post sin comentario), emoji_only (solo emojis), short (comentario de menos
+# de min_chars caracteres).
+TRIAGE_DEFAULT_RULES = getattr(_config, "TRIAGE_DEFAULT_RULES", {
+    "placeholders": ["No comments found"],
+    "min_chars": 2,
+    "empty": "skip",
+    "placeholder": "skip",
+    "empty_comment": "classify",
+    "emoji_only": "emoji",
+    "short": "neutral",
+})
+# Cambios por plataforma (nombre normalizado, como en analysis.py) sobre las reglas por defecto
+TRIAGE_PLATFORM_RULES = getattr(_config, "TRIAGE_PLATFORM_RULES", {
+    # LinkedIn guarda el post como fila padre con comment_content vacío, además de cada comentario
+    "linkedin": {"empty_comment": "skip"},
+})
+
+# Columnas que no aportan texto a la fila
+METADATA_COLUMNS = {"platform", "post_index", "post_author", "comment_author"}
+
+TRIAGE_EXPLANATIONS = {
+    "empty": "Triaje: fila sin texto",
+    "placeholder": "Triaje: comentario de relleno del scraper",
+    "empty_comment": "Triaje: post sin comentario",
+    "emoji_only": "Triaje: solo emojis",
+    "short": "Triaje: comentario demasiado corto",
+}
+
+# Emojis (pictogramas, símbolos, banderas, tonos de piel, ZWJ y selector de variación)
+_EMOJI_RE = re.compile("[\U0001F000-\U0001FAFF\u2300-\u23FF\u2600-\u27BF\u2B00-\u2BFF\u200d\ufe0f\u20e3]")
+_POSITIVE_RE = "[" + "".join(sorted(POSITIVE_EMOJI)) + "]"
+_NEGATIVE_RE = "[" + "".join(sorted(NEGATIVE_EMOJI)) + "]"
+
+
+def rules_for(platform, platform_rules=None):
+    """Reglas efectivas de una plataforma: las de por defecto con sus cambios encima."""
+    overrides = (TRIAGE_PLATFORM_RULES if platform_rules is None else platform_rules).get(platform, {})
+    return dict(TRIAGE_DEFAULT_RULES, **overrides)
+
+
+def _clean(df, name):
+    if name not in df.columns:
+        return pd.Series([""] * len(df), index=df.index)
+    s = df[name].fillna("").astype(str).str.strip()
+    return s.where(~s.str.lower().isin(EMPTY_VALUES), "")
+
+
+def triage_rows(df, texts=None, platform_rules=None):
+    """
+    Triaje vectorizado: para cada fila, None si debe ir al LLM o el resultado ya resuelto
+    ({"sentiment", "explanation", "tokens": 0, "triage": regla}). Las reglas se evalúan
+    con operaciones de pandas sobre columnas enteras, una pasada por plataforma.
+    texts: texto de prompt de cada fila (el de build_items) si ya se calculó.
+    """
+    n = len(df)
+    if n == 0:
+        return []
+    if texts is None:
+        texts = [item.text for item in build_items(df)]
+    index = pd.RangeIndex(n)
+    df = df.reset_index(drop=True)
+    text = pd.Series(texts, index=index).fillna("").astype(str).str.strip()
+    posts = _clean(df, "post_content")
+    comments = _clean(df, "comment_content")
+    platforms = df["platform"].map(str).str.lower().str.strip() if "platform" in df.columns else pd.Series([""] * n)
+
+    emoji_only = comments.ne("") & comments.str.replace(_EMOJI_RE, "", regex=True).str.strip().eq("") \
+        & comments.str.contains(_EMOJI_RE)
+    # Sin texto: el prompt queda vacío, o la fila solo tiene metadatos (plataforma, índice, autores)
+    content_cols = [c for c in df.columns if c not in METADATA_COLUMNS]
+    meta_only = pd.concat([_clean(df, c).eq("") for c in content_cols], axis=1).all(axis=1) if content_cols \
+        else pd.Series(True, index=index)
+    empty = text.eq("") | text.str.lower().isin(EMPTY_VALUES) | meta_only
+    empty_comment = comments.eq("") & posts.ne("")
+    comment_lower = comments.str.lower()
+    comment_len = comments.str.len()
+
+    reasons = pd.Series([None] * n, index=index, dtype=object)
+    labels = pd.Series([None] * n, index=index, dtype=object)
+    for platform in platforms.unique():
+        rules = rules_for(platform, platform_rules)
+        on = platforms == platform
+        placeholders = {p.lower() for p in rules.get("placeholders", [])}
+        masks = [
+            ("empty", empty),
+            ("placeholder", comment_lower.isin(placeholders)),
+            ("empty_comment", empty_comment),
+            ("emoji_only", emoji_only),
+            ("short", comments.ne("") & (comment_len < rules.get("min_chars", 2))),
+        ]
+        for rule, mask in masks:
+            action = rules.get(rule, "classify")
+            if action == "classify":
+                continue
+            hit = on & mask & reasons.isna()
+            if not hit.any():
+                continue
+            reasons[hit] = rule
+            if action == "neutral":
+                labels[hit] = "Neutro"
+            elif action == "emoji":
+                c = comments[hit]
+                score = c.str.count(_POSITIVE_RE) - c.str.count(_NEGATIVE_RE)
+                labels[hit] = score.map(lambda s: "Positivo" if s > 0 else "Negativo" if s < 0 else "Neutro")
+            else:
+                labels[hit] = "N/A"
+
+    return [
+        None if reason is None else
+        {"sentiment": label, "explanation": TRIAGE_EXPLANATIONS[reason], "tokens": 0, "triage": reason}
+        for reason, label in zip(reasons.tolist(), labels.tolist())
+    ]
+
+
+def triage_stats(results, texts, sent_texts=()):
+    """
+    Resumen del triaje: filas resueltas por regla y peticiones ahorradas (textos distintos
+    que solo aparecían en filas de relleno; los que también envían otras filas no cuentan).
+    """
+    by_rule = {}
+    skipped = labeled = 0
+    triaged_texts = set()
+    for res, text in zip(results, texts):
+        if res is None:
+            continue
+        by_rule[res["triage"]] = by_rule.get(res["triage"], 0) + 1
+        if res["sentiment"] == "N/A":
+            skipped += 1
+        else:
+            labeled += 1
+        triaged_texts.add(text)
+    return {
+        "rows": skipped + labeled,
+        "skipped": skipped,
+        "labeled": labeled,
+        "by_rule": by_rule,
+        "calls_saved": len(triaged_texts - set(sent_texts)),
+    }
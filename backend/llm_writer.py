@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundWriter:
+    """
+    Escrituras a MongoDB fuera del event loop de la fase LLM.
+
+    Los callbacks del loop (resultados, progreso) solo encolan la escritura; un único
+    hilo las ejecuta en el mismo orden en que llegaron, así el loop no se detiene en
+    cada ida y vuelta de pymongo. wait() bloquea hasta que todo lo encolado terminó
+    (llamarlo fuera del loop, al cerrar la fase).
+    """
+
+    def __init__(self, name="llm-writer"):
+        self.name = name
+        self._executor = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(self._executor.submit(self._call, fn, args, kwargs))
+
+    def _call(self, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            # Los métodos de Database ya capturan sus errores: esto es solo por seguridad
+            print(f"[Writer] Error en una escritura en segundo plano: {e}")
+
+    def wait(self):
+        """Espera a que terminen las escrituras encoladas."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for f in futures:
+            f.result()
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,165 @@
+import re
+import time
+import unicodedata
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# scikit-learn es opcional: sin él, el clasificador local usa solo el léxico
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+
+# Modo cascada: el clasificador local etiqueta lo que tiene claro y solo escala el resto al LLM
+LLM_CASCADE_MODE = getattr(_config, "LLM_CASCADE_MODE", False)
+CASCADE_CONFIDENCE = getattr(_config, "CASCADE_CONFIDENCE", 0.85)
+CASCADE_MIN_TRAINING = getattr(_config, "CASCADE_MIN_TRAINING", 300) # Etiquetas mínimas para entrenar
+CASCADE_RETRAIN_SECONDS = getattr(_config, "CASCADE_RETRAIN_SECONDS", 6 * 3600)
+
+LABELS = ("Positivo", "Negativo", "Neutro")
+
+POSITIVE_WORDS = {
+    "bueno", "buena", "buenos", "buenas", "excelente", "genial", "increible", "maravilloso", "maravillosa",
+    "feliz", "felicidades", "felicitaciones", "gracias", "amor", "encanta", "encanto", "mejor", "bien",
+    "bravo", "orgullo", "orgulloso", "orgullosa", "hermoso", "hermosa", "espectacular", "fantastico",
+    "fantastica", "perfecto", "perfecta", "exito", "apoyo", "esperanza", "alegria", "felicitar", "top",
+    "brillante", "impresionante", "recomiendo", "gran", "ganamos", "victoria", "bendiciones", "lindo", "linda",
+}
+NEGATIVE_WORDS = {
+    "malo", "mala", "malos", "malas", "pesimo", "pesima", "horrible", "terrible", "odio", "asco", "fraude",
+    "corrupto", "corrupta", "corruptos", "corrupcion", "mentira", "mentiroso", "mentirosos", "ladron",
+    "ladrones", "robo", "verguenza", "vergonzoso", "triste", "miedo", "peligro", "crisis", "desastre",
+    "basura", "inutil", "culpa", "muerte", "muertos", "dictador", "dictadura", "abuso", "injusto",
+    "injusticia", "estafa", "rechazo", "fracaso", "peor", "mal", "lamentable", "indignante", "asqueroso",
+}
+POSITIVE_EMOJI = set("😀😃😄😁😊😍🥰😘👍👏🙌💪❤💙💚💛🎉✨🔥🙏")
+NEGATIVE_EMOJI = set("😡😠🤬😢😭😞😒👎💔🤮😤😱")
+NEGATORS = {"no", "nunca", "ni", "tampoco", "jamas", "sin"}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def lexicon_score(text):
+    """Puntuación de polaridad por léxico (+ positivo / - negativo), con negación simple."""
+    tokens = _TOKEN_RE.findall(_strip_accents(text.lower()))
+    score = 0
+    negate_window = 0
+    for tok in tokens:
+        if tok in NEGATORS:
+            negate_window = 3
+            continue
+        polarity = 1 if tok in POSITIVE_WORDS else -1 if tok in NEGATIVE_WORDS else 0
+        if polarity and negate_window:
+            polarity = -polarity
+        score += polarity
+        if negate_window:
+            negate_window -= 1
+    score += sum(1 for c in text if c in POSITIVE_EMOJI)
+    score -= sum(1 for c in text if c in NEGATIVE_EMOJI)
+    return score
+
+
+class LocalSentimentClassifier:
+    """
+    Clasificador de sentimiento barato y en proceso para el modo cascada.
+
+    - Modelo lineal (TF-IDF de n-gramas de caracteres + regresión logística) entrenado con
+      las etiquetas `sentiment_llm` ya guardadas en MongoDB, si hay suficientes y
+      scikit-learn está instalado. Predice todo el lote de una vez (vectorizado).
+      Se entrena con el texto del comentario solo, así que hay que predecir sobre el
+      mismo texto (PromptItem.body), no sobre el prompt con el post de contexto.
+    - Léxico en español como respaldo (y como freno: si el léxico contradice con fuerza
+      al modelo, la confianza se reduce a la mitad).
+    """
+
+    def __init__(self):
+        self.vectorizer = None
+        self.model = None
+        self.trained_at = 0.0
+        self.attempted_at = 0.0 # Último intento de entrenar (con o sin éxito)
+        self.training_size = 0
+
+    @property
+    def has_model(self):
+        return self.model is not None
+
+    def train(self, texts, labels):
+        """Entrena el modelo lineal. Devuelve True si se pudo entrenar."""
+        if not SKLEARN_AVAILABLE:
+            return False
+        pairs = [(t, l) for t, l in zip(texts, labels) if t and l in LABELS]
+        if len(pairs) < CASCADE_MIN_TRAINING or len({l for _, l in pairs}) < 2:
+            return False
+        x_texts, y = zip(*pairs)
+        vectorizer = TfidfVectorizer(
+            analyzer="char_wb", ngram_range=(2, 5), min_df=2, max_features=100000,
+            lowercase=True, strip_accents="unicode", sublinear_tf=True
+        )
+        matrix = vectorizer.fit_transform(x_texts)
+        model = LogisticRegression(max_iter=1000, class_weight="balanced")
+        model.fit(matrix, y)
+        self.vectorizer, self.model = vectorizer, model
+        self.trained_at = time.time()
+        self.training_size = len(pairs)
+        return True
+
+    def train_from_db(self, db):
+        """Entrena con las etiquetas LLM históricas guardadas en MongoDB."""
+        if db is None or not db.is_connected:
+            return False
+        # Aunque falle, no se vuelve a consultar MongoDB hasta CASCADE_RETRAIN_SECONDS
+        self.attempted_at = time.time()
+        texts, labels = db.get_labeled_samples()
+        ok = self.train(texts, labels)
+        if ok:
+            print(f"[Cascade] Modelo local entrenado con {self.training_size} etiquetas de MongoDB.")
+        else:
+            print(f"[Cascade] Sin modelo local ({len(texts)} etiquetas disponibles); se usará solo el léxico.")
+        return ok
+
+    def predict(self, texts):
+        """Devuelve una lista de (etiqueta, confianza) para todos los textos en bloque."""
+        scores = [lexicon_score(t) for t in texts]
+
+        if self.has_model:
+            probas = self.model.predict_proba(self.vectorizer.transform(texts))
+            classes = list(self.model.classes_)
+            out = []
+            for row, lex in zip(probas, scores):
+                best = int(row.argmax())
+                label, conf = classes[best], float(row[best])
+                if (label == "Positivo" and lex <= -2) or (label == "Negativo" and lex >= 2):
+                    conf *= 0.5
+                out.append((label, conf))
+            return out
+
+        out = []
+        for lex in scores:
+            if lex == 0:
+                out.append(("Neutro", 0.4)) # El léxico no sabe reconocer neutralidad con seguridad
+            else:
+                out.append(("Positivo" if lex > 0 else "Negativo", min(0.95, 0.55 + 0.1 * abs(lex))))
+        return out
+
+
+_shared_classifier = None
+
+
+def get_local_classifier(db=None):
+    """Clasificador compartido por proceso; se re-entrena cada CASCADE_RETRAIN_SECONDS."""
+    global _shared_classifier
+    if _shared_classifier is None:
+        _shared_classifier = LocalSentimentClassifier()
+    stale = time.time() - _shared_classifier.attempted_at > CASCADE_RETRAIN_SECONDS
+    if stale and db is not None and db.is_connected:
+        _shared_classifier.train_from_db(db)
+    return _shared_classifier
@@ -12,14 +12,20 @@ from scrapers.linkedin import scrape_linkedin
 from scrapers.instagram import scrape_instagram
 import nlp_pipeline
 from llm_processor import process_dataframe_concurrently
+from llm_checkpoint import compute_row_ids, should_resume
+from llm_stream import LLM_STREAMING, STREAM_QUEUE_MAXSIZE, StreamClassifier
+from llm_sampling import LLM_SAMPLE_MIN_ROWS, classify_sample
 from analysis import perform_analysis
 import config
 
 # Configuración (En un caso real, usar variables de entorno)
 CREDENTIALS = config.CREDENTIALS
 
-def worker(platform, topic, credentials, limit=15):
-    """ Función wrapper para el proceso paralelo """
+def worker(platform, topic, credentials, limit=15, sink=None):
+    """
+    Función wrapper para el proceso paralelo.
+    sink: cola (Manager().Queue) donde el scraper publica cada fila según la extrae.
+    """
     # Nota: Si se llama desde API, multiprocessing puede tener problemas con prints,
     # pero lo dejaremos para debugging.
     print(f"[{platform.capitalize()}] Iniciando worker...")
@@ -39,16 +45,16 @@ def worker(platform, topic, credentials, limit=15):
 
         if platform == "facebook":
             # from scrapers.facebook import scrape_facebook # Already imported at top
-            return scrape_facebook(topic, credentials.get("email"), credentials.get("password"), limit)
+            return list(scrape_facebook(topic, credentials.get("email"), credentials.get("password"), limit, sink=sink))
         elif platform == "twitter":
             # from scrapers.twitter import scrape_twitter # Already imported at top
-            return scrape_twitter(topic, get_user(credentials), credentials.get("password"), limit)
+            return list(scrape_twitter(topic, get_user(credentials), credentials.get("password"), limit, sink=sink))
         elif platform == "linkedin":
             # from scrapers.linkedin import scrape_linkedin # Already imported at top
-            return scrape_linkedin(topic, credentials.get("email"), credentials.get("password"), limit)
+            return list(scrape_linkedin(topic, credentials.get("email"), credentials.get("password"), limit, sink=sink))
         elif platform == "instagram":
             # from scrapers.instagram import scrape_instagram # Already imported at top
-            return scrape_instagram(topic, get_user(credentials), credentials.get("password"), limit)
+            return list(scrape_instagram(topic, get_user(credentials), credentials.get("password"), limit, sink=sink))
         else:
             print(f"Plataforma desconocida: {platform}")
             return []
@@ -56,51 +62,82 @@ def worker(platform, topic, credentials, limit=15):
         print(f"Error en worker {platform}: {e}")
         return []
 
-def run_pipeline(topic: str, limit: int = 10):
+def run_pipeline(topic: str, limit: int = 10, sample: bool = False, target_margin: float = None):
     """
     Función orquestadora principal.
     Scraping -> LLM Processing -> NLP Pipeline -> CSV Export -> Storytelling
+    sample: clasificar solo una muestra estratificada hasta alcanzar `target_margin`
+            (margen de error de los porcentajes; None = LLM_SAMPLE_MARGIN de config).
     Retorna: Ruta del CSV generado o None si falla.
     """
     print(f"\n[Orquestador] Iniciando extracción PARALELA para '{topic}' (Límite: {limit})...")
     
     # Init DB Status
+    resumed_rows = []
     try:
         from database import Database
         db = Database()
         if db.is_connected:
-            db.init_job_status(topic, ["twitter", "facebook", "linkedin", "instagram"], limit)
+            # Si la ejecución anterior del mismo tema se cortó antes de terminar la fase LLM,
+            # se reanuda desde las filas guardadas en el checkpoint (sin volver a scrapear)
+            # (solo si falló o murió hace poco, y con un número máximo de reintentos)
+            previous = db.get_job_status(topic)
+            if should_resume(previous):
+                resumed_rows = db.get_llm_checkpoint_rows(topic)
+            attempts = previous.get("llm_resume_attempts", 0) + 1 if resumed_rows else 0
+            db.init_job_status(topic, ["twitter", "facebook", "linkedin", "instagram"], limit, resume_attempts=attempts)
     except: db = None
 
-    # Crear procesos
     start_time_scraping = time.time()
-    pool = multiprocessing.Pool(processes=4) # 4 Processes
-    
-    tasks = []
-    # Tarea Facebook
-    tasks.append(pool.apply_async(worker, ("facebook", topic, CREDENTIALS["facebook"], limit)))
-    
-    # Tarea Twitter
-    tasks.append(pool.apply_async(worker, ("twitter", topic, CREDENTIALS["twitter"], limit)))
+    all_data = []
+    streamer = None
+    if resumed_rows:
+        print(f"[Checkpoint] Reanudando '{topic}' con {len(resumed_rows)} filas guardadas; se omite el scraping.")
+        all_data = resumed_rows
+    else:
+        # Streaming: la fase LLM consume las filas mientras los scrapers siguen trabajando
+        row_queue = None
+        # En modo muestreo no se clasifica todo lo que llega: sin streaming
+        if LLM_STREAMING and not sample:
+            manager = multiprocessing.Manager()
+            row_queue = manager.Queue(maxsize=STREAM_QUEUE_MAXSIZE)
+            streamer = StreamClassifier(row_queue, db=db if db and db.is_connected else None).start()
 
-    # Tarea LinkedIn
-    tasks.append(pool.apply_async(worker, ("linkedin", topic, CREDENTIALS["linkedin"], limit)))
+        # Crear procesos
+        pool = multiprocessing.Pool(processes=4) # 4 Processes
+        
+        tasks = []
+        # Tarea Facebook
+        tasks.append(pool.apply_async(worker, ("facebook", topic, CREDENTIALS["facebook"], limit, row_queue)))
+        
+        # Tarea Twitter
+        tasks.append(pool.apply_async(worker, ("twitter", topic, CREDENTIALS["twitter"], limit, row_queue)))
 
-    # Tarea Instagram
-    tasks.append(pool.apply_async(worker, ("instagram", topic, CREDENTIALS["instagram"], limit)))
-    
-    # Recolectar resultados
-    all_data = []
-    for task in tasks:
-        try:
-            res = task.get(timeout=1800) 
-            if res:
-                all_data.extend(res)
-        except Exception as e:
-            print(f"Error en un worker: {e}")
-            
-    pool.close()
-    pool.join()
+        # Tarea LinkedIn
+        tasks.append(pool.apply_async(worker, ("linkedin", topic, CREDENTIALS["linkedin"], limit, row_queue)))
+
+        # Tarea Instagram
+        tasks.append(pool.apply_async(worker, ("instagram", topic, CREDENTIALS["instagram"], limit, row_queue)))
+        
+        # Recolectar resultados
+        for task in tasks:
+            try:
+                res = task.get(timeout=1800) 
+                if res:
+                    all_data.extend(res)
+            except Exception as e:
+                print(f"Error en un worker: {e}")
+                
+        pool.close()
+        pool.join()
+
+        if streamer is not None:
+            # Esperar a que el consumidor termine las tandas que quedan en vuelo
+            streamer.close()
+            manager.shutdown()
+            print(f"[Stream] {streamer.rows_received} filas recibidas en streaming; {len(streamer.results)} textos clasificados durante el scraping.")
+            if db and db.is_connected:
+                db.update_llm_metrics(topic, {"stream": streamer.stats()})
     
     scraping_duration = time.time() - start_time_scraping
     print(f"\n[Stats] Tiempo total de Scraping: {scraping_duration:.2f} segundos")
@@ -118,24 +155,46 @@ def run_pipeline(topic: str, limit: int = 10):
         # Create DataFrame
         df = pd.DataFrame(all_data)
 
+        # Guardar las filas crudas: si la fase LLM se interrumpe, el siguiente run no re-scrapea
+        if db and db.is_connected and not resumed_rows:
+            db.save_llm_checkpoint_rows(topic, all_data, compute_row_ids(df))
+
         # FASE 2: PROCESAMIENTO CON LLMs 
         llm_duration = 0
+        llm_errors = 0
         try:
             print("\n[INFO] Iniciando Fase 2: Clasificación de Sentimiento con LLMs...")
             if db and db.is_connected:
                 db.update_llm_status(topic, "running")
 
             start_time_llm = time.time()
-            df = process_dataframe_concurrently(df)
+            if sample and len(df) > LLM_SAMPLE_MIN_ROWS:
+                df = classify_sample(
+                    df, topic=topic, db=db if db and db.is_connected else None, target_margin=target_margin
+                )
+            else:
+                df = process_dataframe_concurrently(
+                    df, topic=topic, db=db if db and db.is_connected else None,
+                    engine=streamer.engine if streamer else None,
+                    precomputed=streamer.results if streamer else None
+                )
             llm_duration = time.time() - start_time_llm
+            llm_errors = int((df['sentiment_llm'] == "Error").sum())
             print(f"[Stats] Tiempo total de Clasificación LLM: {llm_duration:.2f} segundos")
             
             if db and db.is_connected:
                 db.update_llm_status(topic, "completed")
                 db.update_job_timings(topic, llm_time=llm_duration)
+                if llm_errors == 0:
+                    db.clear_llm_checkpoint(topic)
             print("[INFO] Fase 2 completada.")
         except Exception as e:
             print(f"\n[WARN] No se pudo ejecutar el análisis de LLMs: {e}")
+            if db and db.is_connected:
+                db.update_llm_status(topic, "failed")
+
+        # Id estable de cada fila (el del checkpoint): /explain recupera con él la fila original
+        df['row_id'] = compute_row_ids(df)
 
         # Reorder/Filter columns
         cols = ['platform', 'sentiment_llm', 'explanation_llm', 'tokens_llm', 'post_index', 'post_author', 'post_content', 'comment_author', 'comment_content']
@@ -166,6 +225,10 @@ def run_pipeline(topic: str, limit: int = 10):
                     "sentiment_llm": group['sentiment_llm'].mode()[0] if not group['sentiment_llm'].empty else "", # Post sentiment (heuristic)
                     "comments": []
                 }
+                # Fila propia del post (sin comentario), si la hay
+                post_rows = group[group['comment_content'] == ""] if 'comment_content' in group.columns else group
+                if not post_rows.empty:
+                    post_obj["row_id"] = post_rows.iloc[0]['row_id']
                 
                 # Add comments
                 for _, row in group.iterrows():
@@ -173,7 +236,10 @@ def run_pipeline(topic: str, limit: int = 10):
                         post_obj["comments"].append({
                             "author": row.get('comment_author', ''),
                             "content": row.get('comment_content', ''),
-                            "sentiment": row.get('sentiment_llm', '') # Comment specific sentiment
+                            "sentiment": row.get('sentiment_llm', ''), # Comment specific sentiment
+                            # Las etiquetas del clasificador local o del triaje no entrenan al modelo local
+                            "label_source": row.get('label_source', 'llm'),
+                            "row_id": row.get('row_id', '')
                         })
                 
                 structured_data.append(post_obj)
@@ -211,7 +277,7 @@ def run_pipeline(topic: str, limit: int = 10):
         try:
             print("\n[Orquestador] Generando Informe Ejecutivo (Storytelling)...")
             # Pass DF directly to avoid re-reading
-            timings = {"scraping": scraping_duration, "llm": llm_duration}
+            timings = {"scraping": scraping_duration, "llm": llm_duration, "llm_errors": llm_errors}
             perform_analysis(None, topic, df=df, timings=timings)
         except Exception as e:
              print(f"[Analysis Error] No se pudo generar el reporte JSON: {e}")
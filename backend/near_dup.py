@@ -0,0 +1,177 @@
+import re
+import unicodedata
+
+import numpy as np
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Agrupar comentarios casi idénticos (copy-paste, variantes de emojis) y clasificar uno por grupo.
+# Opcional: un grupo hereda una sola etiqueta, así que un falso positivo cambia resultados
+NEAR_DUP_ENABLED = getattr(_config, "NEAR_DUP_ENABLED", False)
+# Similitud de Jaccard estimada mínima para considerar dos textos el mismo comentario
+NEAR_DUP_THRESHOLD = getattr(_config, "NEAR_DUP_THRESHOLD", 0.8)
+NEAR_DUP_NUM_PERM = getattr(_config, "NEAR_DUP_NUM_PERM", 64)
+NEAR_DUP_BANDS = getattr(_config, "NEAR_DUP_BANDS", 16) # 16 bandas x 4 filas: casi todo par >= 0.8 es candidato
+NEAR_DUP_SHINGLE = 5 # n-gramas de caracteres
+# Dos textos solo se agrupan si contienen las mismas negaciones (tras normalizar): con
+# shingles de 5 caracteres "apoyo esta medida" y "no apoyo esta medida" superan el umbral
+NEAR_DUP_NEGATIONS = frozenset(getattr(_config, "NEAR_DUP_NEGATIONS", [
+    "no", "nunca", "ni", "jamas", "nada", "nadie", "ninguno", "ninguna", "tampoco", "sin",
+    "not", "never", "nor", "none", "nothing", "nobody", "without",
+]))
+
+_MAX_HASH = (1 << 32) - 1
+_REPEAT_RE = re.compile(r"(.)\1{2,}")
+_EMOJI_RUN_RE = re.compile(r"(\S)\1+")
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+_MARKS_RE = re.compile(r"[\u0300-\u036f\ufe0f]")
+
+
+def _is_emoji(ch):
+    return unicodedata.category(ch) == "So"
+
+
+def normalize_for_dedup(text):
+    """
+    Forma canónica para comparar: minúsculas, sin tildes, sin menciones/URLs,
+    repeticiones colapsadas ("jajajaaaa" -> "jajajaa", "😂😂😂" -> "😂") y sin puntuación.
+    Los emojis se conservan: cambian el sentimiento.
+    """
+    t = _MARKS_RE.sub("", unicodedata.normalize("NFD", str(text).lower()))
+    t = re.sub(r"https?://\S+|@\w+", " ", t)
+    t = _REPEAT_RE.sub(r"\1\1", t)
+    t = _EMOJI_RUN_RE.sub(lambda m: m.group(1) if _is_emoji(m.group(1)) else m.group(0), t)
+    t = _PUNCT_RE.sub(lambda m: m.group(0) if _is_emoji(m.group(0)) else " ", t)
+    return _SPACE_RE.sub(" ", t).strip()
+
+
+def negations(norm):
+    """Negaciones presentes en un texto ya normalizado (normalize_for_dedup)."""
+    return frozenset(w for w in norm.split() if w in NEAR_DUP_NEGATIONS)
+
+
+def shingles(text, k=NEAR_DUP_SHINGLE):
+    """n-gramas de caracteres (con repeticiones: no cambian el mínimo de MinHash)."""
+    if len(text) <= k:
+        return [text] if text else []
+    return [text[i:i + k] for i in range(len(text) - k + 1)]
+
+
+class MinHasher:
+    """
+    Firmas MinHash con hashing multiply-shift ((a*x + b) mod 2^64 >> 32, a impar),
+    vectorizado con numpy: sin módulos por primo, el desbordamiento de uint64 es el módulo.
+    """
+
+    def __init__(self, num_perm=None, seed=1):
+        self.num_perm = num_perm or NEAR_DUP_NUM_PERM
+        rng = np.random.RandomState(seed)
+        self.a = (rng.randint(0, 1 << 63, size=self.num_perm, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+        self.b = rng.randint(0, 1 << 63, size=self.num_perm, dtype=np.uint64)
+
+    def signatures(self, shingle_sets, chunk_shingles=200000):
+        """
+        Firmas de muchos conjuntos a la vez: concatena los hashes de sus shingles y
+        reduce por segmentos (np.minimum.reduceat), en trozos para acotar la memoria.
+        Devuelve una matriz (len(shingle_sets), num_perm).
+        """
+        out = np.empty((len(shingle_sets), self.num_perm), dtype=np.uint64)
+        start = 0
+        while start < len(shingle_sets):
+            end, total = start, 0
+            while end < len(shingle_sets) and (end == start or total + len(shingle_sets[end]) <= chunk_shingles):
+                total += len(shingle_sets[end])
+                end += 1
+            chunk = shingle_sets[start:end]
+            # hash() de Python es estable dentro del proceso, que es todo lo que necesita un clustering
+            hashes = np.fromiter(
+                (hash(sh) & _MAX_HASH for shs in chunk for sh in shs), dtype=np.uint64, count=total
+            )
+            offsets = np.cumsum([0] + [len(shs) for shs in chunk[:-1]])
+            values = (np.outer(self.a, hashes) + self.b[:, None]) >> np.uint64(32)
+            out[start:end] = np.minimum.reduceat(values, offsets, axis=1).T
+            start = end
+        return out
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x, y):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            # El índice menor queda como raíz: el representante es el primer texto del grupo
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+def cluster_near_duplicates(texts, threshold=None, num_perm=None, bands=None):
+    """
+    Agrupa textos casi idénticos con MinHash + LSH (coste lineal, sin comparar todos con todos).
+    Devuelve una lista `rep` donde rep[i] es el índice del representante del grupo de texts[i]
+    (el primer texto del grupo, así que rep[i] <= i).
+
+    - Textos idénticos tras normalizar se unen directamente.
+    - Dos textos que comparten algún bucket LSH se unen si la similitud estimada de sus
+      firmas supera `threshold` y tienen las mismas negaciones (NEAR_DUP_NEGATIONS). En
+      cada bucket solo se compara con su primer miembro, de modo que 10.000 copias del
+      mismo spam siguen costando 10.000 comparaciones.
+    """
+    threshold = NEAR_DUP_THRESHOLD if threshold is None else threshold
+    bands = bands or NEAR_DUP_BANDS
+    hasher = MinHasher(num_perm)
+    rows_per_band = hasher.num_perm // bands
+    uf = _UnionFind(len(texts))
+
+    first_by_norm = {}
+    candidates = []
+    candidate_shingles = []
+    candidate_negations = []
+    for i, t in enumerate(texts):
+        norm = normalize_for_dedup(t)
+        if norm in first_by_norm:
+            uf.union(first_by_norm[norm], i)
+            continue
+        first_by_norm[norm] = i
+        sh = shingles(norm)
+        # Textos muy cortos: solo coincidencia exacta (la similitud de 1-2 shingles no significa nada)
+        if len(sh) >= 3:
+            candidates.append(i)
+            candidate_shingles.append(sh)
+            candidate_negations.append(negations(norm))
+    if not candidates:
+        return [uf.find(i) for i in range(len(texts))]
+
+    sigs = hasher.signatures(candidate_shingles)
+    # Claves LSH: cada banda de la firma reducida a un entero (las colisiones espurias
+    # no importan: todo candidato se verifica después contra la firma completa)
+    mixers = hasher.a[:rows_per_band]
+    band_keys = [
+        (sigs[:, b * rows_per_band:(b + 1) * rows_per_band] * mixers).sum(axis=1).tolist() for b in range(bands)
+    ]
+    row_of = {i: row for row, i in enumerate(candidates)}
+    buckets = {}
+    for row, i in enumerate(candidates):
+        joined = False
+        for band in range(bands):
+            first = buckets.setdefault((band, band_keys[band][row]), row)
+            if joined or first == row:
+                continue
+            # Se compara con el representante del grupo (no con cualquier miembro) para no encadenar
+            root = uf.find(candidates[first])
+            if candidate_negations[row_of[root]] != candidate_negations[row]:
+                continue
+            if np.count_nonzero(sigs[row_of[root]] == sigs[row]) >= threshold * hasher.num_perm:
+                uf.union(root, i)
+                joined = True
+    return [uf.find(i) for i in range(len(texts))]
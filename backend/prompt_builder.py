@@ -0,0 +1,206 @@
+from collections import OrderedDict, namedtuple
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Presupuesto de caracteres del texto de una fila (post + comentario)
+PROMPT_MAX_CHARS = getattr(_config, "PROMPT_MAX_CHARS", 1000)
+# Presupuesto del post cuando se envía UNA vez como contexto de un grupo de comentarios
+PROMPT_CONTEXT_MAX_CHARS = getattr(_config, "PROMPT_CONTEXT_MAX_CHARS", 1500)
+# Agrupar los comentarios de un mismo post en una petición con el post como contexto
+LLM_GROUP_BY_POST = getattr(_config, "LLM_GROUP_BY_POST", True)
+# Comentarios por petición en modo agrupado cuando el modo por lotes general está apagado
+LLM_GROUP_BATCH_SIZE = getattr(_config, "LLM_GROUP_BATCH_SIZE", 20)
+# Orden de envío por prioridad: plataformas y posts en round-robin, posts antes que comentarios
+LLM_PRIORITY_ORDER = getattr(_config, "LLM_PRIORITY_ORDER", True)
+
+EMPTY_VALUES = {"", "nan", "none"}
+# Valores que no aportan nada al texto de una fila "flat" (p.ej. filas desplazadas de LinkedIn)
+FLAT_SKIP_VALUES = {"nan", "none", "", "linkedin", "post", "comment", "objetivo"}
+
+# text: texto autocontenido (clave de caché y modo fila a fila)
+# context: post compartido por el grupo ("" si la fila no tiene comentario)
+# body: lo que se envía en modo agrupado (el comentario recortado a PROMPT_MAX_CHARS, o el
+#       texto completo si no hay contexto)
+PromptItem = namedtuple("PromptItem", ["text", "context", "body", "group"])
+
+
+def clean_value(val):
+    """Convierte un valor de celda a string, tratando NaN/None como vacío."""
+    if val is None:
+        return ""
+    s = str(val).strip()
+    return "" if s.lower() in EMPTY_VALUES else s
+
+
+def compose_text(post, comment, max_chars=None):
+    """
+    Texto autocontenido de una fila. El comentario tiene prioridad: el post solo
+    ocupa los caracteres que sobran, así un post largo nunca corta el comentario.
+    """
+    max_chars = max_chars or PROMPT_MAX_CHARS
+    if not comment:
+        return post[:max_chars]
+    if len(comment) >= max_chars:
+        return f"Comment: {comment[:max_chars]}"
+    post_budget = max_chars - len(comment) - len("Post:  | Comment: ")
+    if not post or post_budget <= 0:
+        return f"Comment: {comment}"
+    return f"Post: {post[:post_budget]} | Comment: {comment}"
+
+
+def flat_text(p_content, c_content, content, values, max_chars=None):
+    """
+    Texto de una fila sin post ni comentario utilizables (formato flat). Si tampoco hay
+    'content' útil, se unen todos los valores de la fila: es la lógica especial para las
+    filas desplazadas de LinkedIn. Recibe los valores crudos ya convertidos a str.
+    """
+    max_chars = max_chars or PROMPT_MAX_CHARS
+    if not p_content and not c_content:
+        text = content
+    else:
+        text = f"Post: {p_content} | Comment: {c_content}"
+    if len(text) < 5 or "nan" in text.lower():
+        parts = [v for v in (str(x).strip() for x in values) if v and v.lower() not in FLAT_SKIP_VALUES]
+        if parts:
+            text = " | ".join(parts)
+    return text[:max_chars]
+
+
+def _raw_column(df, name):
+    """Columna como lista de str(valor) (NaN -> 'nan', None -> 'None'); '' si no existe."""
+    if name not in df.columns:
+        return [""] * len(df)
+    return df[name].map(str).tolist()
+
+
+def _clean_column(df, name):
+    """Columna limpia (vectorizado): strip y NaN/None/'nan' -> ''."""
+    if name not in df.columns:
+        return [""] * len(df)
+    s = df[name].fillna("").astype(str).str.strip()
+    return s.where(~s.str.lower().isin(EMPTY_VALUES), "").tolist()
+
+
+def build_items(df, max_chars=None):
+    """
+    PromptItem de todas las filas del DataFrame, construidos por columnas: la limpieza
+    de post_content/comment_content/platform/post_index se hace con operaciones de
+    pandas sobre la columna entera y después solo se recorren listas de str (sin crear
+    una Series por fila). Equivale a LLMProcessor.build_item fila a fila.
+    """
+    max_chars = max_chars or PROMPT_MAX_CHARS
+    posts = _clean_column(df, "post_content")
+    comments = _clean_column(df, "comment_content")
+    groups = list(zip(_clean_column(df, "platform"), _clean_column(df, "post_index")))
+
+    # Filas sin post ni comentario: texto flat, calculado solo sobre ese subconjunto
+    flat_rows = [n for n, (p, c) in enumerate(zip(posts, comments)) if not p and not c]
+    flat = {}
+    if flat_rows:
+        sub = df.iloc[flat_rows]
+        values = sub.values.tolist()
+        raw = zip(_raw_column(sub, "post_content"), _raw_column(sub, "comment_content"), _raw_column(sub, "content"))
+        for n, (p_raw, c_raw, content), row_values in zip(flat_rows, raw, values):
+            flat[n] = flat_text(p_raw, c_raw, content, row_values, max_chars)
+
+    items = []
+    for n, (post, comment, group) in enumerate(zip(posts, comments, groups)):
+        if n in flat:
+            items.append(PromptItem(flat[n], "", flat[n], group))
+        elif not comment:
+            text = post[:max_chars]
+            items.append(PromptItem(text, "", text, group))
+        else:
+            items.append(PromptItem(compose_text(post, comment, max_chars), post, comment[:max_chars], group))
+    return items
+
+
+def estimate_tokens(text):
+    """Estimación barata de tokens (~4 caracteres por token) para presupuestar lotes."""
+    return max(1, len(text) // 4)
+
+
+def make_batches(texts, max_items, token_budget):
+    """
+    Agrupa los textos en lotes respetando un máximo de elementos y un presupuesto
+    aproximado de tokens de entrada. Devuelve listas de índices.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for i, t in enumerate(texts):
+        t_tokens = estimate_tokens(t)
+        if current and (len(current) >= max_items or current_tokens + t_tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += t_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def plan_requests(items, batch_size, token_budget, group_by_post=None):
+    """
+    Decide cómo se reparten los items en peticiones. Devuelve una lista de
+    (contexto | None, [índices]):
+      - Comentarios del mismo post (2 o más): una petición por trozo, con el post
+        enviado una sola vez como contexto.
+      - Resto: lotes genéricos si batch_size > 1, o una petición por item.
+    """
+    if group_by_post is None:
+        group_by_post = LLM_GROUP_BY_POST
+
+    groups = OrderedDict()
+    for i, item in enumerate(items):
+        groups.setdefault((item.group, item.context), []).append(i)
+
+    units = []
+    loose = []
+    for (_, context), idxs in groups.items():
+        if group_by_post and context and len(idxs) >= 2:
+            size = batch_size if batch_size and batch_size > 1 else LLM_GROUP_BATCH_SIZE
+            budget = max(token_budget - estimate_tokens(context[:PROMPT_CONTEXT_MAX_CHARS]), token_budget // 4)
+            for chunk in make_batches([items[i].body for i in idxs], size, budget):
+                units.append((context, [idxs[j] for j in chunk]))
+        else:
+            loose.extend(idxs)
+
+    if batch_size and batch_size > 1:
+        for chunk in make_batches([items[i].text for i in loose], batch_size, token_budget):
+            units.append((None, [loose[j] for j in chunk]))
+    else:
+        units.extend((None, [i]) for i in loose)
+    return units
+
+
+def prioritize_units(items, units):
+    """
+    Reordena las peticiones de plan_requests para que lo clasificado primero sea una
+    muestra representativa y no la primera plataforma del DataFrame:
+      - ronda por profundidad: el primer trozo de cada post antes que el segundo, etc.
+        (los hilos largos de comentarios quedan para el final);
+      - dentro de cada ronda, los textos de post (sin comentario) antes que los comentarios;
+      - y los posts se intercalan en round-robin entre plataformas (post 1 de cada
+        plataforma, luego post 2 de cada plataforma...).
+    Devuelve la lista de unidades reordenada (orden estable para empates).
+    """
+    platform_rank = {}
+    post_rank = {}
+    posts_per_platform = {}
+    depth_of = {}
+    keys = []
+    for u, (context, idxs) in enumerate(units):
+        first = items[idxs[0]]
+        platform, post = first.group if first.group else ("", "")
+        platform_rank.setdefault(platform, len(platform_rank))
+        if (platform, post) not in post_rank:
+            post_rank[(platform, post)] = posts_per_platform.get(platform, 0)
+            posts_per_platform[platform] = post_rank[(platform, post)] + 1
+        depth = depth_of.get((first.group, context), 0)
+        depth_of[(first.group, context)] = depth + 1
+        tier = 0 if not first.context else 1
+        keys.append((depth, tier, post_rank[(platform, post)], platform_rank[platform], u))
+    return [units[k[-1]] for k in sorted(keys)]
@@ -0,0 +1,390 @@
+import queue
+import time
+from urllib.parse import urlparse
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Bloqueo de recursos a nivel de red: los scrapers solo leen texto
+SCRAPER_BLOCK_RESOURCES = getattr(_config, "SCRAPER_BLOCK_RESOURCES", True)
+# Tipos de recurso (request.resource_type de Playwright) que se abortan
+SCRAPER_BLOCKED_TYPES = set(getattr(_config, "SCRAPER_BLOCKED_TYPES", ["image", "media", "font"]))
+# Dominios propios de cada plataforma (y sus subdominios/CDN): el resto se trata como
+# terceros (anuncios, analítica, widgets) y se aborta salvo que sea la navegación principal.
+# "allow_types" vuelve a permitir tipos bloqueados en una plataforma concreta.
+SCRAPER_BLOCK_PROFILES = getattr(_config, "SCRAPER_BLOCK_PROFILES", {
+    "facebook": {"domains": ["facebook.com", "fbcdn.net", "facebook.net", "fbsbx.com"]},
+    "instagram": {"domains": ["instagram.com", "cdninstagram.com", "fbcdn.net", "facebook.com", "facebook.net"]},
+    "twitter": {"domains": ["x.com", "twitter.com", "twimg.com", "x.ai"]},
+    "linkedin": {"domains": ["linkedin.com", "licdn.com"]},
+})
+# Globs de URL de cada tipo bloqueado. Solo las peticiones que encajan pasan por Python:
+# con la API síncrona un handler de route solo corre durante una llamada a Playwright, así
+# que enrutar "**/*" dejaría cada página parada en los time.sleep de los scrapers
+SCRAPER_BLOCKED_URL_PATTERNS = getattr(_config, "SCRAPER_BLOCKED_URL_PATTERNS", {
+    "image": "**/*.{png,jpg,jpeg,gif,webp,avif,svg,ico,bmp}*",
+    "media": "**/*.{mp4,webm,m4a,mp3,m3u8,mpd}*",
+    "font": "**/*.{woff,woff2,ttf,otf,eot}*",
+})
+# Terceros que se abortan (anuncios, analítica) y sus subdominios. El resto de dominios
+# ajenos a la plataforma no se intercepta: solo se cuenta en el informe
+SCRAPER_THIRD_PARTY_HOSTS = getattr(_config, "SCRAPER_THIRD_PARTY_HOSTS", [
+    "doubleclick.net", "googletagmanager.com", "google-analytics.com", "googlesyndication.com",
+    "googleadservices.com", "ads-twitter.com", "adsrvr.org", "scorecardresearch.com",
+])
+# Tamaño medio (bytes) de lo que se deja de descargar, para estimar el ahorro: lo abortado
+# no llega a tener tamaño. Se puede calibrar con una ejecución con el bloqueo desactivado
+# (el informe incluye los bytes medios observados por tipo).
+SCRAPER_AVG_BYTES = getattr(_config, "SCRAPER_AVG_BYTES", {
+    "image": 45_000, "media": 400_000, "font": 35_000, "script": 30_000, "other": 5_000,
+})
+# Segundos que append() espera a que haya hueco en la cola del streaming: si el consumidor
+# LLM no saca filas en ese tiempo (caído o bloqueado) se deja de publicar; las filas siguen
+# en la lista y la pasada final las clasifica
+STREAM_PUT_TIMEOUT = getattr(_config, "STREAM_PUT_TIMEOUT", 30)
+# Máximo de pestañas trabajando a la vez en un mismo contexto de navegador (StepPool)
+SCRAPER_MAX_TABS_PER_CONTEXT = getattr(_config, "SCRAPER_MAX_TABS_PER_CONTEXT", 4)
+# Segundos mínimos entre el arranque de dos pestañas del mismo pool: el ritmo de peticiones
+# a la plataforma no sube con el número de pestañas
+SCRAPER_TAB_START_INTERVAL = getattr(_config, "SCRAPER_TAB_START_INTERVAL", 1.5)
+
+
+class StreamingResults(list):
+    """
+    Lista de resultados de un scraper que, además, publica cada fila añadida en una
+    cola (multiprocessing) para que la fase LLM la clasifique mientras se sigue scrapeando.
+    Si la cola está llena, append() espera (contrapresión sobre el scraper) como mucho
+    STREAM_PUT_TIMEOUT segundos; pasado ese tiempo, o si la cola falla (Manager cerrado),
+    la fila no se publica y el streaming se desactiva para el resto del scraping.
+    """
+
+    def __init__(self, sink=None):
+        super().__init__()
+        self.sink = sink
+
+    def append(self, row):
+        super().append(row)
+        if self.sink is not None:
+            try:
+                self.sink.put(dict(row), timeout=STREAM_PUT_TIMEOUT)
+            except queue.Full:
+                print(f"[Stream] La cola sigue llena tras {STREAM_PUT_TIMEOUT}s (consumidor LLM detenido); se deja de publicar.")
+                self.sink = None
+            except Exception as e:
+                # Sin cola no hay solapamiento, pero la fila sigue en la lista
+                print(f"[Stream] No se pudo publicar la fila: {e}")
+                self.sink = None
+
+
+# Extracción en bloque: un único evaluate_all devuelve los datos de todos los nodos de una
+# lista (comentarios, respuestas) en vez de una llamada CDP por nodo (inner_text,
+# get_attribute, xpath hacia el padre...). Los filtros de líneas se aplican después en Python.
+NODE_TEXT_JS = """
+els => els.map(el => ({text: el.innerText || "", label: el.getAttribute("aria-label") || ""}))
+"""
+
+# innerText del ancestro `levels` niveles por encima de cada nodo (equivale a xpath=./../..)
+ANCESTOR_TEXT_JS = """
+(els, levels) => els.map(el => {
+    let node = el;
+    for (let k = 0; k < levels && node.parentElement; k++) node = node.parentElement;
+    return node.innerText || "";
+})
+"""
+
+
+def evaluate_all(locator, script, arg=None):
+    """Ejecuta `script` sobre todos los nodos del locator en una sola llamada; [] si falla."""
+    try:
+        return locator.evaluate_all(script, arg)
+    except Exception as e:
+        print(f"[Scraper] Fallo en la extracción en bloque: {e}")
+        return []
+
+
+def split_lines(text):
+    """Líneas no vacías (con strip) de un innerText."""
+    return [l.strip() for l in (text or "").split("\n") if l.strip()]
+
+
+class ResourceBlocker:
+    """
+    Capa de intercepción compartida por los cuatro scrapers (rutas sobre todo el contexto,
+    así cubre también las pestañas que se abren después): aborta imágenes, vídeo, fuentes
+    y peticiones a anuncios/analítica. Solo se enrutan los globs de SCRAPER_BLOCKED_URL_PATTERNS
+    y SCRAPER_THIRD_PARTY_HOSTS; el resto de peticiones no pasa por Python.
+
+    También lleva la cuenta de lo que pasa por la red: peticiones bloqueadas por motivo,
+    peticiones a terceros no bloqueadas, bytes descargados (Content-Length) por tipo, bytes
+    ahorrados estimados y tiempo de carga (navegación -> evento load) de cada página. Con
+    enabled=False solo mide, lo que sirve de referencia para comparar.
+    """
+
+    def __init__(self, platform, enabled=None, profile=None):
+        self.platform = platform
+        self.enabled = SCRAPER_BLOCK_RESOURCES if enabled is None else enabled
+        profile = profile if profile is not None else SCRAPER_BLOCK_PROFILES.get(platform, {})
+        self.domains = tuple(d.lower() for d in profile.get("domains", []))
+        self.blocked_types = SCRAPER_BLOCKED_TYPES - set(profile.get("allow_types", []))
+        self.blocked = {} # motivo/tipo -> peticiones abortadas
+        self.requests = 0
+        self.third_party_seen = 0
+        self.bytes_by_type = {} # tipo -> [bytes, respuestas]
+        self.load_times = []
+        self._nav_started = {}
+
+    def route_patterns(self):
+        """Globs que se interceptan: los de cada tipo bloqueado y los de los terceros conocidos."""
+        patterns = [SCRAPER_BLOCKED_URL_PATTERNS[t] for t in sorted(self.blocked_types) if t in SCRAPER_BLOCKED_URL_PATTERNS]
+        for host in SCRAPER_THIRD_PARTY_HOSTS:
+            if not self.is_own(f"https://{host}/"):
+                patterns += [f"**://{host}/**", f"**://*.{host}/**"]
+        return patterns
+
+    def attach(self, context):
+        """Instala la intercepción y los contadores en un BrowserContext."""
+        if self.enabled:
+            for pattern in self.route_patterns():
+                context.route(pattern, self._handle)
+        context.on("request", self._on_request)
+        context.on("response", self._on_response)
+        for page in context.pages:
+            self._watch(page)
+        context.on("page", self._watch)
+        return self
+
+    def is_own(self, url):
+        host = (urlparse(url).hostname or "").lower()
+        return not self.domains or not host or any(host == d or host.endswith("." + d) for d in self.domains)
+
+    def should_block(self, request):
+        """Motivo del bloqueo ('image', 'font', 'third_party'...) o None si se deja pasar."""
+        rtype = request.resource_type
+        if rtype in self.blocked_types:
+            return rtype
+        if rtype != "document" and not self.is_own(request.url):
+            return "third_party"
+        return None
+
+    def _handle(self, route):
+        # Solo llegan las peticiones de route_patterns(); la decisión final la toma should_block
+        # con el tipo real de la petición (un glob de extensión también puede casar con un xhr)
+        reason = self.should_block(route.request)
+        try:
+            if reason:
+                self.blocked[reason] = self.blocked.get(reason, 0) + 1
+                if reason == "third_party":
+                    rtype = route.request.resource_type
+                    self.blocked[f"third_party:{rtype}"] = self.blocked.get(f"third_party:{rtype}", 0) + 1
+                route.abort()
+            else:
+                route.continue_()
+        except Exception:
+            pass # La página se cerró mientras tanto
+
+    def _watch(self, page):
+        page.on("load", self._on_load)
+
+    def _on_request(self, request):
+        self.requests += 1
+        try:
+            if request.resource_type != "document" and not self.is_own(request.url):
+                self.third_party_seen += 1
+            if request.is_navigation_request() and request.frame.parent_frame is None:
+                self._nav_started[id(request.frame)] = time.monotonic()
+        except Exception:
+            pass # Peticiones de service workers: no tienen frame
+
+    def _on_load(self, page):
+        started = self._nav_started.pop(id(page.main_frame), None)
+        if started is not None:
+            self.load_times.append(time.monotonic() - started)
+
+    def _on_response(self, response):
+        try:
+            size = int(response.headers.get("content-length", 0))
+        except (TypeError, ValueError):
+            size = 0
+        entry = self.bytes_by_type.setdefault(response.request.resource_type, [0, 0])
+        entry[0] += size
+        entry[1] += 1
+
+    def bytes_saved_estimate(self):
+        total = 0
+        for reason, n in self.blocked.items():
+            if reason == "third_party":
+                continue # Se cuenta por tipo en "third_party:<tipo>"
+            rtype = reason.split(":", 1)[-1]
+            total += n * SCRAPER_AVG_BYTES.get(rtype, SCRAPER_AVG_BYTES.get("other", 0))
+        return total
+
+    def report(self):
+        """Resumen de red del scraper (para job_status.scraper_metrics.<plataforma>)."""
+        downloaded = sum(b for b, _ in self.bytes_by_type.values())
+        blocked = sum(n for k, n in self.blocked.items() if ":" not in k)
+        return {
+            "blocking": self.enabled,
+            "requests_allowed": self.requests - blocked,
+            "requests_blocked": blocked,
+            # Terceros vistos (bloqueados o no): si crecen, conviene ampliar SCRAPER_THIRD_PARTY_HOSTS
+            "third_party_requests": self.third_party_seen,
+            "blocked_by_reason": dict(self.blocked),
+            "bytes_downloaded": downloaded,
+            "bytes_saved_estimate": self.bytes_saved_estimate(),
+            "avg_bytes_by_type": {t: round(b / n) for t, (b, n) in self.bytes_by_type.items() if n},
+            "pages_loaded": len(self.load_times),
+            "avg_page_load_s": round(sum(self.load_times) / len(self.load_times), 3) if self.load_times else None,
+            "total_page_load_s": round(sum(self.load_times), 2),
+        }
+
+    def publish(self, db=None, topic=None, label=None):
+        """Imprime el resumen y lo guarda en MongoDB si hay conexión."""
+        rep = self.report()
+        print(f"[{label or self.platform}] Red: {rep['requests_blocked']} peticiones bloqueadas {rep['blocked_by_reason']} | "
+              f"{rep['bytes_downloaded'] / 1e6:.1f} MB descargados, ~{rep['bytes_saved_estimate'] / 1e6:.1f} MB ahorrados | "
+              f"Carga media de página: {rep['avg_page_load_s']}s ({rep['pages_loaded']} páginas)")
+        if db is not None and topic and getattr(db, "is_connected", False):
+            db.update_scraper_metrics(topic, self.platform, rep)
+        return rep
+
+
+def idle(seconds, page=None):
+    """
+    Espera `seconds` dejando que Playwright siga trabajando: page.wait_for_timeout si hay
+    página (los handlers de rutas y eventos solo corren dentro de una llamada a Playwright),
+    time.sleep si no.
+    """
+    if seconds <= 0:
+        return
+    if page is not None:
+        try:
+            page.wait_for_timeout(seconds * 1000)
+            return
+        except Exception:
+            pass # Página cerrada: se espera igualmente
+    time.sleep(seconds)
+
+
+def run_steps(steps, page=None):
+    """
+    Ejecuta una tarea por pasos (ver StepPool) ella sola: hace cada espera (con idle, sobre
+    `page` si se pasa) y devuelve su resultado.
+    """
+    try:
+        while True:
+            idle(max(0.0, float(next(steps) or 0)), page)
+    except StopIteration as done:
+        return done.value
+
+
+class StepPool:
+    """
+    Varias pestañas de scraping a la vez sobre la API síncrona de Playwright, que no se
+    puede usar desde varios hilos. Cada tarea es un generador que hace acciones cortas
+    (goto sin esperar la carga, teclas, clicks, lecturas) y cede con `yield` los segundos
+    que quiere esperar antes del siguiente paso. El pool avanza siempre la tarea que antes
+    vence, así la espera de una pestaña la aprovechan las demás mientras el navegador
+    carga todas en paralelo.
+
+    Como mucho `size` tareas en curso (y nunca más de SCRAPER_MAX_TABS_PER_CONTEXT), que
+    arrancan separadas al menos SCRAPER_TAB_START_INTERVAL segundos. Los resultados (el
+    return de cada generador, None si falló) se entregan en el mismo orden en que se
+    enviaron las tareas.
+
+    page: página del mismo navegador sobre la que se espera (page.wait_for_timeout). Con
+    la API síncrona Playwright solo despacha eventos y rutas durante una llamada suya: con
+    time.sleep las pestañas no avanzarían mientras el pool espera. None = time.sleep.
+    """
+
+    def __init__(self, size, label="Scraper", page=None):
+        self.size = max(1, min(int(size), SCRAPER_MAX_TABS_PER_CONTEXT))
+        self.label = label
+        self.page = page
+        self._running = [] # [vence_en, secuencia, generador]
+        self._finished = {} # secuencia -> resultado
+        self._submitted = 0
+        self._delivered = 0
+        self._next_start = 0.0
+
+    @property
+    def pending(self):
+        """Tareas enviadas cuyo resultado aún no se ha entregado."""
+        return self._submitted - self._delivered
+
+    @property
+    def done(self):
+        """Tareas terminadas (entregadas o no), para informar del progreso."""
+        return self._delivered + len(self._finished)
+
+    def full(self):
+        return len(self._running) >= self.size
+
+    def submit(self, steps):
+        start = max(time.monotonic(), self._next_start)
+        self._next_start = start + SCRAPER_TAB_START_INTERVAL
+        self._running.append([start, self._submitted, steps])
+        self._submitted += 1
+
+    def _idle(self, seconds):
+        idle(seconds, self.page)
+
+    def _step(self):
+        """Avanza un paso la tarea que antes vence (esperando hasta entonces si hace falta)."""
+        task = min(self._running, key=lambda t: t[0])
+        wait = task[0] - time.monotonic()
+        if wait > 0:
+            self._idle(wait)
+        try:
+            task[0] = time.monotonic() + max(0.0, float(next(task[2]) or 0))
+        except StopIteration as done:
+            self._running.remove(task)
+            self._finished[task[1]] = done.value
+        except Exception as e:
+            print(f"[{self.label}] Error en una pestaña: {e}")
+            self._running.remove(task)
+            self._finished[task[1]] = None
+
+    def _ready(self):
+        out = []
+        while self._delivered in self._finished:
+            out.append(self._finished.pop(self._delivered))
+            self._delivered += 1
+        return out
+
+    def wait_for_slot(self):
+        """Avanza las tareas hasta que haya un hueco libre; devuelve los resultados listos (en orden)."""
+        while self.full():
+            self._step()
+        return self._ready()
+
+    def wait(self, seconds):
+        """Como una espera de `seconds`, pero avanzando las tareas mientras tanto."""
+        deadline = time.monotonic() + seconds
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if not self._running or min(t[0] for t in self._running) > deadline:
+                self._idle(deadline - now)
+                break
+            self._step()
+        return self._ready()
+
+    def drain(self):
+        """Termina todas las tareas en curso; devuelve los resultados pendientes (en orden)."""
+        while self._running:
+            self._step()
+        return self._ready()
+
+    def close(self):
+        """Aborta las tareas en curso (p.ej. al cancelar): sus `finally` cierran las pestañas."""
+        for task in self._running:
+            try:
+                task[2].close()
+            except Exception as e:
+                print(f"[{self.label}] Error cerrando una pestaña: {e}")
+            self._finished[task[1]] = None
+        self._running = []
+        return self._ready()
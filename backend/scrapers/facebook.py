@@ -5,8 +5,56 @@ import random
 
 import re
 
-def scrape_facebook(topic, email, password, target_count=10):
-    results = []
+from scrapers.common import NODE_TEXT_JS, ResourceBlocker, StreamingResults, evaluate_all, split_lines
+
+COMMENT_UI_LINES = {"Responder", "Me gusta", "Ocultar", "Editar"}
+
+
+def parse_comment(raw_text, label=""):
+    """
+    Autor y contenido de un comentario a partir de su innerText y su aria-label
+    ("Comentario de ..."), quitando botones, fechas relativas y contadores de likes.
+    """
+    lines = split_lines(raw_text)
+    
+    # Intento por aria-label (Suele ser el más limpio "Comentario de ...")
+    c_author = label.replace("Comentario de", "").strip() if label else "Anon"
+    
+    # Si no hay aria-label, usaremos el texto
+    if not c_author or c_author == "Anon":
+         if len(lines) > 0: 
+             c_author = lines[0]
+    
+    # LIMPIEZA DE AUTOR (Quitar fechas relativas que a veces se pegan)
+    # Ej: "Juan Perez Hace 2 horas" -> "Juan Perez"
+    c_author = re.split(r'\s+hace\s+', c_author, flags=re.IGNORECASE)[0].strip()
+    
+    # Contenido: Todo lo que no sea el autor, ni metadata
+    clean_lines = []
+    for l in lines:
+        # Filtros estrictos
+        if (l != c_author 
+            and not l.startswith(c_author) # A veces el texto repite el autor
+            and l not in COMMENT_UI_LINES
+            and not re.match(r'^\d+\s?[hmys]$', l) # "4 h", "1 sem"
+            and not re.match(r'^Hace\s+', l) 
+            ):
+            clean_lines.append(l)
+    
+    c_content = " ".join(clean_lines)
+    
+    # Limpieza final de contenido (a veces el autor sigue pegado al principio)
+    if c_content.startswith(c_author):
+        c_content = c_content[len(c_author):].strip()
+
+    # QUITAR NUMEROS SUELTOS AL FINAL (Contadores de Likes)
+    # Ej: "texto del comentario 15" -> "texto del comentario"
+    c_content = re.sub(r'\s+\d+$', '', c_content).strip()
+    return c_author, c_content
+
+
+def scrape_facebook(topic, email, password, target_count=10, sink=None):
+    results = StreamingResults(sink)
     print(f"[Facebook] Iniciando hilo para: {topic} | Meta: {target_count}")
     
     # Ruta para guardar el perfil de usuario (cookies, cache, etc)
@@ -39,6 +87,9 @@ def scrape_facebook(topic, email, password, target_count=10):
             print("[Facebook] Posiblemente el perfil está bloqueado. Intenta cerrar todos los procesos de Chrome.")
             return []
         
+        # Solo leemos texto: fuera imágenes, vídeo, fuentes y terceros
+        blocker = ResourceBlocker("facebook").attach(browser)
+        
         # En contexto persistente, browser actúa como context y tiene pages
         if len(browser.pages) > 0:
             page = browser.pages[0]
@@ -253,13 +304,13 @@ def scrape_facebook(topic, email, password, target_count=10):
                             # Texto: Estrategia Mejorada
                             post_content = "Sin texto / Solo media"
                             # Buscamos bloques de texto significativos
-                            text_divs = post_body.locator('div[dir="auto"]').all()
+                            text_divs = evaluate_all(post_body.locator('div[dir="auto"]'), NODE_TEXT_JS)
                             
                             content_parts = []
                             seen_texts = set()
                             
                             for div in text_divs:
-                                txt = div.inner_text().strip()
+                                txt = div["text"].strip()
                                 
                                 # Filtros anti-ruido
                                 if (len(txt) > 3 
@@ -390,12 +441,12 @@ def scrape_facebook(topic, email, password, target_count=10):
                             except:
                                 break
 
-                        # Selectores comentarios
-                        comments_loc = container.locator('div[aria-label^="Comentario de"]')
-                        if comments_loc.count() == 0:
-                             comments_loc = container.locator('div[role="article"]') # Genérico
+                        # Selectores comentarios: texto y aria-label de todos en una sola llamada
+                        comment_nodes = evaluate_all(container.locator('div[aria-label^="Comentario de"]'), NODE_TEXT_JS)
+                        if not comment_nodes:
+                             comment_nodes = evaluate_all(container.locator('div[role="article"]'), NODE_TEXT_JS) # Genérico
                         
-                        c_qty = comments_loc.count()
+                        c_qty = len(comment_nodes)
                         print(f"   > Post {posts_scraped+1}: {c_qty} comentarios encontrados.")
                         
                         post_comments_added = 0
@@ -410,63 +461,18 @@ def scrape_facebook(topic, email, password, target_count=10):
                                 "comment_content": ""
                             })
                         
-                        for j in range(c_qty):
-                            try:
-                                el = comments_loc.nth(j)
-                                raw_text = el.inner_text()
-                                lines = [l.strip() for l in raw_text.split('\n') if len(l.strip()) > 0]
-                                
-                                # Extraer autor/contenido
-                                c_author = "Anon"
-                                c_content = ""
-                                
-                                # Intento por aria-label (Suele ser el más limpio "Comentario de ...")
-                                lbl = el.get_attribute("aria-label")
-                                if lbl: 
-                                    c_author = lbl.replace("Comentario de", "").strip()
-                                
-                                # Si no hay aria-label, usaremos el texto
-                                if not c_author or c_author == "Anon":
-                                     if len(lines) > 0: 
-                                         c_author = lines[0]
-                                
-                                # LIMPIEZA DE AUTOR (Quitar fechas relativas que a veces se pegan)
-                                # Ej: "Juan Perez Hace 2 horas" -> "Juan Perez"
-                                c_author = re.split(r'\s+hace\s+', c_author, flags=re.IGNORECASE)[0].strip()
-                                
-                                # Contenido: Todo lo que no sea el autor, ni metadata
-                                clean_lines = []
-                                for l in lines:
-                                    # Filtros estrictos
-                                    if (l != c_author 
-                                        and not l.startswith(c_author) # A veces el texto repite el autor
-                                        and l not in ["Responder", "Me gusta", "Ocultar", "Editar"]
-                                        and not re.match(r'^\d+\s?[hmys]$', l) # "4 h", "1 sem"
-                                        and not re.match(r'^Hace\s+', l) 
-                                        ):
-                                        clean_lines.append(l)
-                                
-                                c_content = " ".join(clean_lines)
-                                
-                                # Limpieza final de contenido (a veces el autor sigue pegado al principio)
-                                if c_content.startswith(c_author):
-                                    c_content = c_content[len(c_author):].strip()
-
-                                # QUITAR NUMEROS SUELTOS AL FINAL (Contadores de Likes)
-                                # Ej: "texto del comentario 15" -> "texto del comentario"
-                                c_content = re.sub(r'\s+\d+$', '', c_content).strip()
-
-                                if len(c_content) > 0:
-                                    results.append({
-                                        "platform": "Facebook",
-                                        "post_index": posts_scraped + 1,
-                                        "post_author": post_author,
-                                        "post_content": post_content, # Ya está limpio
-                                        "comment_author": c_author,
-                                        "comment_content": c_content
-                                    })
-                                    post_comments_added += 1
-                            except: pass
+                        for node in comment_nodes:
+                            c_author, c_content = parse_comment(node["text"], node["label"])
+                            if len(c_content) > 0:
+                                results.append({
+                                    "platform": "Facebook",
+                                    "post_index": posts_scraped + 1,
+                                    "post_author": post_author,
+                                    "post_content": post_content, # Ya está limpio
+                                    "comment_author": c_author,
+                                    "comment_content": c_content
+                                })
+                                post_comments_added += 1
                         
                         # Cerrar modal/post
                         page.keyboard.press("Escape")
@@ -498,6 +504,7 @@ def scrape_facebook(topic, email, password, target_count=10):
                  db.update_stage_progress(topic, "facebook", posts_scraped, "completed")
             
             print(f"[Facebook] Finalizado. Total comentarios: {len(results)}")
+            blocker.publish(db, topic, "Facebook")
             
         except Exception as e:
             print(f"[Facebook] Error: {e}")
@@ -5,14 +5,246 @@ import time
 import random
 from urllib.parse import quote_plus
 
+from scrapers.common import ANCESTOR_TEXT_JS, ResourceBlocker, StepPool, StreamingResults, evaluate_all, split_lines
+from scrapers.payloads import IG_API_PATTERN, IG_COMMENT_DOC_IDS, IG_COMMENT_QUERY_PATTERN, SCRAPER_CAPTURE_API, ResponseCapture
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Posts abiertos a la vez en pestañas del perfil con sesión (tope: SCRAPER_MAX_TABS_PER_CONTEXT)
+IG_DETAIL_TABS = getattr(_config, "IG_DETAIL_TABS", 3)
+
 def human_delay(min_s=1.2, max_s=2.8):
     time.sleep(random.uniform(min_s, max_s))
 
-def scrape_instagram(topic: str, username: str, password: str, target_count: int = 5):
+def parse_comment(block_text):
+    """
+    (autor, contenido) de un comentario a partir del texto de su bloque, o None si está vacío.
+    Normalmente el bloque es:
+      [FOTO]
+      AUTOR (con verificado opcional)
+      TEXTO
+      FECHA - RESPONDER - TRADUCIR
+    """
+    lines = split_lines(block_text)
+    if not lines:
+        return None
+    
+    c_author = lines[0] # Primera línea suele ser autor
+    
+    # Filtrar líneas basura
+    clean_lines = []
+    for l in lines[1:]:
+        if (l != c_author 
+            and "Responder" not in l 
+            and "Reply" not in l
+            and "Me gusta" not in l
+            and not re.match(r'^\d+[smhdw]$', l) # Fechas cortas
+            and "Ver traducción" not in l
+            ):
+            clean_lines.append(l)
+    
+    c_content = " ".join(clean_lines)
+
+    # Limpieza EXTRA: Quitar fechas del principio del contenido (Ej: "3 sem Hola")
+    c_content = re.sub(r'^\d+\s+(sem|sem\.|d|h|m|s|w)\s+', '', c_content).strip()
+    return c_author, c_content
+
+def post_steps(ctx, p_url: str, index: int):
+    """
+    Lectura de un post en su propia pestaña (mismo contexto y misma sesión), como
+    generador: cada `yield` cede los segundos que la pestaña quiere esperar y el return
+    son las filas del post. StepPool intercala así varios posts a la vez.
+    """
+    page = ctx.new_page()
+    page.set_default_timeout(60000)
+    # Modo captura: comentarios desde las respuestas JSON de la API; el DOM queda como respaldo
+    capture = ResponseCapture(IG_API_PATTERN, IG_COMMENT_QUERY_PATTERN, IG_COMMENT_DOC_IDS).attach(page) if SCRAPER_CAPTURE_API else None
+    rows = []
+    try:
+        # Sin esperar a domcontentloaded: mientras carga, el pool avanza las otras pestañas
+        page.goto(p_url, wait_until="commit")
+        deadline = time.monotonic() + 30
+        while page.locator('meta[property="og:description"]').count() == 0 and time.monotonic() < deadline:
+            yield 0.25
+        yield 3
+
+        # --- EXTRAER INFO DEL POST (USANDO METADATOS) ---
+        post_author = "Desconocido"
+        post_content = "Sin descripción"
+
+        try:
+            # Método MetaTags (Muy robusto según tu ejemplo)
+            # Content format: "15K likes, 67 comments - AUTOR el DATE: "DESCRIPCION""
+            og_desc = page.locator('meta[property="og:description"]').get_attribute("content")
+            if og_desc:
+                # 1. Extraer Autor (entre "- " y " el ")
+                if " - " in og_desc and " el " in og_desc:
+                    parts = og_desc.split(" - ")[1].split(" el ")
+                    post_author = parts[0].strip()
+
+                # 2. Extraer Contenido (lo que está entre comillas después de los dos puntos)
+                # A veces no hay comillas si es corto, o formato varía.
+                if ': "' in og_desc:
+                    post_content = og_desc.split(': "', 1)[1].rstrip('".')
+                elif ": " in og_desc:
+                    post_content = og_desc.split(": ", 1)[1]
+
+                print(f"   > [{index}] [Meta] Autor: {post_author}")
+        except Exception as e_meta:
+            print(f"   > [{index}] Error meta: {e_meta}")
+
+        # Fallback visual para Autor si falló meta
+        if post_author == "Desconocido":
+            try:
+                # Header h2 o primer link
+                header_text = page.locator("header h2").first.inner_text()
+                if header_text: post_author = header_text
+            except: pass
+
+        print(f"   > [{index}] Post Autor: {post_author} | Desc: {post_content[:30]}...")
+
+        # --- CARGAR COMENTARIOS ---
+        print(f"   > [{index}] Expandiendo comentarios (Max 50 clicks/scroll)...")
+        consecutive_not_found = 0
+
+        # Pre-chequeo del límite para no expandir de más
+        # (Leemos la variable que se define más abajo, o usamos un valor default alto si no existe aun)
+        current_limit = 50
+
+        for _ in range(50):
+            try:
+                # Chequeo rápido de cantidad actual
+                current_candidates = page.locator('div[role="button"]:has-text("Responder"), div[role="button"]:has-text("Reply"), span:has-text("Responder")').count()
+                if current_candidates >= current_limit + 10:
+                    print(f"   > [{index}] Límite de comentarios alcanzado visualmente. Deteniendo carga.")
+                    break
+
+                found_button = False
+                # 1. Botón circular (+) típico
+                btn_svg = page.locator('svg[aria-label="Cargar más comentarios"]').locator("..")
+                if btn_svg.count() > 0 and btn_svg.first.is_visible():
+                    btn_svg.first.click()
+                    found_button = True
+
+                # 2. Botón de texto "Ver más comentarios" (alternativo)
+                if not found_button:
+                    btn_txt = page.locator('button:has-text("Ver más comentarios")')
+                    if btn_txt.count() > 0 and btn_txt.first.is_visible():
+                        btn_txt.first.click()
+                        found_button = True
+
+                if not found_button:
+                    # Scroll y conteo de fallos
+                    page.mouse.wheel(0, 600)
+                    consecutive_not_found += 1
+            except Exception: break
+
+            # Las esperas se ceden al pool (fuera del try: nada debe atrapar el cierre del generador)
+            if found_button:
+                consecutive_not_found = 0
+                yield 0.8 # Esperar carga (optimizado)
+            elif consecutive_not_found >= 3:
+                # Si fallamos 3 veces seguidas (scroll y no botón), asumimos fln
+                break
+            else:
+                yield 0.4
+
+        # --- EXPANDIR RESPUESTAS ANIDADAS (NUEVO) ---
+        # Basado en tu HTML: "Ver las 1 respuestas"
+        print(f"   > [{index}] Expandiendo sub-respuestas (puede tardar)...")
+        try:
+            # Buscar botones que digan "Ver las..." o "View replies"
+            # Usamos un selector generico de texto
+            nested_btns = page.locator('div[role="button"] span:has-text("Ver las"), div[role="button"] span:has-text("View replies")').all()
+        except Exception: nested_btns = []
+
+        # Limitamos a clicar unos 10-20 para no eternizar
+        clicks = 0
+        for btn in nested_btns:
+            if clicks > 50: break
+            try:
+                if not btn.is_visible(): continue
+                btn.click(force=True)
+                clicks += 1
+            except Exception: continue
+            yield 0.2
+        if clicks > 0:
+            print(f"   > [{index}] Se expandieron {clicks} hilos de respuestas.")
+            yield 2 # Esperar que rendericen
+
+        # --- EXTRAER COMENTARIOS (NUEVA ESTRATEGIA: POR BOTÓN "RESPONDER") ---
+        comments_found = 0
+        seen_comments = set()
+
+        try:
+            # Modo captura: los comentarios vienen de los payloads de la API
+            candidates = []
+            if capture is not None:
+                capture.collect()
+                candidates = [(c["author"], c["content"]) for c in capture.ig_comments()]
+                if candidates:
+                    print(f"   > [{index}] Comentarios leídos de la API: {len(candidates)}")
+
+            if not candidates:
+                # Cada comentario tiene un botón "Responder" (o "Reply"): el texto del
+                # bloque del comentario (5 niveles por encima) de todos ellos en una sola llamada
+                blocks = evaluate_all(page.locator('div[role="button"]:has-text("Responder"), div[role="button"]:has-text("Reply")'), ANCESTOR_TEXT_JS, 5)
+
+                # Si no encuentra por role=button, busca por texto span
+                if not blocks:
+                     blocks = evaluate_all(page.locator('span:has-text("Responder"), span:has-text("Reply")'), ANCESTOR_TEXT_JS, 5)
+
+                print(f"   > [{index}] Candidatos (botones responder): {len(blocks)}")
+                candidates = [parsed for parsed in map(parse_comment, blocks) if parsed]
+
+            limit_comments_per_post = 100
+            # Limpieza final de Post Content (por seguridad)
+            clean_post = post_content.replace("\n", " | ").replace("\r", "").strip()
+
+            for c_author, c_content in candidates:
+                if comments_found >= limit_comments_per_post: break
+
+                # Validar
+                if len(c_content) > 1 and c_content not in seen_comments:
+                    # Evitar que sea la descripción del post repetida
+                    if c_author == post_author and (post_content in c_content or c_content in post_content):
+                        continue
+
+                    rows.append({
+                        "platform": "Instagram",
+                        "post_index": index,
+                        "post_author": post_author,
+                        "post_content": clean_post,
+                        "comment_author": c_author,
+                        "comment_content": c_content
+                    })
+                    seen_comments.add(c_content)
+                    comments_found += 1
+
+        except Exception as e_comm:
+            print(f"   > [{index}] Error extrayendo comentarios: {e_comm}")
+
+        print(f"   > [{index}] Comentarios extraídos: {comments_found}")
+
+    except Exception as e:
+        print(f"[Error] Fallo procesando {p_url}: {e}")
+    finally:
+        try:
+            page.close()
+        except Exception: pass
+    return rows
+
+
+
+def scrape_instagram(topic: str, username: str, password: str, target_count: int = 5, sink=None):
     """
     Scraper robusto de Instagram por Hashtag.
     - topic: Hashtag (sin #)
     - target_count: Cantidad de POSTS a analizar (no comentarios totales)
+    - sink: cola opcional donde se publica cada fila en cuanto se extrae
     """
     user_data_dir = os.path.join(os.getcwd(), "profiles", "auth_profile_instagram")
     os.makedirs(user_data_dir, exist_ok=True)
@@ -20,7 +252,7 @@ def scrape_instagram(topic: str, username: str, password: str, target_count: int
     hashtag = topic.strip().lstrip("#").replace(" ", "").lower()
     start_url = f"https://www.instagram.com/explore/tags/{quote_plus(hashtag)}/"
     
-    results = []
+    results = StreamingResults(sink)
     
     print(f"[Instagram] Iniciando scraper para #{hashtag} | Meta: {target_count} posts")
     
@@ -48,6 +280,8 @@ def scrape_instagram(topic: str, username: str, password: str, target_count: int
             viewport=None,
         )
 
+        # Solo leemos texto: fuera imágenes, vídeo, fuentes y terceros
+        blocker = ResourceBlocker("instagram").attach(ctx)
         page = ctx.pages[0] if ctx.pages else ctx.new_page()
         page.set_default_timeout(60000)
 
@@ -55,12 +289,12 @@ def scrape_instagram(topic: str, username: str, password: str, target_count: int
             # 1. Navegar al Hashtag
             print(f"[Instagram] Navegando a: {start_url}")
             page.goto(start_url, wait_until="domcontentloaded")
-            time.sleep(3)
+            page.wait_for_timeout(3000)
 
             # Check Login
             if "/accounts/login" in page.url:
                 print("[Instagram] Redirigido a Login. Intentando esperar login manual si el usuario está mirando...")
-                time.sleep(5)
+                page.wait_for_timeout(5000)
                 if "/accounts/login" in page.url:
                     print("[Error] No hay sesión iniciada. Ejecuta 'python login_manual.py --site instagram' primero.")
                     ctx.close()
@@ -89,7 +323,7 @@ def scrape_instagram(topic: str, username: str, password: str, target_count: int
                     break
                 
                 page.mouse.wheel(0, 4000)
-                time.sleep(2)
+                page.wait_for_timeout(2000)
                 scrolls += 1
             
             target_urls = list(post_urls)[:target_count]
@@ -101,219 +335,52 @@ def scrape_instagram(topic: str, username: str, password: str, target_count: int
                 db = Database()
             except: db = None
 
-            # 3. Procesar cada Post
-            for i, p_url in enumerate(target_urls):
-                print(f"\n[Instagram] ({i+1}/{len(target_urls)}) Procesando: {p_url}")
-                
-                 # Report Progress
-                if db and db.is_connected:
-                    if db.check_cancellation(topic):
+            # 3. Procesar los posts en varias pestañas a la vez (round-robin de pasos, ver StepPool)
+            pool = StepPool(IG_DETAIL_TABS, label="Instagram", page=page)
+            reported = 0
+
+            def save_rows(finished):
+                # Filas de los posts terminados, en el orden de target_urls
+                for rows in finished:
+                    for row in rows or []:
+                        results.append(row)
+
+            def report_progress():
+                # Posts terminados en cualquier pestaña, aunque aún no se hayan entregado
+                nonlocal reported
+                if pool.done != reported and db and db.is_connected:
+                    reported = pool.done
+                    db.update_stage_progress(topic, "instagram", reported, "running")
+
+            try:
+                cancelled = False
+                for i, p_url in enumerate(target_urls):
+                     # Report Progress
+                    if db and db.is_connected:
+                        if db.check_cancellation(topic):
+                            print(f"[Instagram] Cancelación detectada para '{topic}'. Deteniendo...")
+                            cancelled = True
+                            break
+
+                    print(f"\n[Instagram] ({i+1}/{len(target_urls)}) Procesando: {p_url}")
+                    pool.submit(post_steps(ctx, p_url, i + 1))
+                    save_rows(pool.wait_for_slot())
+                    report_progress()
+
+                while pool.pending and not cancelled:
+                    save_rows(pool.wait(1.0))
+                    report_progress()
+                    if db and db.is_connected and db.check_cancellation(topic):
                         print(f"[Instagram] Cancelación detectada para '{topic}'. Deteniendo...")
-                        break
-                    db.update_stage_progress(topic, "instagram", i+1, "running")
-
-                try:
-                    page.goto(p_url, wait_until="domcontentloaded")
-                    time.sleep(3)
-                    
-                    # --- EXTRAER INFO DEL POST (USANDO METADATOS) ---
-                    post_author = "Desconocido"
-                    post_content = "Sin descripción"
-                    
-                    try:
-                        # Método MetaTags (Muy robusto según tu ejemplo)
-                        # Content format: "15K likes, 67 comments - AUTOR el DATE: "DESCRIPCION""
-                        og_desc = page.locator('meta[property="og:description"]').get_attribute("content")
-                        if og_desc:
-                            # 1. Extraer Autor (entre "- " y " el ")
-                            if " - " in og_desc and " el " in og_desc:
-                                parts = og_desc.split(" - ")[1].split(" el ")
-                                post_author = parts[0].strip()
-                            
-                            # 2. Extraer Contenido (lo que está entre comillas después de los dos puntos)
-                            # A veces no hay comillas si es corto, o formato varía.
-                            if ': "' in og_desc:
-                                post_content = og_desc.split(': "', 1)[1].rstrip('".')
-                            elif ": " in og_desc:
-                                post_content = og_desc.split(": ", 1)[1]
-                            
-                            print(f"   > [Meta] Autor: {post_author}")
-                    except Exception as e_meta:
-                        print(f"   > Error meta: {e_meta}")
-
-                    # Fallback visual para Autor si falló meta
-                    if post_author == "Desconocido":
-                        try:
-                            # Header h2 o primer link
-                            header_text = page.locator("header h2").first.inner_text()
-                            if header_text: post_author = header_text
-                        except: pass
-
-                    print(f"   > Post Autor: {post_author} | Desc: {post_content[:30]}...")
-
-                    # --- CARGAR COMENTARIOS ---
-                    print("   > Expandiendo comentarios (Max 50 clicks/scroll)...")
-                    consecutive_not_found = 0
-                    
-                    # Pre-chequeo del límite para no expandir de más
-                    # (Leemos la variable que se define más abajo, o usamos un valor default alto si no existe aun)
-                    current_limit = 50 
-
-                    for _ in range(50):
-                        try:
-                            # Chequeo rápido de cantidad actual
-                            current_candidates = page.locator('div[role="button"]:has-text("Responder"), div[role="button"]:has-text("Reply"), span:has-text("Responder")').count()
-                            if current_candidates >= current_limit + 10: 
-                                print("   > Límite de comentarios alcanzado visualmente. Deteniendo carga.")
-                                break
-
-                            found_button = False
-                            # 1. Botón circular (+) típico
-                            btn_svg = page.locator('svg[aria-label="Cargar más comentarios"]').locator("..")
-                            if btn_svg.count() > 0 and btn_svg.first.is_visible():
-                                btn_svg.first.click()
-                                found_button = True
-                            
-                            # 2. Botón de texto "Ver más comentarios" (alternativo)
-                            if not found_button:
-                                btn_txt = page.locator('button:has-text("Ver más comentarios")')
-                                if btn_txt.count() > 0 and btn_txt.first.is_visible():
-                                    btn_txt.first.click()
-                                    found_button = True
-
-                            if found_button:
-                                consecutive_not_found = 0
-                                time.sleep(0.8) # Esperar carga (optimizado)
-                            else:
-                                # Scroll y conteo de fallos
-                                page.mouse.wheel(0, 600)
-                                time.sleep(0.4)
-                                consecutive_not_found += 1
-                                
-                                if consecutive_not_found >= 3:
-                                    # Si fallamos 3 veces seguidas (scroll y no botón), asumimos fln
-                                    break
-                        except: break
-
-                    # --- EXPANDIR RESPUESTAS ANIDADAS (NUEVO) ---
-                    # Basado en tu HTML: "Ver las 1 respuestas"
-                    print("   > Expandiendo sub-respuestas (puede tardar)...")
-                    try:
-                        # Buscar botones que digan "Ver las..." o "View replies"
-                        # Usamos un selector generico de texto
-                        nested_btns = page.locator('div[role="button"] span:has-text("Ver las"), div[role="button"] span:has-text("View replies")').all()
-                        
-                        # Limitamos a clicar unos 10-20 para no eternizar
-                        clicks = 0
-                        for btn in nested_btns:
-                            if clicks > 50: break
-                            if btn.is_visible():
-                                try:
-                                    btn.click(force=True)
-                                    time.sleep(0.2)
-                                    clicks += 1
-                                except: pass
-                        if clicks > 0:
-                            print(f"   > Se expandieron {clicks} hilos de respuestas.")
-                            time.sleep(2) # Esperar que rendericen
-                    except: pass
-
-                    # --- EXTRAER COMENTARIOS (NUEVA ESTRATEGIA: POR BOTÓN "RESPONDER") ---
-                    comments_found = 0
-                    seen_comments = set()
-                    
-                    try:
-                        # Cada comentario tiene un botón "Responder" (o "Reply")
-                        # Buscamos todos esos botones
-                        reply_btns = page.locator('div[role="button"]:has-text("Responder"), div[role="button"]:has-text("Reply")').all()
-                        
-                        # Si no encuentra por role=button, busca por texto span
-                        if not reply_btns:
-                             reply_btns = page.locator('span:has-text("Responder"), span:has-text("Reply")').all()
-                        
-                        print(f"   > Candidatos (botones responder): {len(reply_btns)}")
-                        
-                        limit_comments_per_post = 100
-                        
-                        for btn in reply_btns:
-                            if comments_found >= limit_comments_per_post: break
-                            
-                            try:
-                                # El texto del comentario suele estar:
-                                # 1. En un contenedor padre del botón 'Responder'.
-                                # 2. Específicamente, en un <span> o <div> hermano o tío.
-                                
-                                # Subimos al contenedor del comentario (LI o DIV wrapper)
-                                # Normalmente el botón responder está en una fila de acciones. El texto está arriba.
-                                
-                                # Intentamos subir 3-4 niveles hasta abarcar todo el bloque del comentario
-                                comment_block = btn.locator('xpath=./../../../../..') 
-                                
-                                # Extraemos todo el texto del bloque
-                                block_text = comment_block.inner_text()
-                                lines = [l.strip() for l in block_text.split('\n') if l.strip()]
-                                
-                                if not lines: continue
-                                
-                                # Parseo Heurístico
-                                # Normalmente: 
-                                # [FOTO]
-                                # AUTOR (con verificado opcional)
-                                # TEXTO
-                                # FECHA - RESPONDER - TRADUCIR
-                                
-                                c_author = lines[0] # Primera línea suele ser autor
-                                c_content = ""
-                                
-                                # Filtrar líneas basura
-                                clean_lines = []
-                                for l in lines[1:]:
-                                    if (l != c_author 
-                                        and "Responder" not in l 
-                                        and "Reply" not in l
-                                        and "Me gusta" not in l
-                                        and not re.match(r'^\d+[smhdw]$', l) # Fechas cortas
-                                        and "Ver traducción" not in l
-                                        ):
-                                        clean_lines.append(l)
-                                
-                                c_content = " ".join(clean_lines)
-
-                                # Limpieza EXTRA: Quitar fechas del principio del contenido (Ej: "3 sem Hola")
-                                c_content = re.sub(r'^\d+\s+(sem|sem\.|d|h|m|s|w)\s+', '', c_content).strip()
-                                
-                                # Validar
-                                if len(c_content) > 1 and c_content not in seen_comments:
-                                    # Evitar que sea la descripción del post repetida
-                                    if c_author == post_author and (post_content in c_content or c_content in post_content):
-                                        continue
-                                    
-                                    # Limpieza final de Post Content (por seguridad)
-                                    clean_post = post_content.replace("\n", " | ").replace("\r", "").strip()
-
-                                    results.append({
-                                        "platform": "Instagram",
-                                        "post_index": i + 1,
-                                        "post_author": post_author,
-                                        "post_content": clean_post,
-                                        "comment_author": c_author,
-                                        "comment_content": c_content
-                                    })
-                                    seen_comments.add(c_content)
-                                    comments_found += 1
-                                    
-                            except: pass
-                            
-                    except Exception as e_comm:
-                        print(f"   > Error extrayendo comentarios: {e_comm}")
-
-                    print(f"   > Comentarios extraídos: {comments_found}")
-
-                except Exception as e:
-                    print(f"[Error] Fallo procesando {p_url}: {e}")
+                        cancelled = True
+            finally:
+                # Al cancelar (o si el bucle falla) las pestañas en curso se cierran y no quedan
+                # suspendidas hasta ctx.close(); lo ya terminado se conserva
+                save_rows(pool.close())
 
             if db and db.is_connected:
                 db.update_stage_progress(topic, "instagram", len(target_urls), "completed")
+            blocker.publish(db, topic, "Instagram")
 
         except Exception as e:
             print(f"[Error Global] {e}")
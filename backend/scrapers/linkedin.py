@@ -4,11 +4,13 @@ import random
 import re
 from playwright.sync_api import sync_playwright
 
+from scrapers.common import ResourceBlocker, StreamingResults
+
 def human_delay(min_s=1, max_s=3):
     time.sleep(random.uniform(min_s, max_s))
 
-def scrape_linkedin(topic, email, password, target_count=10):
-    results = []
+def scrape_linkedin(topic, email, password, target_count=10, sink=None):
+    results = StreamingResults(sink)
     print(f"[LinkedIn] Modo 'Humano' (Diferencia de Texto) para: {topic} | Meta: {target_count}")
     
     user_data_dir = os.path.join(os.getcwd(), "profiles", "auth_profile_linkedin")
@@ -24,6 +26,8 @@ def scrape_linkedin(topic, email, password, target_count=10):
             print(f"[LinkedIn] Error lanzando navegador: {launch_error}")
             return []
         
+        # Solo leemos texto: fuera imágenes, vídeo, fuentes y terceros
+        blocker = ResourceBlocker("linkedin").attach(browser)
         if len(browser.pages) > 0: page = browser.pages[0]
         else: page = browser.new_page()
         page.set_default_timeout(30000)
@@ -376,6 +380,7 @@ def scrape_linkedin(topic, email, password, target_count=10):
             if db and db.is_connected:
                 db.update_stage_progress(topic, "linkedin", total_posts_extracted, "completed")
             print(f"[LinkedIn] Finalizado. Total: {len(results)}")
+            blocker.publish(db, topic, "LinkedIn")
             
         except Exception as e:
             print(f"[LinkedIn] Error Global: {e}")
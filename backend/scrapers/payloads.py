@@ -0,0 +1,278 @@
+import html
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import parse_qs
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Modo captura: leer los datos de las respuestas JSON con las que la web hidrata la página
+# (page.on("response")) en vez de reconstruirlos desde el DOM. Si no llega ningún payload
+# útil, cada scraper vuelve a la extracción por DOM.
+SCRAPER_CAPTURE_API = getattr(_config, "SCRAPER_CAPTURE_API", False)
+# Carpeta donde guardar cada payload capturado (fixtures para probar los parsers sin navegador)
+SCRAPER_CAPTURE_DUMP_DIR = getattr(_config, "SCRAPER_CAPTURE_DUMP_DIR", None)
+
+# Endpoints GraphQL de X con tweets: búsqueda y conversación
+X_API_PATTERN = re.compile(r"/i/api/graphql/[^/]+/(SearchTimeline|TweetDetail)")
+# Comentarios de un post de Instagram (API v1 y GraphQL de la web)
+IG_API_PATTERN = re.compile(r"/api/v1/media/\d+/comments|/graphql/query|/api/graphql")
+# Las peticiones GraphQL de Instagram van todas a la misma URL: solo se guardan las de la
+# consulta de comentarios (por su nombre, cabecera x-fb-friendly-name o fb_api_req_friendly_name,
+# o por su doc_id si se configura)
+IG_COMMENT_QUERY_PATTERN = re.compile(getattr(_config, "IG_COMMENT_QUERY_PATTERN", r"Comments?\w*Query"))
+IG_COMMENT_DOC_IDS = set(getattr(_config, "IG_COMMENT_DOC_IDS", []))
+_GRAPHQL_URL = re.compile(r"/graphql")
+# Listas y conexiones que contienen comentarios (API v1 y GraphQL). Cualquier otro objeto
+# con text + user (descripción, posts sugeridos...) no es un comentario
+_IG_COMMENT_KEYS = re.compile(r"^(comments|preview_child_comments|child_comments)$|comments__\w*connection$")
+
+# Claves que contienen OTRO tweet (citado o retuiteado): no son filas de la conversación
+_X_NESTED_KEYS = {"quoted_status_result", "retweeted_status_result"}
+
+
+def _walk(node, key=None, skip=()):
+    """Recorre un JSON en profundidad: (clave del padre, dict) de cada diccionario."""
+    stack = [(key, node)]
+    while stack:
+        key, node = stack.pop()
+        if isinstance(node, dict):
+            yield key, node
+            stack.extend((k, v) for k, v in reversed(list(node.items())) if k not in skip)
+        elif isinstance(node, list):
+            stack.extend((key, v) for v in reversed(node))
+
+
+def _clean_text(text):
+    return html.unescape(text or "").replace("\n", " ").replace("\r", " ").strip()
+
+
+def x_tweet(result):
+    """
+    Tweet de un payload de X con la forma de las filas del scraper, o None si el dict no
+    es un tweet. El texto es el visible (sin las menciones iniciales de las respuestas ni
+    el enlace final de la media), como el de div[data-testid="tweetText"].
+    """
+    if result.get("__typename") == "TweetWithVisibilityResults":
+        result = result.get("tweet") or {}
+    legacy = result.get("legacy")
+    if not isinstance(legacy, dict) or "full_text" not in legacy:
+        return None
+    rest_id = result.get("rest_id") or legacy.get("id_str")
+    if not rest_id:
+        return None
+
+    note = ((result.get("note_tweet") or {}).get("note_tweet_results") or {}).get("result") or {}
+    if note.get("text"):
+        text = note["text"] # Tweets largos: full_text viene truncado
+    else:
+        text = legacy["full_text"]
+        start, end = (legacy.get("display_text_range") or [0, len(text)])[:2]
+        text = text[start:end]
+
+    user = ((result.get("core") or {}).get("user_results") or {}).get("result") or {}
+    screen_name = (user.get("legacy") or {}).get("screen_name") or (user.get("core") or {}).get("screen_name") or ""
+    return {
+        "id": rest_id,
+        "conversation_id": legacy.get("conversation_id_str") or rest_id,
+        "in_reply_to": legacy.get("in_reply_to_status_id_str"),
+        "author": f"@{screen_name}" if screen_name else "",
+        "content": _clean_text(text),
+        "datetime": legacy.get("created_at", ""),
+        "url": f"https://x.com/{screen_name or 'i/web'}/status/{rest_id}",
+    }
+
+
+def parse_x_payload(data):
+    """Tweets (en orden de aparición, sin repetir) de un payload de SearchTimeline o TweetDetail."""
+    tweets = []
+    seen = set()
+    for _, node in _walk(data, skip=_X_NESTED_KEYS):
+        if node.get("__typename") not in ("Tweet", "TweetWithVisibilityResults"):
+            continue
+        tweet = x_tweet(node)
+        if tweet and tweet["content"] and tweet["id"] not in seen:
+            seen.add(tweet["id"])
+            tweets.append(tweet)
+    return tweets
+
+
+def parse_ig_comments(data):
+    """
+    Comentarios (autor, texto) de un payload de Instagram: objetos con pk, text y
+    user.username dentro de una lista de comentarios de la API v1 (comments,
+    preview_child_comments, child_comments) o de una conexión GraphQL de comentarios
+    (...comments__connection -> edges -> node). Lo que cuelga de 'caption' no cuenta.
+    """
+    comments = []
+    seen = set()
+    stack = [(False, data)]
+    while stack:
+        in_comments, node = stack.pop()
+        if isinstance(node, list):
+            stack.extend((in_comments, v) for v in reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        user = node.get("user")
+        if in_comments and isinstance(node.get("text"), str) and isinstance(user, dict) and user.get("username"):
+            pk = node.get("pk") or node.get("id")
+            text = _clean_text(node["text"])
+            if pk is not None and pk not in seen and text:
+                seen.add(pk)
+                comments.append({"id": str(pk), "author": user["username"], "content": text})
+        for k, v in reversed(list(node.items())):
+            if k == "caption" or not isinstance(v, (dict, list)):
+                continue
+            # Dentro de una lista de comentarios, sus edges/node siguen siéndolo; el resto
+            # (user, objetos del comentario) no contiene otros comentarios salvo sus respuestas
+            child_in = bool(_IG_COMMENT_KEYS.search(k)) or (in_comments and k in ("edges", "node"))
+            stack.append((child_in, v))
+    return comments
+
+
+def x_conversation(tweets, url):
+    """
+    {"post", "replies"} de una conversación a partir de los tweets capturados, con el
+    mismo formato que devuelve scrape_conversation. post es None si el tweet principal
+    (el id de la URL) no llegó en ningún payload. Las respuestas son los tweets cuya
+    cadena de in_reply_to llega al tweet principal (respuestas directas y de niveles
+    inferiores); el hilo padre y otras ramas de la misma conversación no entran.
+    """
+    match = re.search(r"/status/(\d+)", url)
+    focal_id = match.group(1) if match else None
+    by_id = {t["id"]: t for t in tweets}
+    focal = by_id.get(focal_id)
+    result = {"post": None, "replies": []}
+    if focal is None:
+        return result
+    result["post"] = {
+        "source": "X", "type": "post", "url": url, "author": focal["author"],
+        "content": focal["content"], "datetime": focal["datetime"], "parent_url": url,
+    }
+    descends = {focal_id: True} # id -> si su cadena de respuestas llega al tweet principal
+
+    def reaches_focal(tid):
+        path = []
+        while tid not in descends:
+            tweet = by_id.get(tid)
+            if tweet is None or tid in path: # Padre no capturado (o ciclo): fuera
+                break
+            path.append(tid)
+            tid = tweet["in_reply_to"]
+        ok = descends.get(tid, False)
+        descends.update(dict.fromkeys(path, ok))
+        return ok
+
+    for t in tweets:
+        if t["id"] != focal_id and reaches_focal(t["id"]):
+            result["replies"].append({
+                "source": "X", "type": "reply", "url": url, "author": t["author"],
+                "content": t["content"], "datetime": t["datetime"], "parent_url": url,
+            })
+    return result
+
+
+class ResponseCapture:
+    """
+    Guarda las respuestas de una página cuya URL coincide con `pattern` y lee sus cuerpos
+    JSON bajo demanda (collect), desde el flujo principal del scraper y no dentro del
+    handler del evento. Los payloads quedan en `payloads` en orden de llegada.
+    query_pattern: en las URLs GraphQL (compartidas por todas las consultas), guardar solo
+    las peticiones cuyo nombre de consulta coincide (o cuyo doc_id está en doc_ids).
+    Tweets y comentarios se parsean de forma incremental: cada payload una sola vez.
+    """
+
+    def __init__(self, pattern, query_pattern=None, doc_ids=()):
+        self.pattern = pattern
+        self.query_pattern = query_pattern
+        self.doc_ids = set(doc_ids)
+        self.reset()
+
+    def attach(self, page):
+        page.on("response", self._on_response)
+        return self
+
+    def _on_response(self, response):
+        if response.request.resource_type in ("xhr", "fetch") and self.pattern.search(response.url):
+            if self.query_pattern is None or not _GRAPHQL_URL.search(response.url) or self._wanted_query(response.request):
+                self._pending.append(response)
+
+    def _wanted_query(self, request):
+        try:
+            headers = request.headers or {}
+            form = parse_qs(request.post_data or "")
+        except Exception:
+            return False
+        if self.doc_ids and (form.get("doc_id") or [""])[0] in self.doc_ids:
+            return True
+        name = headers.get("x-fb-friendly-name") or (form.get("fb_api_req_friendly_name") or [""])[0]
+        return bool(name) and bool(self.query_pattern.search(name))
+
+    def reset(self):
+        """Descarta lo capturado (p.ej. al pasar al siguiente post en la misma página)."""
+        self.payloads = []
+        self._pending = []
+        self._x_tweets, self._x_seen, self._x_parsed = [], set(), 0
+        self._ig_comments, self._ig_seen, self._ig_parsed = [], set(), 0
+
+    def collect(self):
+        """Lee los cuerpos pendientes; devuelve cuántos payloads JSON nuevos se añadieron."""
+        pending, self._pending = self._pending, []
+        added = 0
+        for response in pending:
+            try:
+                payload = response.json()
+            except Exception:
+                continue # Cuerpo no JSON o la página ya se cerró
+            self.payloads.append(payload)
+            added += 1
+            if SCRAPER_CAPTURE_DUMP_DIR:
+                self._dump(payload)
+        return added
+
+    def _dump(self, payload):
+        try:
+            os.makedirs(SCRAPER_CAPTURE_DUMP_DIR, exist_ok=True)
+            path = os.path.join(SCRAPER_CAPTURE_DUMP_DIR, f"payload_{time.time_ns()}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"[Capture] No se pudo guardar el payload: {e}")
+
+    def x_tweets(self):
+        for payload in self.payloads[self._x_parsed:]:
+            for t in parse_x_payload(payload):
+                if t["id"] not in self._x_seen:
+                    self._x_seen.add(t["id"])
+                    self._x_tweets.append(t)
+        self._x_parsed = len(self.payloads)
+        return list(self._x_tweets)
+
+    def ig_comments(self):
+        for payload in self.payloads[self._ig_parsed:]:
+            for c in parse_ig_comments(payload):
+                if c["id"] not in self._ig_seen:
+                    self._ig_seen.add(c["id"])
+                    self._ig_comments.append(c)
+        self._ig_parsed = len(self.payloads)
+        return list(self._ig_comments)
+
+
+if __name__ == "__main__":
+    # Prueba offline de los parsers con payloads guardados (SCRAPER_CAPTURE_DUMP_DIR):
+    #   python -m scrapers.payloads payload_1.json [payload_2.json ...]
+    # Los payloads de referencia y sus resultados esperados están en tests/ (python -m pytest tests)
+    for path in sys.argv[1:]:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        tweets = parse_x_payload(data)
+        comments = parse_ig_comments(data) if not tweets else []
+        print(f"{path}: {len(tweets)} tweets, {len(comments)} comentarios de Instagram")
+        for row in (tweets or comments)[:10]:
+            print(f"   {row['author']}: {row['content'][:80]}")
@@ -8,6 +8,8 @@ from typing import Dict, List
 from playwright.sync_api import TimeoutError, sync_playwright
 
 import config
+from scrapers.common import ResourceBlocker, StepPool, StreamingResults, evaluate_all, run_steps
+from scrapers.payloads import SCRAPER_CAPTURE_API, X_API_PATTERN, ResponseCapture, x_conversation
 
 # This scraper reuses a real session and adds delays; it does not attempt to bypass CAPTCHAs or anti-bot systems.
 
@@ -15,6 +17,20 @@ SLEEP_MIN = 0.5
 SLEEP_MAX = 1.0
 MAX_SCROLLS = 100 # Scroll global del feed
 TARGET_REPLIES_PER_TWEET = 500 # Máximo por post
+# Conversaciones abiertas a la vez en pestañas del mismo contexto (tope: SCRAPER_MAX_TABS_PER_CONTEXT)
+X_CONVERSATION_TABS = getattr(config, "X_CONVERSATION_TABS", 3)
+
+# Texto de cada tweetText y handle (@usuario) de su article, como extract_handle
+TWEETS_JS = """
+els => els.map(el => {
+    const article = el.closest("article");
+    if (!article) return null;
+    const handle = Array.from(article.querySelectorAll('[data-testid="User-Name"] span'))
+        .map(s => (s.innerText || "").trim())
+        .find(t => t.startsWith("@")) || "";
+    return {text: el.innerText || "", author: handle};
+})
+"""
 
 
 def is_port_open(host, port):
@@ -103,6 +119,17 @@ def extract_permalink(article) -> str:
     return f"https://x.com{href}"
 
 
+def dom_permalinks(tweets):
+    """Permalink de cada tweet visible del feed, desplazándose hasta él (extracción por DOM)."""
+    for idx in range(tweets.count()):
+        try:
+            article = tweets.nth(idx)
+            article.scroll_into_view_if_needed()
+            yield extract_permalink(article)
+        except Exception:
+            continue
+
+
 def wait_for_home(page) -> bool:
     for _ in range(20):
         human_delay(1.5)
@@ -153,23 +180,38 @@ def ensure_login(page, username: str, password: str) -> bool:
     return logged_in
 
 
-def scrape_conversation(context, url: str) -> Dict[str, List[Dict[str, str]]]:
+def step_delay(multiplier: float = 1.0) -> float:
+    """Los mismos segundos que human_delay, para cederlos (yield) en vez de dormir."""
+    return random.uniform(SLEEP_MIN, SLEEP_MAX) * multiplier
+
+
+def conversation_steps(context, url: str):
+    """
+    Lectura de una conversación en su propia pestaña, como generador: cada `yield` cede
+    los segundos que la pestaña quiere esperar (delays humanos, carga de respuestas) y el
+    return es {"post", "replies"}. Así StepPool puede intercalar varias conversaciones
+    a la vez; scrape_conversation la ejecuta sola.
+    """
     convo_page = context.new_page()
     convo_results = {"post": None, "replies": []}
+    # Modo captura: el hilo sale de los payloads TweetDetail; el DOM queda como respaldo
+    capture = ResponseCapture(X_API_PATTERN).attach(convo_page) if SCRAPER_CAPTURE_API else None
     try:
-        human_delay(1.5)
-        convo_page.goto(url, wait_until="domcontentloaded")
+        yield step_delay(1.5)
+        # Sin esperar a domcontentloaded: mientras carga, el pool avanza las otras pestañas
+        convo_page.goto(url, wait_until="commit")
         
         # DEBUG: Screenshot desactivado
         # safe_name = url.split('/')[-1]
         # try:
         #     convo_page.screenshot(path=f"debug_tweet_{safe_name}.png")
         # except: pass
-        try:
-             convo_page.wait_for_selector('article', timeout=15000)
-        except: 
-             print(f"   > [X] No se detectó artículo en {url}")
-             return convo_results
+        deadline = time.monotonic() + 15
+        while convo_page.locator('article').count() == 0:
+            if time.monotonic() > deadline:
+                print(f"   > [X] No se detectó artículo en {url}")
+                return convo_results
+            yield 0.25
 
         # Scroll INTELIGENTE con Teclado (PageDown)
         # Esto suele disparar mejor los eventos de carga que el mouse.wheel
@@ -182,21 +224,37 @@ def scrape_conversation(context, url: str) -> Dict[str, List[Dict[str, str]]]:
             
         last_height = convo_page.evaluate("document.body.scrollHeight")
         no_change_count = 0
+        no_payload_count = 0
+        if capture is not None:
+            capture.collect()
         
         print("   > Navegando respuestas (PageDown)...")
         for _ in range(15): 
+            # Con captura, el scroll solo sirve para pedir la siguiente página del hilo:
+            # si ya no llegan payloads nuevos (o hay respuestas de sobra) no hace falta seguir
+            if capture is not None and capture.payloads:
+                if capture.collect():
+                    no_payload_count = 0
+                else:
+                    no_payload_count += 1
+                if no_payload_count >= 2 or len(capture.x_tweets()) > TARGET_REPLIES_PER_TWEET:
+                    break
+
             # Usar teclado para bajar
             convo_page.keyboard.press("PageDown")
-            human_delay(0.5) 
+            yield step_delay(0.5)
             
             # Chequear botones "Mostrar más"
+            more_btns = []
             try:
                 more_btns = convo_page.locator('div[role="button"]:has-text("Mostrar más"), span:has-text("Mostrar más")').all()
-                for btn in more_btns:
+            except: pass
+            for btn in more_btns:
+                try:
                     if btn.is_visible():
                         btn.click()
-                        human_delay(0.5)
-            except: pass
+                except: continue
+                yield step_delay(0.5)
 
             new_height = convo_page.evaluate("document.body.scrollHeight")
             # print(f"     Height: {last_height} -> {new_height}")
@@ -209,6 +267,15 @@ def scrape_conversation(context, url: str) -> Dict[str, List[Dict[str, str]]]:
                 no_change_count = 0
                 last_height = new_height
             
+        if capture is not None:
+            capture.collect()
+            captured = x_conversation(capture.x_tweets(), url)
+            if captured["post"]:
+                captured["replies"] = captured["replies"][:TARGET_REPLIES_PER_TWEET]
+                print(f"   > Conversación leída de la API: {len(captured['replies'])} respuestas ({len(capture.payloads)} payloads)")
+                return captured
+            print("   > Sin payload de la conversación; se extrae del DOM.")
+
         # Estrategia Mejorada para Identificar Post Principal y Respuestas
         
         # 1. Extraer el handle del autor esperado desde la URL
@@ -251,27 +318,18 @@ def scrape_conversation(context, url: str) -> Dict[str, List[Dict[str, str]]]:
              # (Lógica de fallback anterior, simplificada)
              pass
 
-        tweet_texts = convo_page.locator('div[data-testid="tweetText"]')
-        count = tweet_texts.count()
+        # Texto y handle de todos los tweets de la conversación en una sola llamada
+        tweets = evaluate_all(convo_page.locator('div[data-testid="tweetText"]'), TWEETS_JS)
         
         candidates = []
-        for i in range(count):
-            try:
-                el = tweet_texts.nth(i)
-                raw_txt = el.inner_text()
-                txt = raw_txt.replace("\n", " ").replace("\r", " ").strip()
-                if not txt: continue
-                
-                container = el.locator('xpath=./ancestor::article')
-                if container.count() == 0: continue
-                
-                handle = extract_handle(container)
-                
-                candidates.append({
-                    "text": txt,
-                    "author": handle
-                })
-            except: pass
+        for tweet in tweets:
+            if not tweet: continue # Sin article contenedor
+            txt = tweet["text"].replace("\n", " ").replace("\r", " ").strip()
+            if not txt: continue
+            candidates.append({
+                "text": txt,
+                "author": tweet["author"]
+            })
             
         if not main_post_data:
              # Fallback lógica autor URL
@@ -326,8 +384,14 @@ def scrape_conversation(context, url: str) -> Dict[str, List[Dict[str, str]]]:
     return convo_results
 
 
-def scrape_twitter(topic: str, username: str, password: str, target_count: int = 10) -> List[Dict[str, str]]:
-    results: List[Dict[str, str]] = []
+def scrape_conversation(context, url: str) -> Dict[str, List[Dict[str, str]]]:
+    """Lee una conversación sola (sin pool), haciendo las esperas que pide cada paso."""
+    page = context.pages[0] if context.pages else None
+    return run_steps(conversation_steps(context, url), page) or {"post": None, "replies": []}
+
+
+def scrape_twitter(topic: str, username: str, password: str, target_count: int = 10, sink=None) -> List[Dict[str, str]]:
+    results: List[Dict[str, str]] = StreamingResults(sink)
     print(f"[X] Iniciando para: {topic} | Meta: {target_count} POSTS")
 
     # Update DB status immediately to 'running'
@@ -397,6 +461,8 @@ def scrape_twitter(topic: str, username: str, password: str, target_count: int =
             print("[X] No context. Aborting.")
             return results
 
+        # Sin imágenes, vídeo, fuentes ni terceros (también en las pestañas de conversación)
+        blocker = ResourceBlocker("twitter").attach(context)
         page = context.pages[0] if context.pages else context.new_page()
 
         try:
@@ -408,6 +474,7 @@ def scrape_twitter(topic: str, username: str, password: str, target_count: int =
             # Búsqueda TOP (Destacados)
             search_url = f"https://x.com/search?q={topic}&src=typed_query" 
             print(f"[X] Buscando '{topic}'...")
+            search_capture = ResponseCapture(X_API_PATTERN).attach(page) if SCRAPER_CAPTURE_API else None
             page.goto(search_url, wait_until="domcontentloaded")
             human_delay(2.0)
 
@@ -423,91 +490,115 @@ def scrape_twitter(topic: str, username: str, password: str, target_count: int =
                 db = Database()
             except: db = None
 
-             # --- BUCLE PRINCIPAL (Por Post) ---
-            while post_idx < target_count and scrolls < MAX_SCROLLS:
-                print(f"[X] Progreso: {post_idx}/{target_count} posts procesados. Feed scroll {scrolls}...")
+            def save_conversation(convo_data):
+                # Filas de una conversación terminada; el pool las entrega en orden de descubrimiento
+                nonlocal post_idx, collected_comments
+                if not convo_data:
+                    return
+                post_data = convo_data["post"]
+                replies = convo_data["replies"]
                 
-                # Actualizar DB
-                if db and db.is_connected:
-                    db.update_stage_progress(topic, "twitter", post_idx, "running")
+                # Si encontramos el post (aunque tenga 0 comentarios, cuenta como procesado)
+                # Pero para maximizar utilidad, sigamos la lógica de guardar.
+                if post_data:
+                    post_idx += 1
+                    p_author = post_data["author"]
+                    p_content = post_data["content"]
+                    
+                    num_replies = len(replies)
+                    
+                    # Si no hay respuestas, podríamos guardar 1 fila con comment vacio
+                    # o no guardar nada si preferimos solo data con interacción.
+                    # Guardaremos todo para cumplir la cuota de "Posts analizados".
+                    
+                    if num_replies == 0:
+                        # Opcional: Descomentar para guardar posts sin comentarios
+                        results.append({
+                           "platform": "X",
+                           "post_index": post_idx,
+                           "post_author": p_author,
+                           "post_content": p_content,
+                           "comment_author": "N/A",
+                           "comment_content": "No comments found"
+                        })
+                    else:
+                        for reply in replies:
+                            results.append({
+                                "platform": "X",
+                                "post_index": post_idx,
+                                "post_author": p_author,
+                                "post_content": p_content,
+                                "comment_author": reply["author"],
+                                "comment_content": reply["content"]
+                            })
+                    
+                    collected_comments += num_replies
+                    print(f"     + [Post {post_idx}] {num_replies} respuestas. Total global: {collected_comments}")
+
+            # Conversaciones en varias pestañas a la vez (round-robin de pasos, ver StepPool)
+            pool = StepPool(X_CONVERSATION_TABS, label="X", page=page)
+            try:
+                # --- BUCLE PRINCIPAL (Por Post) ---
+                while post_idx < target_count and scrolls < MAX_SCROLLS:
+                    print(f"[X] Progreso: {post_idx}/{target_count} posts procesados ({pool.pending} en curso). Feed scroll {scrolls}...")
                 
-                # 1. Identificar Tweets en pantalla
-                tweets = page.locator('article[data-testid="tweet"]')
-                count = tweets.count()
+                    # Actualizar DB
+                    if db and db.is_connected:
+                        db.update_stage_progress(topic, "twitter", post_idx, "running")
                 
-                # Iterar sobre tweets visibles
-                for idx in range(count):
-                    if post_idx >= target_count: break
+                    # 1. Identificar Tweets en pantalla (con captura: los de los payloads SearchTimeline)
+                    tweets = page.locator('article[data-testid="tweet"]')
+                    permalinks = None
+                    if search_capture is not None:
+                        search_capture.collect()
+                        permalinks = [t["url"] for t in search_capture.x_tweets()] or None
+                
+                    # Iterar sobre tweets visibles
+                    for permalink in (permalinks or dom_permalinks(tweets)):
+                        # Las conversaciones en curso cuentan: no se abren más de las que faltan
+                        if post_idx + pool.pending >= target_count: break
                     
-                    try:
-                        article = tweets.nth(idx)
-                        article.scroll_into_view_if_needed()
-                        
-                        permalink = extract_permalink(article)
-                        if not permalink or permalink in seen_urls:
-                            continue
-                        seen_urls.add(permalink)
-                        
-                        # PROCESS TWEET
-                        print(f"   > [Post {post_idx+1}] Procesando: {permalink}")
-                        human_delay(0.5)
-                        convo_data = scrape_conversation(context, permalink)
+                        try:
+                            if not permalink or permalink in seen_urls:
+                                continue
+                            seen_urls.add(permalink)
                         
-                        post_data = convo_data["post"]
-                        replies = convo_data["replies"]
-                        
-                        # Si encontramos el post (aunque tenga 0 comentarios, cuenta como procesado)
-                        # Pero para maximizar utilidad, sigamos la lógica de guardar.
-                        if post_data:
-                            post_idx += 1
-                            p_author = post_data["author"]
-                            p_content = post_data["content"]
-                            
-                            num_replies = len(replies)
+                            # PROCESS TWEET
+                            print(f"   > [Pestaña {pool.pending + 1}] Procesando: {permalink}")
+                            for convo_data in pool.wait(step_delay(0.5)):
+                                save_conversation(convo_data)
+                            pool.submit(conversation_steps(context, permalink))
+                            for convo_data in pool.wait_for_slot():
+                                save_conversation(convo_data)
                             
-                            # Si no hay respuestas, podríamos guardar 1 fila con comment vacio
-                            # o no guardar nada si preferimos solo data con interacción.
-                            # Guardaremos todo para cumplir la cuota de "Posts analizados".
-                            
-                            if num_replies == 0:
-                                # Opcional: Descomentar para guardar posts sin comentarios
-                                results.append({
-                                   "platform": "X",
-                                   "post_index": post_idx,
-                                   "post_author": p_author,
-                                   "post_content": p_content,
-                                   "comment_author": "N/A",
-                                   "comment_content": "No comments found"
-                                })
-                            else:
-                                for reply in replies:
-                                    results.append({
-                                        "platform": "X",
-                                        "post_index": post_idx,
-                                        "post_author": p_author,
-                                        "post_content": p_content,
-                                        "comment_author": reply["author"],
-                                        "comment_content": reply["content"]
-                                    })
-                            
-                            collected_comments += num_replies
-                            print(f"     + {num_replies} respuestas. Total global: {collected_comments}")
-                            
-                    except Exception as e:
-                        pass
+                        except Exception as e:
+                            pass
                 
-                if post_idx >= target_count: break
+                    if post_idx + pool.pending >= target_count:
+                        # Faltan solo las que están en curso; si alguna falla, se sigue buscando
+                        for convo_data in pool.drain():
+                            save_conversation(convo_data)
+                        continue
                 
-                # Scroll Feed Principal
-                page.mouse.wheel(0, 2500)
-                human_delay(2.0)
-                scrolls += 1
+                    # Scroll Feed Principal (las pestañas siguen avanzando mientras tanto)
+                    page.mouse.wheel(0, 2500)
+                    for convo_data in pool.wait(step_delay(2.0)):
+                        save_conversation(convo_data)
+                    scrolls += 1
             
+                for convo_data in pool.drain():
+                    save_conversation(convo_data)
+            finally:
+                # Si el bucle falla o expira, las pestañas en curso se cierran aquí (en modo
+                # X_REMOTE_DEBUGGING_URL browser.close() solo desconecta y quedarían abiertas)
+                pool.close()
+
             # Final Update
             if db and db.is_connected:
                 db.update_stage_progress(topic, "twitter", post_idx, "completed")
 
             print(f"[X] Finalizado. {post_idx} posts procesados. {collected_comments} respuestas extraídas.")
+            blocker.publish(db, topic, "X")
 
         except TimeoutError:
             print("[X] Timeout durante la carga inicial o búsqueda. Reintentando refresh...")
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+# Los módulos del backend se importan como en producción (desde backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import InternalServerError, RateLimitError  # noqa: E402
+
+
+def overload_error(status=429):
+    """Error de saturación del proveedor (429 o 5xx) como lo lanza el cliente de OpenAI."""
+    response = httpx.Response(status, request=httpx.Request("POST", "http://llm.test/v1/chat/completions"))
+    cls = RateLimitError if status == 429 else InternalServerError
+    return cls(f"HTTP {status}", response=response, body=None)
+
+
+def batch_reply(messages, sentiment="Neutro"):
+    """Respuesta válida del modo por lotes para los ids que trae el mensaje (o del modo individual)."""
+    # "Textos: [...]" o "Post (contexto): ...\nComentarios: [...]": el JSON va en la última línea
+    line = messages[-1]["content"].splitlines()[-1]
+    if "[" not in line:
+        # Un texto suelto ("Texto: ...") viaja en modo individual
+        return json.dumps({"sentiment": sentiment, "explanation": "ok"})
+    ids = [item["id"] for item in json.loads(line[line.index("["):])]
+    return json.dumps([{"id": i, "sentiment": sentiment, "explanation": "ok"} for i in ids])
+
+
+class FakeLLM:
+    """
+    Sustituto de AsyncOpenAI para los tests: `reply(base_url, messages)` devuelve el
+    contenido de la respuesta o lanza una excepción; `delay` simula la latencia.
+    """
+
+    def __init__(self):
+        self.reply = lambda base_url, messages: '{"sentiment": "Neutro", "explanation": "ok"}'
+        self.delay = 0.0
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def client(self, base_url=None, api_key=None):
+        fake = self
+
+        async def create(model, messages, temperature=0, max_tokens=None, **kwargs):
+            fake.calls.append(SimpleNamespace(base_url=base_url, api_key=api_key, model=model, messages=messages))
+            fake.in_flight += 1
+            fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+            try:
+                delay = fake.delay(base_url) if callable(fake.delay) else fake.delay
+                if delay:
+                    await asyncio.sleep(delay)
+                content = fake.reply(base_url, messages)
+            finally:
+                fake.in_flight -= 1
+            usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    import llm_engine
+    import llm_router
+
+    fake = FakeLLM()
+    monkeypatch.setattr(llm_engine, "get_async_client", fake.client)
+    monkeypatch.setattr(llm_router, "get_async_client", fake.client)
+    return fake
@@ -0,0 +1,26 @@
+"""Datos sintéticos y percentiles del benchmark de la fase LLM."""
+from benchmark_llm import make_dataframe, percentile
+
+
+def test_dataframe_is_reproducible():
+    first = make_dataframe(200, comments_per_post=20, duplicate_rate=0.1, seed=3)
+    assert first.equals(make_dataframe(200, comments_per_post=20, duplicate_rate=0.1, seed=3))
+    assert not first.equals(make_dataframe(200, comments_per_post=20, duplicate_rate=0.1, seed=4))
+    assert len(first) == 200
+    # Mismo post -> mismo contenido de post
+    assert first.groupby("post_index")["post_content"].nunique().max() == 1
+
+
+def test_duplicate_rate():
+    df = make_dataframe(500, duplicate_rate=0.2, seed=0)
+    duplicated = df.duplicated(subset=["comment_author", "comment_content"]).mean()
+    assert 0.1 < duplicated < 0.3
+    assert not make_dataframe(500, duplicate_rate=0.0).duplicated().any()
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 0.5) == 51.0
+    assert percentile(values, 0.99) == 100.0
+    assert percentile(list(reversed(values)), 0.0) == 1.0
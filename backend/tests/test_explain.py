@@ -0,0 +1,52 @@
+"""Explicaciones bajo demanda: reutilizan la caché del modo ligero y la del completo."""
+import pandas as pd
+import pytest
+
+import llm_processor
+from llm_checkpoint import compute_row_ids
+from llm_processor import LLMProcessor, get_shared_cache
+from prompt_builder import build_items
+
+TEXT = "Post: Nueva ley | Comment: Me parece una gran idea"
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch):
+    monkeypatch.setattr(llm_processor, "_shared_caches", {})
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+
+
+def lean_processor():
+    # Sin clave: cualquier llamada real al LLM se notaría en la explicación
+    processor = LLMProcessor(cache=get_shared_cache(lean=True), lean=True)
+    processor.api_key = ""
+    return processor
+
+
+def test_lean_cache_hit():
+    get_shared_cache(lean=True).set(TEXT, {"sentiment": "Positivo", "explanation": "apoyo", "confidence": 0.9})
+    res = lean_processor().explain(TEXT)
+    assert res["explanation"] == "apoyo" and res["cached"]
+
+
+def test_full_cache_hit_for_same_label():
+    get_shared_cache(lean=False).set(TEXT, {"sentiment": "Positivo", "explanation": "tono favorable"})
+    get_shared_cache(lean=True).set(TEXT, {"sentiment": "Positivo", "explanation": "", "confidence": 0.9})
+    res = lean_processor().explain(TEXT, "Positivo")
+    assert res["explanation"] == "tono favorable" and res["cached"]
+    # Para otra etiqueta la explicación del modo completo no sirve
+    res = lean_processor().explain(TEXT, "Negativo")
+    assert res["sentiment"] == "Negativo" and not res.get("cached")
+
+
+def test_row_id_rebuilds_the_classified_text():
+    # Fila flat de LinkedIn: su texto depende de todas las columnas del DataFrame del job
+    rows = [
+        {"platform": "LinkedIn", "post_index": 1, "post_content": "Post", "comment_content": "Bien"},
+        {"platform": "LinkedIn", "post_index": 2, "content": "nan", "author": "Ana", "extra": "Texto desplazado"},
+    ]
+    frame = pd.DataFrame(rows)
+    classified = build_items(frame)[1].text
+    row_ids = compute_row_ids(frame)
+    rebuilt = build_items(frame.iloc[[row_ids.index(row_ids[1])]])[0].text
+    assert rebuilt == classified
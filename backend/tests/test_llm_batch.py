@@ -0,0 +1,72 @@
+"""Modo por lotes: validación de respuestas y partición de lotes malformados."""
+import asyncio
+import json
+
+import pytest
+
+import llm_processor
+from conftest import batch_reply
+from llm_processor import LLMProcessor
+
+
+@pytest.fixture(autouse=True)
+def no_routing(monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+
+
+class ScriptedEngine:
+    """Motor mínimo: chat() responde con `reply(messages)` y cuenta las peticiones."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+
+    async def chat(self, messages, max_tokens, temperature=0):
+        self.requests.append(messages)
+        return self.reply(messages), 100
+
+
+def processor(lean=False):
+    p = LLMProcessor(lean=lean)
+    p.api_key = "test"
+    return p
+
+
+def test_parse_batch_requires_every_id():
+    p = processor()
+    ok = json.dumps([{"id": 1, "sentiment": "Negativo"}, {"id": 0, "sentiment": "Positivo"}])
+    assert [r["sentiment"] for r in p._parse_batch(ok, 2)] == ["Positivo", "Negativo"]
+    assert p._parse_batch("```json\n" + ok + "\n```", 2) is not None
+    assert p._parse_batch(json.dumps({"results": json.loads(ok)}), 2) is not None
+    assert p._parse_batch(json.dumps([{"id": 0, "sentiment": "Positivo"}]), 2) is None
+    assert p._parse_batch("no es json", 2) is None
+
+
+def test_parse_lean_batch():
+    p = processor(lean=True)
+    parsed = p._parse_batch("0 pos 9\n1 NEG\n2: neutro 4", 3)
+    assert [r["sentiment"] for r in parsed] == ["Positivo", "Negativo", "Neutro"]
+    assert parsed[0]["confidence"] == 1.0 and "confidence" not in parsed[1]
+    assert p._parse_batch("0 pos", 2) is None
+
+
+def test_one_request_per_batch():
+    engine = ScriptedEngine(batch_reply)
+    results = asyncio.run(processor().analyze_batch_async(["a", "bb", "ccc"], engine))
+    assert len(engine.requests) == 1
+    assert [r["sentiment"] for r in results] == ["Neutro"] * 3
+    # Los tokens de la petición se reparten en proporción a la longitud
+    assert [r["tokens"] for r in results] == [17, 33, 50]
+
+
+def test_malformed_batch_is_split_down_to_single_requests():
+    def reply(messages):
+        if messages[0]["content"].startswith("Eres un analista") and "lista JSON" in messages[0]["content"]:
+            return "respuesta cortada ["
+        return json.dumps({"sentiment": "Positivo", "explanation": "ok"})
+
+    engine = ScriptedEngine(reply)
+    results = asyncio.run(processor().analyze_batch_async(["a", "b", "c", "d"], engine))
+    assert [r["sentiment"] for r in results] == ["Positivo"] * 4
+    # 1 lote de 4 + 2 de 2 + 4 individuales
+    assert len(engine.requests) == 7
@@ -0,0 +1,82 @@
+"""SentimentCache (claves, LRU, TTL, prefetch/flush) y BackgroundWriter."""
+import threading
+
+import llm_cache
+from llm_cache import SentimentCache
+from llm_writer import BackgroundWriter
+
+
+class FakeDB:
+    is_connected = True
+
+    def __init__(self, stored=None):
+        self.stored = dict(stored or {})
+        self.queries = 0
+        self.writes = []
+
+    def get_llm_cache_many(self, keys, ttl_seconds):
+        self.queries += 1
+        return {k: self.stored[k] for k in keys if k in self.stored}
+
+    def save_llm_cache_many(self, entries, ttl_seconds):
+        self.writes.append(dict(entries))
+        self.stored.update(entries)
+
+
+def test_key_depends_on_model_prompt_and_normalized_text():
+    cache = SentimentCache("m1", "v1")
+    assert cache.make_key("hola   mundo") == cache.make_key(" hola mundo ")
+    assert cache.make_key("hola") != SentimentCache("m2", "v1").make_key("hola")
+    assert cache.make_key("hola") != SentimentCache("m1", "v2").make_key("hola")
+
+
+def test_get_set_ignores_errors_and_counts_hits():
+    cache = SentimentCache("m", "v")
+    cache.set("a", {"sentiment": "Error", "explanation": "timeout"})
+    assert cache.get("a") is None
+    cache.set("a", {"sentiment": "Positivo", "explanation": "bien", "tokens": 50, "confidence": 0.9})
+    assert cache.get("a") == {"sentiment": "Positivo", "explanation": "bien", "confidence": 0.9, "tokens": 0, "cached": True}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_lru_and_ttl(monkeypatch):
+    cache = SentimentCache("m", "v", max_items=2)
+    for t in ("a", "b"):
+        cache.set(t, {"sentiment": "Neutro"})
+    cache.get("a") # "a" pasa a ser la más reciente
+    cache.set("c", {"sentiment": "Neutro"})
+    assert cache.contains("a") and cache.contains("c") and not cache.contains("b")
+
+    expiring = SentimentCache("m", "v", ttl_seconds=10)
+    expiring.set("a", {"sentiment": "Neutro"})
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 11)
+    assert expiring.get("a") is None
+
+
+def test_prefetch_and_flush_batch_db_access():
+    warm = SentimentCache("m", "v")
+    db = FakeDB({warm.make_key("a"): {"sentiment": "Negativo", "explanation": ""}})
+    cache = SentimentCache("m", "v", db=db)
+    assert cache.get("a") is None # get() nunca consulta MongoDB
+    assert cache.prefetch(["a", "b", "a"]) == 1 and db.queries == 1
+    assert cache.get("a")["sentiment"] == "Negativo"
+    assert cache.prefetch(["a"]) == 0 and db.queries == 1 # Ya en memoria
+
+    cache.set("b", {"sentiment": "Positivo"})
+    cache.set("c", {"sentiment": "Neutro"})
+    assert db.writes == []
+    assert cache.flush() == 2
+    assert len(db.writes) == 1 and len(db.writes[0]) == 2
+    assert cache.flush() == 0
+
+
+def test_background_writer_runs_in_order_off_thread():
+    writer = BackgroundWriter()
+    calls = []
+    writer.submit(lambda: calls.append((1, threading.current_thread().name)))
+    writer.submit(lambda: 1 / 0) # Los errores se registran y no paran la cola
+    writer.submit(lambda n: calls.append((n, threading.current_thread().name)), 2)
+    writer.close()
+    assert [n for n, _ in calls] == [1, 2]
+    assert all(name.startswith("llm-writer") for _, name in calls)
@@ -0,0 +1,96 @@
+"""Checkpoint de la fase LLM: ids de fila, escritura por lotes y cuándo reanudar."""
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import llm_checkpoint
+from llm_checkpoint import CheckpointWriter, compute_row_ids, should_resume
+from llm_writer import BackgroundWriter
+
+NOW = datetime(2026, 1, 10, 12, 0)
+
+
+class FakeDB:
+    def __init__(self):
+        self.saved = []
+
+    def save_llm_checkpoint_results(self, topic, results):
+        self.saved.append((topic, dict(results)))
+
+
+def frame(rows):
+    return pd.DataFrame([
+        {"platform": "X", "post_index": 1, "post_content": "post", "comment_author": author, "comment_content": text}
+        for author, text in rows
+    ])
+
+
+def test_row_ids_are_stable_and_distinct_for_repeats():
+    df = frame([("@ana", "hola"), ("@beto", "adiós"), ("@ana", "hola")])
+    ids = compute_row_ids(df)
+    assert len(set(ids)) == 3
+    # El mismo texto repetido: mismo hash con otro nº de aparición
+    assert ids[0].rsplit("-", 1)[0] == ids[2].rsplit("-", 1)[0]
+    assert compute_row_ids(df) == ids
+    # Un reordenamiento no cambia el id de cada fila
+    assert compute_row_ids(df.iloc[[1, 0, 2]]) == [ids[1], ids[0], ids[2]]
+
+
+def test_row_ids_treat_nan_and_none_alike():
+    # Al releer las filas de MongoDB un NaN puede volver como None (o como "nan")
+    base = frame([("@ana", "hola")])
+    ids = {tuple(compute_row_ids(base.assign(content=value))) for value in (float("nan"), None, "nan", "")}
+    assert len(ids) == 1
+
+
+def test_writer_flushes_by_rows_and_skips_errors():
+    db = FakeDB()
+    checkpoint = CheckpointWriter(db, "tema", flush_rows=3, flush_seconds=60)
+    checkpoint.add(["r1", "r2"], {"sentiment": "Positivo", "explanation": "bien", "tokens": 15, "source": "llm"})
+    checkpoint.add(["r3"], {"sentiment": "Error", "explanation": "timeout"})
+    assert db.saved == []
+    checkpoint.add(["r4"], {"sentiment": "Neutro", "tokens": 7})
+    assert len(db.saved) == 1
+    topic, results = db.saved[0]
+    assert topic == "tema" and set(results) == {"r1", "r2", "r4"}
+    # Los tokens se imputan solo a la primera fila que comparte el texto
+    assert results["r1"]["tokens"] == 15 and results["r2"]["tokens"] == 0
+    assert results["r1"]["source"] == "llm" and "source" not in results["r4"]
+    assert checkpoint.saved == 3
+
+
+def test_writer_flushes_by_time(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(llm_checkpoint.time, "monotonic", lambda: clock[0])
+    db = FakeDB()
+    checkpoint = CheckpointWriter(db, "tema", flush_rows=100, flush_seconds=5)
+    checkpoint.add(["r1"], {"sentiment": "Positivo"})
+    assert db.saved == []
+    clock[0] += 6
+    checkpoint.add(["r2"], {"sentiment": "Negativo"})
+    assert [set(results) for _, results in db.saved] == [{"r1", "r2"}]
+
+
+def test_writer_goes_through_background_writer():
+    db = FakeDB()
+    writer = BackgroundWriter()
+    checkpoint = CheckpointWriter(db, "tema", flush_rows=100, writer=writer)
+    checkpoint.add(["r1"], {"sentiment": "Positivo"})
+    checkpoint.flush()
+    writer.close()
+    assert [set(results) for _, results in db.saved] == [{"r1"}]
+
+
+@pytest.mark.parametrize("status, expected", [
+    ({"llm_status": "running", "updated_at": NOW - timedelta(hours=1)}, True),
+    ({"llm_status": "failed", "updated_at": NOW - timedelta(hours=1), "llm_resume_attempts": 2}, True),
+    ({"llm_status": "done", "updated_at": NOW - timedelta(hours=1)}, False),
+    ({"llm_status": "running", "updated_at": NOW - timedelta(hours=1), "cancelled": True}, False),
+    ({"llm_status": "running", "updated_at": NOW - timedelta(hours=1), "llm_resume_attempts": 3}, False),
+    ({"llm_status": "running", "updated_at": NOW - timedelta(hours=25)}, False),
+    ({"llm_status": "running", "updated_at": "2026-01-10"}, False),
+    (None, False),
+])
+def test_should_resume(status, expected):
+    assert should_resume(status, now=NOW) is expected
@@ -0,0 +1,217 @@
+"""Controladores de la fase LLM: AIMD, circuit breaker, backoff y hedging."""
+import asyncio
+import random
+import time
+
+import pytest
+
+import llm_engine
+from conftest import overload_error
+from llm_control import (
+    OUTCOME_ERROR, OUTCOME_OK, OUTCOME_OVERLOAD, AdaptiveLimiter, CircuitBreaker, CircuitOpenError, Hedger,
+    backoff_delay,
+)
+from llm_engine import LLMEngine
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def complete(limiter, outcome, latency=0.01, started=None):
+    """Una petición completa con la latencia indicada (sin dormir)."""
+    await limiter.acquire()
+    await limiter.release(started if started is not None else time.monotonic() - latency, outcome)
+
+
+def test_additive_increase_per_healthy_window():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=2, max_limit=4)
+        for _ in range(2):
+            await complete(limiter, OUTCOME_OK)
+        assert limiter.limit == 3 # Ventana de 2 peticiones sanas: +1
+        for _ in range(3):
+            await complete(limiter, OUTCOME_OK)
+        assert limiter.limit == 4
+        for _ in range(8):
+            await complete(limiter, OUTCOME_OK)
+        assert limiter.limit == 4 # Techo
+    run(scenario())
+
+
+def test_no_increase_when_latency_degrades_or_errors():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=2, max_limit=10)
+        for _ in range(2):
+            await complete(limiter, OUTCOME_OK, latency=0.01)
+        assert limiter.limit == 3
+        for _ in range(3):
+            await complete(limiter, OUTCOME_OK, latency=1.0) # p50 100x la mejor observada
+        assert limiter.limit == 3
+        await complete(limiter, OUTCOME_OK)
+        await complete(limiter, OUTCOME_OK)
+        await complete(limiter, OUTCOME_ERROR) # 33% de errores en la ventana
+        assert limiter.limit == 3
+    run(scenario())
+
+
+def test_multiplicative_decrease_once_per_burst():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=16, min_limit=2, max_limit=16)
+        burst_started = time.monotonic()
+        # Ráfaga de 429 de peticiones lanzadas a la vez: un solo recorte
+        for _ in range(5):
+            await complete(limiter, OUTCOME_OVERLOAD, started=burst_started)
+        assert limiter.limit == 8
+        # Una petición lanzada después del recorte sí vuelve a recortar
+        await complete(limiter, OUTCOME_OVERLOAD, latency=0)
+        assert limiter.limit == 4
+        for _ in range(5):
+            await complete(limiter, OUTCOME_OVERLOAD, latency=0)
+        assert limiter.limit == 2 # Suelo
+        assert limiter.snapshot()["overload"] == 11
+    run(scenario())
+
+
+def test_acquire_waits_under_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=2, max_limit=2)
+        started = [await limiter.acquire(), await limiter.acquire()]
+        third = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.02)
+        assert not third.done() and limiter.in_flight == 2
+        await limiter.release(started[0], OUTCOME_OK)
+        await asyncio.wait_for(third, 1)
+        assert limiter.in_flight == 2
+    run(scenario())
+
+
+def test_breaker_opens_probes_and_closes():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=0.05)
+        for _ in range(2):
+            breaker.record_failure(True)
+        breaker.record_failure(False) # Un 400 no cuenta
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record_failure(True)
+        assert breaker.state == CircuitBreaker.OPEN and breaker.times_opened == 1
+
+        # Pasado el cooldown solo una petición hace de sonda; la otra espera
+        probe = await asyncio.wait_for(breaker.wait_ready(), 1)
+        assert probe is True and breaker.state == CircuitBreaker.HALF_OPEN
+        waiting = asyncio.ensure_future(breaker.wait_ready())
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        breaker.record_success(probe=True)
+        assert await asyncio.wait_for(waiting, 1) is False
+        assert breaker.state == CircuitBreaker.CLOSED and breaker.cooldown == 0.05
+    run(scenario())
+
+
+def test_failed_probe_doubles_cooldown_and_gives_up():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.02, max_cooldown=0.05, give_up_after=0.15)
+        breaker.record_failure(True)
+        for expected in (0.04, 0.05):
+            probe = await asyncio.wait_for(breaker.wait_ready(), 1)
+            breaker.record_failure(True, probe=probe)
+            assert breaker.state == CircuitBreaker.OPEN and breaker.cooldown == expected
+        await asyncio.sleep(0.15)
+        with pytest.raises(CircuitOpenError):
+            await breaker.wait_ready()
+    run(scenario())
+
+
+def test_backoff_delay_full_jitter():
+    random.seed(3)
+    delays = [backoff_delay(attempt, base=1.0, cap=5.0) for attempt in range(6) for _ in range(50)]
+    assert all(0 <= d <= 5.0 for d in delays)
+    assert max(backoff_delay(1, base=1.0, cap=5.0) for _ in range(200)) <= 2.0
+
+
+def test_engine_trips_breaker_and_retries(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_engine, "backoff_delay", lambda attempt: 0)
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k", breaker=CircuitBreaker(failure_threshold=2, cooldown=0.01))
+    failures = {"left": 2}
+
+    def reply(base_url, messages):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise overload_error(503)
+        return "ok"
+
+    fake_llm.reply = reply
+
+    async def classify(item):
+        try:
+            return (await engine.chat([{"role": "user", "content": item}], max_tokens=5))[0]
+        except Exception as e:
+            return "retry" if llm_engine.is_retryable(e) else "fatal"
+
+    async def scenario():
+        results = await engine.map(classify, ["a", "b"])
+        assert results == ["retry", "retry"]
+        assert engine.breaker.state == CircuitBreaker.OPEN
+        left = await engine.retry_failed(classify, ["a", "b"], results, needs_retry=lambda r: r == "retry")
+        return results, left
+
+    results, left = engine.run(scenario())
+    assert results == ["ok", "ok"] and left == 0
+    assert engine.retried == 2 and engine.recovered == 2
+    assert engine.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_hedger_delay_budget_and_savings():
+    hedger = Hedger(percentile=0.9, budget=0.1, min_samples=5, min_delay=0.05)
+    for latency in (0.01, 0.02, 0.03, 0.04):
+        hedger.record(latency)
+    # Sin muestras suficientes no se duplica nada
+    assert hedger.delay() is None
+    for latency in (0.2, 0.3, 1.0, 2.0, 0.01, 0.01):
+        hedger.record(latency)
+    assert hedger.delay() == 2.0
+    assert Hedger(percentile=0.1, min_samples=1, min_delay=0.05).delay() is None
+    floor = Hedger(percentile=0.1, min_samples=1, min_delay=0.05)
+    floor.record(0.001)
+    assert floor.delay() == 0.05
+    # Presupuesto: como mucho un 10% de duplicados
+    hedger.requests = 20
+    hedger.hedged = 1
+    assert hedger.allow()
+    hedger.hedged = 2
+    assert not hedger.allow()
+    # Un duplicado que gana a 0.5s ahorra la media de la cola observada por encima (1.0 y 2.0)
+    hedger.record(0.5, hedged=True, hedge_won=True)
+    assert hedger.hedge_wins == 1 and hedger.saved_seconds == pytest.approx(1.0)
+    assert 0.5 not in hedger._latencies
+
+
+def seeded_hedger():
+    hedger = Hedger(percentile=0.5, budget=1.0, min_samples=1, min_delay=0.0)
+    hedger.record(0.02)
+    return hedger
+
+
+def test_engine_hedges_slow_request(fake_llm):
+    # La primera petición se queda en la cola lenta; el duplicado responde al momento
+    delays = iter([2.0, 0.0])
+    fake_llm.delay = lambda base_url: next(delays)
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k", hedger=seeded_hedger())
+    started = time.monotonic()
+    content, tokens = run(engine.chat([{"role": "user", "content": "Texto: hola"}], max_tokens=50))
+    assert time.monotonic() - started < 1.0
+    assert tokens == 15 and len(fake_llm.calls) == 2
+    snap = engine.snapshot()["hedging"]
+    assert snap["hedged"] == 1 and snap["hedge_wins"] == 1
+    # La original se canceló: no queda nada en vuelo
+    assert engine.limiter.in_flight == 0
+
+
+def test_engine_does_not_hedge_fast_or_over_budget(fake_llm):
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k", hedger=seeded_hedger())
+    run(engine.chat([{"role": "user", "content": "Texto: hola"}], max_tokens=50))
+    assert len(fake_llm.calls) == 1 and engine.hedger.hedged == 0
+    fake_llm.delay = 0.1
+    engine.hedger.budget = 0.0
+    run(engine.chat([{"role": "user", "content": "Texto: hola"}], max_tokens=50))
+    assert len(fake_llm.calls) == 2 and engine.hedger.hedged == 0
@@ -0,0 +1,70 @@
+"""LLMEngine: clientes compartidos, map() acotado y ejecución desde código síncrono."""
+import asyncio
+
+import httpx
+from openai import BadRequestError
+
+import llm_engine
+from conftest import overload_error
+from llm_engine import LLMEngine, classify_exception, is_retryable
+
+
+def test_async_client_shared_per_loop():
+    async def two_clients():
+        a = llm_engine.get_async_client("http://llm.test/v1", "k")
+        b = llm_engine.get_async_client("http://llm.test/v1", "k")
+        other = llm_engine.get_async_client("http://otro.test/v1", "k")
+        await llm_engine.close_async_client()
+        return a, b, other
+
+    a, b, other = asyncio.run(two_clients())
+    assert a is b and a is not other
+    # Otro event loop: otro cliente (un httpx.AsyncClient no se puede compartir entre loops)
+    assert asyncio.run(two_clients())[0] is not a
+
+
+def test_map_keeps_order_and_bounds_workers():
+    engine = LLMEngine(max_concurrency=3)
+    running = {"now": 0, "max": 0}
+    done = []
+
+    async def work(x):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01 * (5 - x % 5))
+        running["now"] -= 1
+        return x * 10
+
+    results = engine.run(engine.map(work, list(range(10)), on_result=lambda i, res: done.append(i)))
+    assert results == [x * 10 for x in range(10)]
+    assert running["max"] == 3
+    assert sorted(done) == list(range(10))
+
+
+def test_chat_through_shared_client(fake_llm):
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k")
+    content, tokens = engine.run(engine.chat([{"role": "user", "content": "hola"}], max_tokens=10))
+    assert tokens == 15 and "Neutro" in content
+    assert fake_llm.calls[0].model == llm_engine.LLM_MODEL
+    assert engine.snapshot()["ok"] == 1
+
+
+def test_run_inside_running_loop(fake_llm):
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k")
+
+    async def caller():
+        # Desde un loop ya en marcha (p.ej. FastAPI) run() usa un hilo con su propio loop
+        return engine.run(engine.chat([{"role": "user", "content": "hola"}], max_tokens=10))
+
+    assert asyncio.run(caller())[1] == 15
+
+
+def test_classify_exception():
+    assert is_retryable(overload_error(429))
+    assert is_retryable(overload_error(503))
+    assert is_retryable(asyncio.TimeoutError())
+    bad_request = BadRequestError(
+        "HTTP 400", response=httpx.Response(400, request=httpx.Request("POST", "http://llm.test")), body=None
+    )
+    assert not is_retryable(bad_request)
+    assert classify_exception(ValueError("json")) == "error"
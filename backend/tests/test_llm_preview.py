@@ -0,0 +1,86 @@
+"""Vista previa de la fase LLM: recuentos parciales y orden de prioridad de las peticiones."""
+import asyncio
+
+import pandas as pd
+
+import llm_preview
+from conftest import batch_reply
+from llm_engine import LLMEngine
+from llm_preview import PartialStats, normalize_platforms
+from llm_processor import LLMProcessor, classify_items_async
+from prompt_builder import build_items, prioritize_units
+
+
+class FakeDB:
+    def __init__(self):
+        self.previews = []
+
+    def update_llm_preview(self, topic, preview):
+        self.previews.append(preview)
+
+
+def rows():
+    return pd.DataFrame([
+        {"platform": "X", "post_index": 1, "post_content": "p1", "comment_content": "a"},
+        {"platform": "X", "post_index": 1, "post_content": "p1", "comment_content": "b"},
+        {"platform": "X", "post_index": 1, "post_content": "p1", "comment_content": "c"},
+        {"platform": "X", "post_index": 2, "post_content": "p2", "comment_content": "d"},
+        {"platform": "X", "post_index": 2, "post_content": "p2", "comment_content": "e"},
+        {"platform": " Facebook", "post_index": 1, "post_content": "f1", "comment_content": "g"},
+        {"platform": " Facebook", "post_index": 1, "post_content": "f1", "comment_content": "h"},
+        {"platform": "X", "post_index": 3, "post_content": "p3", "comment_content": ""},
+    ])
+
+
+def test_partial_counts_per_platform():
+    stats = PartialStats(normalize_platforms(rows()))
+    stats.add([0, 5], {"sentiment": "Positivo"})
+    stats.add([1], {"sentiment": "Negativo"})
+    stats.add([2], {"sentiment": "Error"})
+    preview, shares = stats.snapshot()
+    assert preview["global_counts"] == {"Positivo": 2, "Negativo": 1}
+    assert preview["by_platform"] == {"x": {"Positivo": 1, "Negativo": 1}, "facebook": {"Positivo": 1}}
+    assert preview["classified_rows"] == 3 and preview["total_rows"] == 8
+    assert preview["global_percents"]["Positivo"] == "66.7%"
+    # Sin publicaciones previas la vista previa nunca es estable
+    assert not preview["stable"]
+
+
+def test_publication_is_throttled_and_becomes_stable(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(llm_preview.time, "monotonic", lambda: clock[0])
+    db = FakeDB()
+    stats = PartialStats(["x"] * 100, db=db, topic="tema", interval=2, stable_delta=0.05)
+    stats.add(range(10), {"sentiment": "Positivo"})
+    stats.add(range(10, 20), {"sentiment": "Negativo"})
+    assert len(db.previews) == 1
+    clock[0] += 3
+    stats.add(range(20, 22), {"sentiment": "Positivo"})
+    assert len(db.previews) == 2
+    # Del 100% positivo al 55%: se movió demasiado
+    assert not db.previews[1]["stable"]
+    clock[0] += 3
+    stats.add([22], {"sentiment": "Negativo"})
+    assert db.previews[2]["stable"] and db.previews[2]["max_shift"] < 0.05
+    stats.maybe_publish(force=True)
+    assert db.previews[-1]["final"] and db.previews[-1]["classified_rows"] == 23
+
+
+def test_priority_interleaves_posts_and_platforms():
+    items = build_items(rows())
+    units = [("p1", [0, 1]), ("p1", [2]), ("p2", [3, 4]), ("f1", [5, 6]), (None, [7])]
+    ordered = prioritize_units(items, units)
+    # Primero el post suelto, después el primer trozo de cada post alternando plataformas
+    # y al final el segundo trozo del hilo largo
+    assert ordered == [units[4], units[0], units[3], units[2], units[1]]
+
+
+def test_requests_are_sent_in_priority_order(fake_llm):
+    fake_llm.reply = lambda base_url, messages: batch_reply(messages)
+    items = build_items(rows())
+    engine = LLMEngine(max_concurrency=1, base_url="http://llm.test/v1", api_key="k")
+    processor = LLMProcessor(base_url="http://llm.test/v1", api_key="k")
+    results = asyncio.run(classify_items_async(items, processor=processor, engine=engine, batch_size=2, priority=True))
+    assert [res["sentiment"] for res in results] == ["Neutro"] * len(items)
+    # El primer envío es el post sin comentarios, no el hilo del primer post del DataFrame
+    assert fake_llm.calls[0].messages[-1]["content"].endswith("p3")
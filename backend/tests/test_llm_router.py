@@ -0,0 +1,139 @@
+"""LLMRouter: failover, políticas de reparto, clave de caché por modelo y llamadas síncronas."""
+import asyncio
+import random
+
+import pytest
+from openai import InternalServerError
+
+import llm_processor
+import llm_router
+from llm_engine import DEEPSEEK_BASE_URL, LLM_MODEL
+from conftest import overload_error
+from llm_router import LLMRouter, load_endpoints, routed_model_key, sync_endpoint
+
+SPECS = [
+    {"base_url": "http://a:8001/v1", "api_key": "ka", "model": "m1"},
+    {"base_url": "http://b:8001/v1", "api_key": "kb", "model": "m1"},
+]
+
+
+@pytest.fixture(autouse=True)
+def no_last_router(monkeypatch):
+    # Cada LLMRouter creado queda como _last_router: que no pase de un test a otro
+    monkeypatch.setattr(llm_router, "_last_router", None)
+
+
+def test_routed_model_key():
+    assert routed_model_key([{"base_url": DEEPSEEK_BASE_URL}, {"base_url": DEEPSEEK_BASE_URL}]) == LLM_MODEL
+    assert routed_model_key(SPECS) == "m1@http://a:8001/v1+http://b:8001/v1"
+    # Modelos distintos: no se sabe qué modelo respondió cada entrada
+    assert routed_model_key([SPECS[0], {**SPECS[1], "model": "m2"}]) is None
+
+
+def test_mixed_models_disable_cache(monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [SPECS[0], {**SPECS[1], "model": "m2"}])
+    monkeypatch.setattr(llm_router, "LLM_ENDPOINTS", [SPECS[0], {**SPECS[1], "model": "m2"}])
+    assert llm_processor.get_shared_cache() is None
+    # Un base_url explícito no pasa por el router
+    assert llm_processor.get_shared_cache(base_url="http://a:8001/v1") is not None
+
+
+def test_sync_endpoint_skips_open_circuit(monkeypatch):
+    monkeypatch.setattr(llm_router, "_last_router", None)
+    assert sync_endpoint(LLMRouter(endpoints=load_endpoints(SPECS))) == ("http://a:8001/v1", "ka", "m1")
+    router = LLMRouter(endpoints=load_endpoints(SPECS))
+    router.endpoints[0].breaker._open(0.0)
+    router.endpoints[0].breaker.opened_at = float("inf") # Aún en cooldown
+    # Sin router explícito se usa el último creado
+    assert sync_endpoint() == ("http://b:8001/v1", "kb", "m1")
+    assert router.breaker is None
+
+
+def test_processor_sync_calls_use_routed_endpoint(monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", SPECS)
+    monkeypatch.setattr(llm_router, "_last_router", None)
+    monkeypatch.setattr(llm_router, "LLM_ENDPOINTS", SPECS)
+    calls = []
+    monkeypatch.setattr(llm_processor, "get_sync_client", lambda base_url, api_key: calls.append((base_url, api_key)) or "client")
+    processor = llm_processor.LLMProcessor()
+    assert processor.routed
+    assert processor._sync_target() == ("client", "m1")
+    assert calls == [("http://a:8001/v1", "ka")]
+
+
+def test_router_needs_endpoints():
+    with pytest.raises(ValueError):
+        LLMRouter(endpoints=[])
+
+
+def chat(router):
+    return asyncio.run(router.chat([{"role": "user", "content": "Texto: hola"}], max_tokens=50))
+
+
+def test_overload_fails_over_to_next_endpoint(fake_llm):
+    def reply(base_url, messages):
+        if base_url == "http://a:8001/v1":
+            raise overload_error(429)
+        return '{"sentiment": "Positivo", "explanation": "ok"}'
+
+    fake_llm.reply = reply
+    router = LLMRouter(endpoints=load_endpoints(SPECS), hedge=False)
+    content, tokens = chat(router)
+    assert "Positivo" in content and tokens == 15
+    assert [c.base_url for c in fake_llm.calls] == ["http://a:8001/v1", "http://b:8001/v1"]
+    assert [c.api_key for c in fake_llm.calls] == ["ka", "kb"]
+    snap = router.snapshot()
+    assert snap["failovers"] == 1
+    assert snap["endpoints"]["a:8001"]["overload"] == 1 and snap["endpoints"]["b:8001"]["ok"] == 1
+
+
+def test_client_errors_do_not_fail_over(fake_llm):
+    def reply(base_url, messages):
+        raise ValueError("petición mal formada")
+
+    fake_llm.reply = reply
+    router = LLMRouter(endpoints=load_endpoints(SPECS), hedge=False)
+    with pytest.raises(ValueError):
+        chat(router)
+    assert len(fake_llm.calls) == 1 and router.failovers == 0
+
+
+def test_all_endpoints_overloaded_raises(fake_llm):
+    def reply(base_url, messages):
+        raise overload_error(503)
+
+    fake_llm.reply = reply
+    router = LLMRouter(endpoints=load_endpoints(SPECS), hedge=False)
+    with pytest.raises(InternalServerError):
+        chat(router)
+    assert len(fake_llm.calls) == 2
+
+
+def test_least_latency_prefers_fast_and_untried_endpoints():
+    router = LLMRouter(endpoints=load_endpoints(SPECS), policy="least_latency", hedge=False)
+    a, b = router.endpoints
+    a.record_latency(0.2)
+    # b aún no tiene latencia medida: recibe tráfico al menos una vez
+    assert router._pick(set()) is b
+    b.record_latency(1.0)
+    assert router._pick(set()) is a
+    assert router._pick({a.name}) is b
+    # Con el circuito de a abierto (en cooldown) solo queda b
+    a.breaker._open(0.0)
+    a.breaker.opened_at = float("inf")
+    assert router._pick(set()) is b
+
+
+def test_weighted_policy_follows_weights(monkeypatch):
+    specs = [{**SPECS[0], "weight": 3}, {**SPECS[1], "weight": 1}]
+    router = LLMRouter(endpoints=load_endpoints(specs), policy="weighted", hedge=False)
+    monkeypatch.setattr(llm_router.random, "choices", random.Random(0).choices)
+    picks = [router._pick(set()).name for _ in range(2000)]
+    assert 0.7 < picks.count("a:8001") / len(picks) < 0.8
+
+
+def test_api_keys_create_one_endpoint_per_key():
+    endpoints = load_endpoints([{"base_url": DEEPSEEK_BASE_URL, "api_keys": ["k1", "k2"], "max_concurrency": 5}])
+    assert [(ep.name, ep.api_key) for ep in endpoints] == [("api.deepseek.com#1", "k1"), ("api.deepseek.com#2", "k2")]
+    router = LLMRouter(endpoints=endpoints, hedge=False)
+    assert router.snapshot()["max_limit"] == 10
@@ -0,0 +1,115 @@
+"""Modo muestreo: orden estratificado, intervalos de confianza y rondas hasta el margen objetivo."""
+import json
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import llm_processor
+from llm_engine import LLMEngine
+from llm_sampling import _next_size, classify_sample, estimate_distribution, stratified_order
+
+BASE_URL = "http://llm.test/v1"
+LABELS = ("Positivo", "Negativo", "Neutro")
+
+
+def corpus(n, platforms=("X", "Facebook")):
+    return pd.DataFrame([
+        {"platform": platforms[i % len(platforms)], "post_index": i // 40, "post_content": f"post {i // 40}",
+         "comment_content": f"comentario número {i}"}
+        for i in range(n)
+    ])
+
+
+def mixed_reply(base_url, messages):
+    # Etiqueta repartida de forma determinista según el texto de cada id
+    line = messages[-1]["content"].splitlines()[-1]
+    if "[" not in line:
+        return json.dumps({"sentiment": LABELS[zlib.crc32(line[len("Texto: "):].encode()) % 3], "explanation": "ok"})
+    items = json.loads(line[line.index("["):])
+    return json.dumps([
+        {"id": it["id"], "sentiment": LABELS[zlib.crc32(it["text"].encode()) % 3], "explanation": "ok"}
+        for it in items
+    ])
+
+
+def test_stratified_prefix_keeps_proportions():
+    df = corpus(400)
+    order = stratified_order(df, seed=1)
+    assert sorted(order.tolist()) == list(range(400))
+    assert stratified_order(df, seed=1).tolist() == order.tolist()
+    # Cualquier prefijo tiene de cada estrato (plataforma, post) la misma fracción ±1 fila
+    key = df["platform"] + "|" + df["post_index"].map(str)
+    sizes = key.value_counts()
+    for k in (40, 100, 200):
+        taken = key.iloc[order[:k]].value_counts()
+        for stratum, size in sizes.items():
+            assert abs(taken.get(stratum, 0) - size * k / 400) <= 1
+
+
+def test_estimate_of_a_census_has_no_error():
+    platforms = ["x"] * 4 + ["facebook"] * 4
+    labels = ["Positivo", "Positivo", "Negativo", "Negativo", "Neutro", "Neutro", "Neutro", "Neutro"]
+    estimate = estimate_distribution(platforms, labels)
+    assert estimate["margin"] == 0
+    assert estimate["global_percents"] == {"Negativo": "25.0%", "Neutro": "50.0%", "Positivo": "25.0%"}
+    assert estimate["by_platform"]["x"]["ci"]["Positivo"] == [0.5, 0.5]
+
+
+def test_estimate_weights_platforms_and_lists_unsampled():
+    # x: 100 filas, 10 clasificadas (todas positivas); facebook: 300 filas, 30 negativas; tiktok sin muestra
+    platforms = ["x"] * 100 + ["facebook"] * 300 + ["tiktok"] * 50
+    labels = ["Positivo"] * 10 + [None] * 90 + ["Negativo"] * 30 + [None] * 270 + [None] * 50
+    estimate = estimate_distribution(platforms, labels)
+    assert estimate["global_percents"]["Positivo"] == "25.0%"
+    assert estimate["global_percents"]["Negativo"] == "75.0%"
+    assert estimate["unsampled_platforms"] == ["tiktok"]
+    assert estimate["sampled_rows"] == 40 and estimate["total_rows"] == 450
+
+
+def test_interval_contains_share_and_shrinks_with_sample():
+    platforms = ["x"] * 1000
+    small = estimate_distribution(platforms, (["Positivo", "Negativo"] * 50) + [None] * 900)
+    large = estimate_distribution(platforms, (["Positivo", "Negativo"] * 250) + [None] * 500)
+    low, high = small["global_ci"]["Positivo"]
+    assert low < 0.5 < high
+    assert large["margin"] < small["margin"]
+
+
+def test_next_size_grows_within_bounds():
+    assert _next_size(400, 10000, 0.06, 0.03) == 1600
+    # Como mucho x4 por ronda y al menos un 25% más
+    assert _next_size(400, 10000, 0.30, 0.03) == 1600
+    assert _next_size(400, 10000, 0.031, 0.03) == 500
+    assert _next_size(400, 450, 0.06, 0.03) == 450
+
+
+@pytest.fixture
+def sampling_env(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+    fake_llm.reply = mixed_reply
+    return dict(engine=LLMEngine(base_url=BASE_URL, api_key="k"), base_url=BASE_URL, use_cache=False, batch_size=50,
+                cascade=False, near_dup=False, triage=False, lean=False)
+
+
+def test_sample_grows_until_margin(sampling_env):
+    df = classify_sample(corpus(3000), target_margin=0.05, initial=100, **sampling_env)
+    taken = int(df["sampled"].sum())
+    assert 100 < taken < 3000
+    assert (df.loc[~df["sampled"], "sentiment_llm"] == "N/A").all()
+    assert df.loc[df["sampled"], "sentiment_llm"].isin(LABELS).all()
+    assert set(df.loc[df["sampled"], "label_source"]) == {"llm"}
+    platforms = df["platform"].str.lower().tolist()
+    labels = [s if ok else None for s, ok in zip(df["sentiment_llm"], df["sampled"])]
+    assert estimate_distribution(platforms, labels)["margin"] <= 0.05
+
+
+def test_sample_tops_up_small_platforms(sampling_env):
+    df = corpus(2000)
+    df.loc[df.index[:40], "platform"] = "TikTok"
+    out = classify_sample(df, target_margin=0.5, initial=60, **sampling_env)
+    # El margen se cumple en la primera ronda, pero TikTok necesita LLM_SAMPLE_MIN_PER_PLATFORM filas
+    assert out.loc[out["platform"] == "TikTok", "sampled"].sum() >= 30
+    assert out.loc[out["sampled"], "sentiment_llm"].isin(LABELS).all()
+    assert np.count_nonzero(out["sampled"]) < 2000
@@ -0,0 +1,91 @@
+"""Streaming scraping → LLM: StreamClassifier, contrapresión de StreamingResults y pasada final."""
+import queue
+
+import pandas as pd
+
+import llm_processor
+import llm_stream
+from conftest import batch_reply
+from llm_engine import LLMEngine
+from llm_processor import process_dataframe_concurrently
+from llm_stream import STREAM_END, StreamClassifier
+from prompt_builder import build_items
+from scrapers import common
+from scrapers.common import StreamingResults
+
+BASE_URL = "http://llm.test/v1"
+
+
+def row(comment, post_index=1):
+    return {"platform": "X", "post_index": post_index, "post_content": "Post del tema", "comment_content": comment}
+
+
+def isolate(monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+    monkeypatch.setattr(llm_processor, "_shared_caches", {})
+    # StreamClassifier crea su LLMProcessor con la clave de config
+    monkeypatch.setattr(llm_processor, "DEEPSEEK_API_KEY", "k")
+    monkeypatch.setattr(llm_stream, "LLM_TRIAGE_ENABLED", False)
+    monkeypatch.setattr(llm_stream, "NEAR_DUP_ENABLED", False)
+
+
+class FailingEngine:
+    def run(self, coro):
+        coro.close()
+        raise RuntimeError("motor caído")
+
+
+def test_stream_classifies_batches_while_rows_arrive(fake_llm, monkeypatch):
+    isolate(monkeypatch)
+    fake_llm.reply = lambda base_url, messages: batch_reply(messages, "Positivo")
+    rows = queue.Queue()
+    streamer = StreamClassifier(
+        rows, engine=LLMEngine(base_url=BASE_URL, api_key="k"), batch_rows=2, batch_seconds=60, cascade=False,
+    ).start()
+    for comment in ["uno", "dos", "tres", "uno"]:
+        rows.put(row(comment))
+    results = streamer.close(timeout=5)
+    assert not streamer.alive and not streamer.failed
+    assert streamer.rows_received == 4
+    # Tandas de 2 filas; el texto repetido de la segunda tanda no se vuelve a enviar
+    assert streamer.batches == 2 and len(fake_llm.calls) == 2
+    assert len(results) == 3
+    assert {res["sentiment"] for res in results.values()} == {"Positivo"}
+
+
+def test_stream_failure_keeps_draining_queue():
+    rows = queue.Queue()
+    streamer = StreamClassifier(rows, engine=FailingEngine(), cascade=False).start()
+    rows.put(row("uno"))
+    rows.put(STREAM_END)
+    streamer._thread.join(5)
+    assert streamer.failed and not streamer.alive
+    assert rows.empty()
+    assert streamer.close() == {}
+
+
+def test_final_pass_reuses_streamed_results(fake_llm, monkeypatch):
+    isolate(monkeypatch)
+    fake_llm.reply = lambda base_url, messages: batch_reply(messages, "Negativo")
+    df = pd.DataFrame([row("uno"), row("dos")])
+    # Lo que el streaming ya clasificó (mismo texto que construye la pasada final)
+    precomputed = {item.text: {"sentiment": "Positivo", "explanation": "stream", "tokens": 15}
+                   for item in build_items(df.iloc[[0]])}
+    out = process_dataframe_concurrently(
+        df, use_cache=False, engine=LLMEngine(base_url=BASE_URL, api_key="k"), base_url=BASE_URL,
+        cascade=False, near_dup=False, triage=False, lean=False, precomputed=precomputed,
+    )
+    assert out["sentiment_llm"].tolist() == ["Positivo", "Negativo"]
+    assert len(fake_llm.calls) == 1
+
+
+def test_streaming_results_stop_publishing_when_queue_stays_full(monkeypatch):
+    monkeypatch.setattr(common, "STREAM_PUT_TIMEOUT", 0.01)
+    sink = queue.Queue(maxsize=1)
+    results = StreamingResults(sink)
+    results.append({"id": 1})
+    results.append({"id": 2})
+    results.append({"id": 3})
+    # La lista conserva todas las filas; la cola solo la que cupo
+    assert [r["id"] for r in results] == [1, 2, 3]
+    assert sink.qsize() == 1 and results.sink is None
@@ -0,0 +1,64 @@
+"""Stub local de la API de chat completions: respuestas deterministas que LLMProcessor sabe leer."""
+import pandas as pd
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("uvicorn")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import llm_processor  # noqa: E402
+from llm_engine import LLMEngine  # noqa: E402
+from llm_processor import process_dataframe_concurrently  # noqa: E402
+from llm_stub_server import build_answer, create_app, label_for, parse_args  # noqa: E402
+
+BASE_URL = "http://llm.test/v1"
+REQUEST = {"model": "stub", "messages": [{"role": "user", "content": "Texto: hola"}]}
+
+
+def frame():
+    rows = [{"platform": "X", "post_index": 1, "post_content": "Post del tema", "comment_content": c}
+            for c in ["uno", "dos", "tres"]]
+    rows.append({"platform": "X", "post_index": 2, "post_content": "Otro post", "comment_content": "suelto"})
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize("batch_size, lean", [(1, False), (10, False), (10, True)])
+def test_processor_reads_stub_answers(fake_llm, monkeypatch, batch_size, lean):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+    fake_llm.reply = lambda base_url, messages: build_answer(messages)
+    runs = [
+        process_dataframe_concurrently(
+            frame(), use_cache=False, batch_size=batch_size, engine=LLMEngine(base_url=BASE_URL, api_key="k"),
+            base_url=BASE_URL, cascade=False, near_dup=False, triage=False, lean=lean,
+        )["sentiment_llm"].tolist()
+        for _ in range(2)
+    ]
+    assert "Error" not in runs[0]
+    # Misma entrada -> mismas etiquetas
+    assert runs[0] == runs[1]
+
+
+def test_label_is_deterministic():
+    assert label_for("hola") == label_for("hola")
+    assert label_for("hola") in ("Positivo", "Negativo", "Neutro")
+
+
+def test_app_counts_tokens_and_requests():
+    client = TestClient(create_app(parse_args(["--latency", "fixed", "--median-ms", "0", "--per-token-ms", "0"])))
+    first = client.post("/v1/chat/completions", json=REQUEST).json()
+    second = client.post("/chat/completions", json=REQUEST).json()
+    assert first["choices"][0]["message"]["content"] == second["choices"][0]["message"]["content"]
+    stats = client.get("/stats").json()
+    assert stats["requests"] == 2 and stats["status_codes"] == {"200": 2}
+    assert stats["total_tokens"] == 2 * first["usage"]["total_tokens"]
+    client.post("/reset")
+    assert client.get("/stats").json()["requests"] == 0
+
+
+@pytest.mark.parametrize("flag, status", [("--error-rate", 500), ("--rate-limit-rate", 429)])
+def test_app_injects_errors(flag, status):
+    client = TestClient(create_app(parse_args([flag, "1", "--error-latency-ms", "0"])))
+    response = client.post("/v1/chat/completions", json=REQUEST)
+    assert response.status_code == status
+    assert client.get("/stats").json()["status_codes"] == {str(status): 1}
@@ -0,0 +1,93 @@
+"""Telemetría por petición: histograma de latencias, tokens, códigos de estado y coste."""
+import asyncio
+
+import pytest
+from openai import RateLimitError
+
+import llm_telemetry
+from conftest import overload_error
+from llm_engine import LLMEngine
+from llm_telemetry import Histogram, JobTelemetry, Telemetry, status_label
+
+
+def test_status_labels():
+    assert status_label() == "200"
+    assert status_label(overload_error(429)) == "429"
+    assert status_label(overload_error(503)) == "503"
+    assert status_label(asyncio.TimeoutError()) == "timeout"
+    assert status_label(asyncio.CancelledError()) == "cancelled"
+    assert status_label(ValueError("json")) == "error"
+
+
+def test_histogram_percentiles_interpolate_within_bucket():
+    hist = Histogram(bounds=(0.1, 1.0, 10.0))
+    assert hist.percentile(0.5) is None
+    for value in (0.05, 0.05, 0.5, 0.5, 0.5, 0.5, 5.0, 5.0, 50.0, 50.0):
+        hist.observe(value)
+    assert hist.percentile(0.1) == pytest.approx(0.05)
+    assert hist.percentile(0.5) == pytest.approx(0.1 + 0.9 * 3 / 4)
+    # Lo que cae por encima del último límite se acota a él
+    assert hist.percentile(1.0) == 10.0
+    assert hist.cumulative() == [(0.1, 2), (1.0, 6), (10.0, 8), (float("inf"), 10)]
+
+
+def test_only_successful_requests_count_latency_and_tokens():
+    telemetry = Telemetry()
+    telemetry.record(0.4, "200", prompt_tokens=1_000_000, completion_tokens=0, endpoint="a")
+    telemetry.record(0.6, "200", prompt_tokens=0, completion_tokens=1_000_000, endpoint="b")
+    telemetry.record(0.1, "429", prompt_tokens=500, endpoint="a")
+    telemetry.record_retries(2)
+    snap = telemetry.snapshot()
+    assert snap["requests"] == 3 and snap["status_codes"] == {"200": 2, "429": 1}
+    assert snap["by_endpoint"] == {"a": {"200": 1, "429": 1}, "b": {"200": 1}}
+    assert snap["prompt_tokens"] == 1_000_000 and snap["completion_tokens"] == 1_000_000
+    assert snap["mean_latency_s"] == 0.5 and snap["retries"] == 2
+    assert snap["cost_usd"] == pytest.approx(llm_telemetry.LLM_PRICE_INPUT_PER_M + llm_telemetry.LLM_PRICE_OUTPUT_PER_M)
+
+
+def test_prometheus_text():
+    telemetry = Telemetry()
+    telemetry.record(0.3, "200", prompt_tokens=10, completion_tokens=5, endpoint="a")
+    telemetry.record(0.1, "500", endpoint="a")
+    text = telemetry.render_prometheus()
+    assert 'llm_requests_total{endpoint="a",status="200"} 1' in text
+    assert 'llm_requests_total{endpoint="a",status="500"} 1' in text
+    assert 'llm_request_latency_seconds_bucket{le="0.25"} 0' in text
+    assert 'llm_request_latency_seconds_bucket{le="0.5"} 1' in text
+    assert 'llm_request_latency_seconds_bucket{le="+Inf"} 1' in text
+    assert 'llm_tokens_total{kind="completion"} 5' in text
+    assert text.endswith("\n")
+
+
+def test_job_telemetry_feeds_global(monkeypatch):
+    monkeypatch.setattr(llm_telemetry, "GLOBAL_TELEMETRY", Telemetry())
+    first, second = JobTelemetry(), JobTelemetry()
+    first.record(0.2, "200", 10, 5)
+    second.record(0.2, "200", 10, 5)
+    second.record_retries(1)
+    assert first.snapshot()["requests"] == 1
+    total = llm_telemetry.GLOBAL_TELEMETRY.snapshot()
+    assert total["requests"] == 2 and total["prompt_tokens"] == 20 and total["retries"] == 1
+
+
+def test_engine_records_each_request(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_telemetry, "GLOBAL_TELEMETRY", Telemetry())
+    outcomes = iter([overload_error(429), None])
+
+    def reply(base_url, messages):
+        error = next(outcomes)
+        if error:
+            raise error
+        return '{"sentiment": "Neutro", "explanation": "ok"}'
+
+    fake_llm.reply = reply
+    fake_llm.delay = 0.01
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k", hedge=False)
+    messages = [{"role": "user", "content": "Texto: hola"}]
+    with pytest.raises(RateLimitError):
+        asyncio.run(engine.chat(messages, max_tokens=50))
+    asyncio.run(engine.chat(messages, max_tokens=50))
+    snap = engine.telemetry.snapshot()
+    assert snap["status_codes"] == {"429": 1, "200": 1}
+    assert snap["prompt_tokens"] == 10 and snap["completion_tokens"] == 5
+    assert snap["p50_latency_s"] is not None and snap["tokens_per_s"] > 0
@@ -0,0 +1,76 @@
+"""Triaje previo a la fase LLM: reglas por defecto, cambios por plataforma y ahorro de peticiones."""
+import pandas as pd
+
+import llm_processor
+from conftest import batch_reply
+from llm_engine import LLMEngine
+from llm_processor import process_dataframe_concurrently
+from llm_triage import rules_for, triage_rows, triage_stats
+
+
+def row(comment, platform="X", post="Post del tema", post_index=1):
+    return {"platform": platform, "post_index": post_index, "post_content": post, "comment_content": comment}
+
+
+def rules(results):
+    return [res["triage"] if res else None for res in results]
+
+
+def test_default_rules():
+    df = pd.DataFrame([
+        row("Me parece una propuesta razonable"),
+        row("No comments found"),
+        row(""),
+        row("👍🔥"),
+        row("😡👎"),
+        row("🤔"),
+        row("k"),
+        row("", post=""),
+    ])
+    results = triage_rows(df)
+    assert rules(results) == [None, "placeholder", None, "emoji_only", "emoji_only", "emoji_only", "short", "empty"]
+    assert [res["sentiment"] for res in results if res] == ["N/A", "Positivo", "Negativo", "Neutro", "Neutro", "N/A"]
+    assert all(res["tokens"] == 0 for res in results if res)
+
+
+def test_platform_overrides():
+    assert rules_for("linkedin")["empty_comment"] == "skip"
+    assert rules_for("x")["empty_comment"] == "classify"
+    df = pd.DataFrame([row("", platform="LinkedIn "), row("", platform="X"), row("ok", platform="Facebook")])
+    custom = {"facebook": {"min_chars": 3}}
+    assert rules(triage_rows(df)) == ["empty_comment", None, None]
+    assert rules(triage_rows(df, platform_rules=custom)) == [None, None, "short"]
+
+
+def test_metadata_only_rows_are_empty():
+    df = pd.DataFrame([{"platform": "X", "post_index": 3, "post_author": "@ana", "comment_author": "@beto",
+                        "post_content": "nan", "comment_content": None}])
+    assert rules(triage_rows(df)) == ["empty"]
+
+
+def test_stats_count_only_calls_actually_saved():
+    texts = ["a", "b", "b", "c"]
+    results = [
+        {"sentiment": "N/A", "triage": "placeholder"},
+        {"sentiment": "Neutro", "triage": "short"},
+        None,
+        {"sentiment": "Positivo", "triage": "emoji_only"},
+    ]
+    stats = triage_stats(results, texts, sent_texts=["b"])
+    assert stats == {"rows": 3, "skipped": 1, "labeled": 2,
+                     "by_rule": {"placeholder": 1, "short": 1, "emoji_only": 1}, "calls_saved": 2}
+
+
+def test_triaged_rows_never_reach_the_llm(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+    fake_llm.reply = lambda base_url, messages: batch_reply(messages, "Negativo")
+    df = pd.DataFrame([row("Esto es un desastre"), row("No comments found"), row("👏")])
+    out = process_dataframe_concurrently(
+        df, use_cache=False, engine=LLMEngine(base_url="http://llm.test/v1", api_key="k"), base_url="http://llm.test/v1",
+        cascade=False, near_dup=False, triage=True, lean=False,
+    )
+    assert out["sentiment_llm"].tolist() == ["Negativo", "N/A", "Positivo"]
+    assert out["triage"].tolist() == ["", "placeholder", "emoji_only"]
+    assert out["label_source"].tolist() == ["llm", "triage", "triage"]
+    assert len(fake_llm.calls) == 1
+    assert "No comments found" not in fake_llm.calls[0].messages[-1]["content"]
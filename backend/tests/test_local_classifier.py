@@ -0,0 +1,80 @@
+"""Modo cascada: clasificador local (léxico y modelo lineal) y reparto con el LLM."""
+import pandas as pd
+import pytest
+
+import llm_processor
+import local_classifier
+from conftest import batch_reply
+from llm_engine import LLMEngine
+from local_classifier import LocalSentimentClassifier, get_local_classifier, lexicon_score
+from llm_processor import process_dataframe_concurrently
+
+
+class FakeDB:
+    is_connected = True
+
+    def __init__(self, texts=(), labels=()):
+        self.samples = (list(texts), list(labels))
+        self.queries = 0
+
+    def get_labeled_samples(self):
+        self.queries += 1
+        return self.samples
+
+
+def test_lexicon_with_negation_and_emoji():
+    assert lexicon_score("Excelente trabajo, gracias 👏") == 3
+    assert lexicon_score("Esto no es bueno") == -1
+    assert lexicon_score("Qué vergüenza, un fraude 😡") == -3
+    assert lexicon_score("Mañana hay reunión") == 0
+
+
+def test_lexicon_predictions():
+    preds = LocalSentimentClassifier().predict(["Excelente, genial, gracias", "Mañana hay reunión", "odio"])
+    assert preds[0][0] == "Positivo" and preds[0][1] == pytest.approx(0.85)
+    assert preds[1] == ("Neutro", 0.4)
+    assert preds[2][0] == "Negativo" and preds[2][1] < 0.85
+
+
+def test_retrain_is_throttled_even_when_training_fails(monkeypatch):
+    monkeypatch.setattr(local_classifier, "_shared_classifier", None)
+    db = FakeDB(["pocos"], ["Positivo"])
+    get_local_classifier(db)
+    get_local_classifier(db)
+    assert db.queries == 1
+
+
+def test_linear_model_trains_on_labels(monkeypatch):
+    pytest.importorskip("sklearn")
+    monkeypatch.setattr(local_classifier, "CASCADE_MIN_TRAINING", 10)
+    texts = [f"me encanta esta propuesta {i}" for i in range(10)] + [f"qué horror de gestión {i}" for i in range(10)]
+    labels = ["Positivo"] * 10 + ["Negativo"] * 10
+    clf = LocalSentimentClassifier()
+    assert clf.train_from_db(FakeDB(texts, labels))
+    assert clf.predict(["me encanta esta propuesta"])[0][0] == "Positivo"
+
+
+def test_cascade_sends_only_uncertain_rows(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+    monkeypatch.setattr(local_classifier, "_shared_classifier", LocalSentimentClassifier())
+
+    def reply(base_url, messages):
+        # Un solo texto escalado viaja en modo individual; varios, por lotes
+        if "[" in messages[-1]["content"].splitlines()[-1]:
+            return batch_reply(messages)
+        return '{"sentiment": "Neutro", "explanation": "ok"}'
+
+    fake_llm.reply = reply
+    df = pd.DataFrame([
+        # El post es muy positivo, pero se predice sobre el comentario solo
+        {"platform": "X", "post_index": 1, "post_content": "Excelente genial gracias bravo", "comment_content": "Qué horror, un fraude, una vergüenza"},
+        {"platform": "X", "post_index": 1, "post_content": "Excelente genial gracias bravo", "comment_content": "Mañana hablamos del tema"},
+    ])
+    engine = LLMEngine(base_url="http://llm.test/v1", api_key="k")
+    out = process_dataframe_concurrently(
+        df, use_cache=False, engine=engine, base_url="http://llm.test/v1", cascade=True, cascade_threshold=0.7,
+        near_dup=False, triage=False, lean=False,
+    )
+    assert out["sentiment_llm"].tolist() == ["Negativo", "Neutro"]
+    assert out["label_source"].tolist() == ["local", "llm"]
+    assert len(fake_llm.calls) == 1
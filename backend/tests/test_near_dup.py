@@ -0,0 +1,35 @@
+"""Agrupación de casi-duplicados: copias con ruido se unen, las negaciones las separan."""
+import near_dup
+from near_dup import cluster_near_duplicates, negations, normalize_for_dedup
+
+BASE = "Yo apoyo totalmente esta medida del gobierno porque ayuda a las familias"
+
+
+def test_disabled_by_default():
+    assert near_dup.NEAR_DUP_ENABLED is False
+
+
+def test_normalize():
+    assert normalize_for_dedup("¡¡Buenísimo!!! 😂😂😂 @ana https://t.co/x") == "buenisimo 😂"
+
+
+def test_noisy_copies_share_a_cluster():
+    texts = [BASE, BASE + "!!!", "@ana " + BASE.upper(), "Otro comentario que no tiene nada que ver con el resto"]
+    assert cluster_near_duplicates(texts) == [0, 0, 0, 3]
+
+
+def test_negation_keeps_texts_apart(monkeypatch):
+    negated = BASE.replace("Yo apoyo", "Yo no apoyo")
+    assert negations(normalize_for_dedup(negated)) == {"no"}
+    assert cluster_near_duplicates([BASE, negated]) == [0, 1]
+    # Con la misma negación sí se agrupan
+    assert cluster_near_duplicates([negated, negated + " !!"]) == [0, 0]
+    never = BASE.replace("Yo apoyo", "Yo nunca apoyo")
+    assert cluster_near_duplicates([negated, never]) == [0, 1]
+    # Sin la comprobación de negaciones la similitud sola los uniría
+    monkeypatch.setattr(near_dup, "NEAR_DUP_NEGATIONS", frozenset())
+    assert cluster_near_duplicates([BASE, negated]) == [0, 0]
+
+
+def test_short_texts_only_exact():
+    assert cluster_near_duplicates(["ok", "ok!", "oki"]) == [0, 0, 2]
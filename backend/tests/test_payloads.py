@@ -0,0 +1,110 @@
+"""
+Reproducción offline de los parsers del modo captura con payloads guardados
+(tests/fixtures, mismo formato que los que vuelca SCRAPER_CAPTURE_DUMP_DIR).
+"""
+import json
+import os
+
+from scrapers.payloads import (
+    IG_API_PATTERN, IG_COMMENT_QUERY_PATTERN, X_API_PATTERN, ResponseCapture, parse_ig_comments, parse_x_payload,
+    x_conversation,
+)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CONVERSATION_URL = "https://x.com/autor/status/200"
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeRequest:
+    def __init__(self, resource_type="xhr", headers=None, post_data=None):
+        self.resource_type = resource_type
+        self.headers = headers or {}
+        self.post_data = post_data
+
+
+class FakeResponse:
+    def __init__(self, url, payload, request=None):
+        self.url = url
+        self.request = request or FakeRequest()
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+def test_x_payload_tweets():
+    tweets = parse_x_payload(load("x_tweet_detail.json"))
+    by_id = {t["id"]: t for t in tweets}
+    # El tweet citado no es una fila de la conversación
+    assert "50" not in by_id
+    assert [t["id"] for t in tweets] == ["100", "200", "300", "400", "500", "600", "700"]
+    # Texto visible: sin la mención inicial, con entidades HTML resueltas
+    assert by_id["200"]["content"] == "Post principal de la conversación & más"
+    assert by_id["200"]["author"] == "@autor"
+    assert by_id["200"]["url"] == CONVERSATION_URL
+    assert by_id["600"]["author"] == "@dani"
+    # Tweets largos: el texto completo de note_tweet
+    assert by_id["700"]["content"].startswith("Respuesta larga muy muy")
+
+
+def test_x_conversation_only_descendants_of_focal():
+    convo = x_conversation(parse_x_payload(load("x_tweet_detail.json")), CONVERSATION_URL)
+    assert convo["post"]["author"] == "@autor"
+    authors = [r["author"] for r in convo["replies"]]
+    # Ni el hilo padre (100) ni la otra rama que responde al padre (500)
+    assert authors == ["@ana", "@beto", "@dani", "@eva"]
+
+
+def test_x_conversation_without_focal():
+    convo = x_conversation(parse_x_payload(load("x_search_timeline.json")), "https://x.com/autor/status/999")
+    assert convo == {"post": None, "replies": []}
+
+
+def test_ig_comments_graphql_ignores_caption_and_suggestions():
+    comments = parse_ig_comments(load("ig_comments_graphql.json"))
+    assert [(c["author"], c["content"]) for c in comments] == [
+        ("ana.ig", "Qué buena foto!"),
+        ("beto_ig", "No me gusta nada"),
+    ]
+
+
+def test_ig_comments_v1_with_child_comments():
+    comments = parse_ig_comments(load("ig_comments_v1.json"))
+    assert [c["author"] for c in comments] == ["carla.ig", "dani.ig", "ana.ig"]
+
+
+def test_ig_feed_payload_has_no_comments():
+    assert parse_ig_comments(load("ig_feed_graphql.json")) == []
+
+
+def test_capture_filters_graphql_queries():
+    capture = ResponseCapture(IG_API_PATTERN, IG_COMMENT_QUERY_PATTERN, doc_ids={"123"})
+    graphql = "https://www.instagram.com/graphql/query"
+    comments = load("ig_comments_graphql.json")
+    capture._on_response(FakeResponse(graphql, comments, FakeRequest(headers={"x-fb-friendly-name": "PolarisPostCommentsContainerQuery"})))
+    capture._on_response(FakeResponse(graphql, comments, FakeRequest(post_data="fb_api_req_friendly_name=PolarisPostCommentsPaginationQuery&doc_id=9")))
+    capture._on_response(FakeResponse(graphql, comments, FakeRequest(post_data="fb_api_req_friendly_name=Other&doc_id=123")))
+    capture._on_response(FakeResponse(graphql, load("ig_feed_graphql.json"), FakeRequest(headers={"x-fb-friendly-name": "PolarisFeedTimelineQuery"})))
+    capture._on_response(FakeResponse("https://www.instagram.com/api/v1/media/1/comments/", load("ig_comments_v1.json")))
+    capture._on_response(FakeResponse("https://www.instagram.com/api/v1/media/1/comments/", {}, FakeRequest(resource_type="image")))
+    assert capture.collect() == 4
+    assert [c["author"] for c in capture.ig_comments()] == ["ana.ig", "beto_ig", "carla.ig", "dani.ig"]
+
+
+def test_capture_parses_each_payload_once():
+    capture = ResponseCapture(X_API_PATTERN)
+    search = "https://x.com/i/api/graphql/abc/SearchTimeline?variables=%7B%7D"
+    capture._on_response(FakeResponse(search, load("x_search_timeline.json")))
+    capture.collect()
+    assert [t["id"] for t in capture.x_tweets()] == ["200", "800"]
+    parsed = capture._x_parsed
+    capture._on_response(FakeResponse("https://x.com/i/api/graphql/abc/TweetDetail", load("x_tweet_detail.json")))
+    capture.collect()
+    assert parsed == 1 and len(capture.payloads) == 2
+    assert [t["id"] for t in capture.x_tweets()] == ["200", "800", "100", "300", "400", "500", "600", "700"]
+    capture.reset()
+    assert capture.x_tweets() == []
@@ -0,0 +1,54 @@
+"""Construcción de los PromptItem y reparto de peticiones."""
+import pandas as pd
+import pytest
+
+from llm_processor import LLMProcessor
+from prompt_builder import build_items, plan_requests
+
+
+def test_long_comment_body_is_capped():
+    df = pd.DataFrame([
+        {"platform": "X", "post_index": 1, "post_content": "Post", "comment_content": "a" * 5000},
+        {"platform": "X", "post_index": 1, "post_content": "Post", "comment_content": "b" * 5000},
+    ])
+    items = build_items(df, max_chars=1000)
+    assert all(len(item.body) == 1000 for item in items)
+    assert items[0].text == "Comment: " + "a" * 1000
+    # El presupuesto de tokens del lote agrupado se respeta con comentarios largos
+    units = plan_requests(items, batch_size=20, token_budget=300)
+    assert [idxs for _, idxs in units] == [[0], [1]]
+
+
+def test_comments_grouped_under_their_post():
+    df = pd.DataFrame([
+        {"platform": "X", "post_index": 1, "post_content": "Post uno", "comment_content": "c1"},
+        {"platform": "X", "post_index": 1, "post_content": "Post uno", "comment_content": "c2"},
+        {"platform": "X", "post_index": 2, "post_content": "Post dos", "comment_content": "c3"},
+        {"platform": "X", "post_index": 3, "post_content": "Solo post", "comment_content": ""},
+    ])
+    items = build_items(df)
+    assert items[0].context == "Post uno" and items[0].body == "c1"
+    assert items[0].text == "Post: Post uno | Comment: c1"
+    units = plan_requests(items, batch_size=1, token_budget=4000)
+    # Los dos comentarios del post 1 van juntos con el post como contexto; el resto, sueltos
+    assert units == [("Post uno", [0, 1]), (None, [2]), (None, [3])]
+    assert plan_requests(items, batch_size=1, token_budget=4000, group_by_post=False) == [(None, [i]) for i in range(4)]
+
+
+ROWS = {
+    "post_only": [{"platform": "X", "post_index": 1, "post_content": "  Solo el post  ", "comment_content": ""}],
+    "comment": [{"platform": "Facebook", "post_index": 2, "post_content": "Post de contexto", "comment_content": "Gran idea"}],
+    "flat_content": [{"platform": "LinkedIn", "post_index": 3, "content": "Texto en la columna content"}],
+    "flat_shifted": [{"platform": "LinkedIn", "post_index": "nan", "content": "nan", "author": "Ana", "extra": "Fila desplazada"}],
+    "nan": [{"platform": float("nan"), "post_index": float("nan"), "post_content": float("nan"), "comment_content": None}],
+    "over_length": [{"platform": "X", "post_index": 4, "post_content": "p" * 3000, "comment_content": "c" * 3000}],
+    "long_post": [{"platform": "X", "post_index": 5, "post_content": "p" * 3000, "comment_content": "corto"}],
+}
+ROWS["mixed"] = [row for rows in ROWS.values() for row in rows]
+
+
+@pytest.mark.parametrize("case", sorted(ROWS))
+def test_build_items_matches_build_item(case):
+    df = pd.DataFrame(ROWS[case])
+    processor = LLMProcessor()
+    assert build_items(df) == [processor.build_item(row) for _, row in df.iterrows()]
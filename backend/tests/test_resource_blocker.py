@@ -0,0 +1,105 @@
+"""ResourceBlocker: qué se bloquea, qué rutas se instalan y el informe de red."""
+from scrapers.common import SCRAPER_AVG_BYTES, ResourceBlocker
+
+PROFILE = {"domains": ["x.com", "twimg.com"]}
+
+
+class FakeRequest:
+    def __init__(self, url, resource_type="xhr"):
+        self.url = url
+        self.resource_type = resource_type
+        self.frame = None
+
+    def is_navigation_request(self):
+        return False
+
+
+class FakeRoute:
+    def __init__(self, request):
+        self.request = request
+        self.action = None
+
+    def abort(self):
+        self.action = "abort"
+
+    def continue_(self):
+        self.action = "continue"
+
+
+class FakeResponse:
+    def __init__(self, request, size):
+        self.request = request
+        self.headers = {"content-length": str(size)}
+
+
+class FakeContext:
+    def __init__(self):
+        self.routes = []
+        self.handlers = {}
+        self.pages = []
+
+    def route(self, pattern, handler):
+        self.routes.append(pattern)
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+
+def test_should_block():
+    blocker = ResourceBlocker("twitter", enabled=True, profile=PROFILE)
+    assert blocker.should_block(FakeRequest("https://pbs.twimg.com/media/a.jpg", "image")) == "image"
+    assert blocker.should_block(FakeRequest("https://x.com/font.woff2", "font")) == "font"
+    assert blocker.should_block(FakeRequest("https://www.googletagmanager.com/gtm.js", "script")) == "third_party"
+    # La navegación principal y los recursos propios pasan aunque el host sea ajeno o sea un subdominio
+    assert blocker.should_block(FakeRequest("https://t.co/abc", "document")) is None
+    assert blocker.should_block(FakeRequest("https://api.x.com/graphql/TweetDetail", "xhr")) is None
+
+
+def test_allow_types_and_route_patterns():
+    blocker = ResourceBlocker("twitter", enabled=True, profile={**PROFILE, "allow_types": ["image"]})
+    assert blocker.should_block(FakeRequest("https://pbs.twimg.com/media/a.jpg", "image")) is None
+    ctx = FakeContext()
+    blocker.attach(ctx)
+    # Nunca se enruta todo el tráfico por Python
+    assert "**/*" not in ctx.routes
+    assert not any(".png" in p or "jpg" in p for p in ctx.routes)
+    assert any("woff2" in p for p in ctx.routes)
+    assert "**://*.doubleclick.net/**" in ctx.routes
+
+
+def test_disabled_only_measures():
+    ctx = FakeContext()
+    ResourceBlocker("twitter", enabled=False, profile=PROFILE).attach(ctx)
+    assert ctx.routes == []
+    assert {"request", "response", "page"} <= set(ctx.handlers)
+
+
+def test_handle_and_report():
+    blocker = ResourceBlocker("twitter", enabled=True, profile=PROFILE)
+    requests = [
+        FakeRequest("https://pbs.twimg.com/media/a.jpg", "image"),
+        FakeRequest("https://stats.g.doubleclick.net/px.gif", "image"),
+        FakeRequest("https://www.googletagmanager.com/gtm.js", "script"),
+        FakeRequest("https://x.com/i/api/graphql/x.svg", "xhr"),
+        FakeRequest("https://cdn.otro.com/widget.js", "script"),
+    ]
+    routes = []
+    for req in requests:
+        blocker._on_request(req)
+    # Las cuatro primeras casan con algún glob; la última no se enruta
+    for req in requests[:4]:
+        route = FakeRoute(req)
+        blocker._handle(route)
+        routes.append(route.action)
+    assert routes == ["abort", "abort", "abort", "continue"]
+    blocker._on_response(FakeResponse(requests[3], 1200))
+
+    rep = blocker.report()
+    assert rep["blocking"] is True
+    assert rep["requests_blocked"] == 3
+    assert rep["requests_allowed"] == 2
+    assert rep["blocked_by_reason"] == {"image": 2, "third_party": 1, "third_party:script": 1}
+    assert rep["third_party_requests"] == 3
+    assert rep["bytes_downloaded"] == 1200
+    assert rep["avg_bytes_by_type"] == {"xhr": 1200}
+    assert rep["bytes_saved_estimate"] == 2 * SCRAPER_AVG_BYTES["image"] + SCRAPER_AVG_BYTES["script"]
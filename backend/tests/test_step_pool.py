@@ -0,0 +1,107 @@
+"""StepPool con generadores falsos: orden de resultados, huecos, cierre y esperas."""
+import pytest
+
+import scrapers.common as common
+from scrapers.common import StepPool, run_steps
+
+
+@pytest.fixture(autouse=True)
+def no_start_interval(monkeypatch):
+    monkeypatch.setattr(common, "SCRAPER_TAB_START_INTERVAL", 0.0)
+
+
+class FakePage:
+    def __init__(self):
+        self.waits = []
+
+    def wait_for_timeout(self, ms):
+        self.waits.append(ms)
+
+
+def task(name, delays, log=None, closed=None):
+    try:
+        for d in delays:
+            if log is not None:
+                log.append(name)
+            yield d
+        return name
+    finally:
+        if closed is not None:
+            closed.append(name)
+
+
+def failing():
+    yield 0
+    raise RuntimeError("pestaña caída")
+
+
+def test_results_in_submission_order():
+    pool = StepPool(3)
+    # La primera tarea es la más lenta: su resultado sale igualmente el primero
+    pool.submit(task("a", [0.03, 0.03]))
+    pool.submit(task("b", [0]))
+    pool.submit(failing())
+    assert pool.drain() == ["a", "b", None]
+    assert pool.pending == 0 and pool.done == 3
+
+
+def test_steps_interleave_by_deadline():
+    log = []
+    pool = StepPool(2)
+    pool.submit(task("a", [0.02, 0], log))
+    pool.submit(task("b", [0, 0], log))
+    pool.drain()
+    # Mientras "a" espera, "b" avanza
+    assert log == ["a", "b", "b", "a"]
+
+
+def test_wait_for_slot_and_size_cap():
+    pool = StepPool(100)
+    assert pool.size == common.SCRAPER_MAX_TABS_PER_CONTEXT
+    pool = StepPool(2)
+    pool.submit(task("a", [0]))
+    pool.submit(task("b", [0, 0, 0]))
+    assert pool.full()
+    ready = pool.wait_for_slot()
+    assert not pool.full()
+    assert ready == ["a"]
+    assert pool.pending == 1
+
+
+def test_done_counts_undelivered():
+    pool = StepPool(2)
+    pool.submit(task("lenta", [0.05]))
+    pool.submit(task("rápida", []))
+    # "rápida" termina pero no se entrega hasta que termine "lenta"
+    assert pool.wait(0.01) == []
+    assert pool.done == 1 and pool.pending == 2
+
+
+def test_close_aborts_running_tasks():
+    closed = []
+    pool = StepPool(2)
+    pool.submit(task("a", [0], closed=closed))
+    pool.submit(task("b", [10, 10], closed=closed))
+    delivered = pool.wait_for_slot() + pool.wait(0.01)
+    assert delivered == ["a"]
+    # Lo que seguía en curso se entrega como fallido
+    assert pool.close() == [None]
+    assert sorted(closed) == ["a", "b"]
+    assert pool.pending == 0
+
+
+def test_idles_through_page():
+    page = FakePage()
+    pool = StepPool(1, page=page)
+    pool.submit(task("a", [0.02]))
+    assert pool.drain() == ["a"]
+    assert page.waits and all(ms > 0 for ms in page.waits)
+    page.waits.clear()
+    pool.wait(0.01) # Sin tareas: la espera también pasa por la página
+    assert len(page.waits) == 1
+
+
+def test_run_steps_idles_through_page():
+    page = FakePage()
+    assert run_steps(task("a", [0.01, 0, 0.02]), page) == "a"
+    assert page.waits == [10, 20]
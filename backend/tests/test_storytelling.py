@@ -0,0 +1,101 @@
+"""Storytelling memoizado (story_cache_key) y publicado en streaming."""
+from types import SimpleNamespace
+
+import pytest
+
+import llm_processor
+from llm_processor import LLMProcessor, story_cache_key
+
+STATS = {"global": {"Positivo": 10, "Negativo": 5}, "by_platform": {"x": {"Positivo": 10, "Negativo": 5}}}
+
+
+class FakeDB:
+    is_connected = True
+
+    def __init__(self, stories=None):
+        self.stories = dict(stories or {})
+        self.streams = []
+
+    def get_story_cache(self, key):
+        return self.stories.get(key)
+
+    def save_story_cache(self, key, topic, story):
+        self.stories[key] = story
+
+    def update_story_stream(self, topic, text, done=False):
+        self.streams.append((text, done))
+
+
+class FakeSyncClient:
+    """Cliente síncrono de OpenAI: devuelve el informe entero o en fragmentos si stream=True."""
+
+    def __init__(self, parts=("Informe ", "del ", "tema."), error=None):
+        self.parts = parts
+        self.error = error
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature=0, max_tokens=None, stream=False):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        if stream:
+            return iter(SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))]) for p in self.parts)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="".join(self.parts)))])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeSyncClient()
+    monkeypatch.setattr(llm_processor, "LLM_ENDPOINTS", [])
+    monkeypatch.setattr(llm_processor, "_story_memory", {})
+    monkeypatch.setattr(llm_processor, "STORY_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm_processor, "get_sync_client", lambda base_url, api_key: fake)
+    return fake
+
+
+def processor():
+    return LLMProcessor(base_url="http://llm.test/v1", api_key="k")
+
+
+def test_story_key_ignores_dict_order():
+    reordered = {"by_platform": STATS["by_platform"], "global": {"Negativo": 5, "Positivo": 10}}
+    assert story_cache_key("tema", STATS) == story_cache_key("tema", reordered)
+    assert story_cache_key("tema", STATS) != story_cache_key("otro", STATS)
+    assert story_cache_key("tema", STATS) != story_cache_key("tema", {**STATS, "global": {"Positivo": 11}})
+
+
+def test_story_is_memoized(client):
+    assert processor().generate_storytelling("tema", STATS, stream=False) == "Informe del tema."
+    assert processor().generate_storytelling("tema", STATS, stream=False) == "Informe del tema."
+    assert client.calls == 1
+    processor().generate_storytelling("tema", {**STATS, "global": {"Positivo": 11}}, stream=False)
+    assert client.calls == 2
+
+
+def test_story_reused_from_db(client):
+    db = FakeDB({story_cache_key("tema", STATS): "Informe guardado."})
+    seen = []
+    assert processor().generate_storytelling("tema", STATS, db=db, on_text=seen.append) == "Informe guardado."
+    assert client.calls == 0
+    assert seen == ["Informe guardado."] and db.streams == [("Informe guardado.", True)]
+
+
+def test_story_streams_partial_text(client, monkeypatch):
+    monkeypatch.setattr(llm_processor, "STORY_STREAM_FLUSH_SECONDS", 0)
+    db = FakeDB()
+    seen = []
+    story = processor().generate_storytelling("tema", STATS, db=db, stream=True, on_text=seen.append)
+    assert story == "Informe del tema."
+    assert seen == ["Informe ", "Informe del ", "Informe del tema.", "Informe del tema."]
+    # Primero se vacía el informe anterior y al final queda marcado como terminado
+    assert db.streams[0] == ("", False) and db.streams[-1] == (story, True)
+    assert db.stories == {story_cache_key("tema", STATS): story}
+
+
+def test_failed_story_is_not_cached(client):
+    client.error = RuntimeError("sin conexión")
+    db = FakeDB()
+    assert processor().generate_storytelling("tema", STATS, db=db, stream=False).startswith("No se pudo generar")
+    assert db.stories == {} and llm_processor._story_memory == {}
+    assert db.streams[-1][1] is True